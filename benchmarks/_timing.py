@@ -0,0 +1,18 @@
+"""Timing helpers shared by the standalone benchmark runners."""
+
+from __future__ import annotations
+
+import timeit
+import typing as t
+
+
+def timed(func: t.Callable[[], t.Any], repeat: int = 5) -> float:
+    """Return the best time per call of `func`, in seconds."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def report(label: str, seconds: float) -> None:
+    """Print a single benchmark result."""
+    print(f"{label:<50} {seconds * 1e6:>12.2f}us")
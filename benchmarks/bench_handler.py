@@ -0,0 +1,70 @@
+"""Measure the per request overhead of ExceptionHandler.__call__.
+
+Run this benchmark:
+$ python benchmarks/bench_handler.py
+"""
+
+from __future__ import annotations
+
+import pytest
+from _timing import report, timed
+from fastapi.exceptions import RequestValidationError
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+
+from fastapi_problem.error import NotFoundProblem
+from fastapi_problem.handler import EXCEPTION_GROUP, new_exception_handler
+
+
+class UserNotFoundError(NotFoundProblem):
+    title = "User not found."
+
+
+def make_request(headers: list[tuple[bytes, bytes]] | None = None) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/users/1",
+        "headers": headers or [],
+        "query_string": b"",
+    })
+
+
+def make_validation_error(count: int = 10) -> RequestValidationError:
+    return RequestValidationError([
+        {"type": "missing", "loc": ("body", i, "name"), "msg": "Field required", "input": {"id": i}}
+        for i in range(count)
+    ])
+
+
+EXCEPTIONS = {
+    "known problem": lambda: UserNotFoundError("User 1 does not exist."),
+    "unhandled exception": lambda: RuntimeError("Something went wrong."),
+    "http exception": lambda: HTTPException(404),
+    "request validation error": make_validation_error,
+}
+
+if EXCEPTION_GROUP is not None:
+    exception_group = EXCEPTION_GROUP
+    EXCEPTIONS["exception group (100)"] = lambda: exception_group(
+        "batch",
+        [UserNotFoundError(f"User {i} does not exist.") for i in range(100)],
+    )
+
+
+@pytest.mark.parametrize("name", list(EXCEPTIONS))
+def test_exception_handler(benchmark, name):
+    eh = new_exception_handler()
+    benchmark(eh, make_request(), EXCEPTIONS[name]())
+
+
+def main() -> None:
+    eh = new_exception_handler()
+    request = make_request()
+    for name, factory in EXCEPTIONS.items():
+        exc = factory()
+        report(f"ExceptionHandler.__call__ ({name})", timed(lambda exc=exc: eh(request, exc)))
+
+
+if __name__ == "__main__":
+    main()
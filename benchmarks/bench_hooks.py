@@ -0,0 +1,81 @@
+"""Measure the cost of the builtin post hooks.
+
+Run this benchmark:
+$ python benchmarks/bench_hooks.py
+"""
+
+from __future__ import annotations
+
+import typing as t
+
+import pytest
+from _timing import report, timed
+from bench_handler import make_request
+from starlette.responses import JSONResponse
+
+from fastapi_problem.cors import CorsConfiguration
+from fastapi_problem.handler import CorsPostHook, StripExtrasPostHook
+
+CONTENT = {
+    "type": "user-not-found",
+    "title": "User not found.",
+    "status": 404,
+    "detail": "User 1 does not exist.",
+    "user_id": 1,
+}
+
+CORS = {
+    "allow all": CorsConfiguration(
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        allow_credentials=True,
+    ),
+    "200 origins": CorsConfiguration(
+        allow_origins=[f"https://{i}.example.com" for i in range(200)],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        allow_credentials=True,
+    ),
+    "200 origins + regexes": CorsConfiguration(
+        allow_origins=[f"https://{i}.example.com" for i in range(200)],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        allow_credentials=True,
+        allow_origin_regex=[rf"https://.*\.tenant{i}\.example\.org" for i in range(20)],
+    ),
+}
+
+HOOKS: dict[str, t.Callable[[], t.Any]] = {
+    **{f"CorsPostHook ({name})": lambda config=config: CorsPostHook(config) for name, config in CORS.items()},
+    "StripExtrasPostHook (disabled)": StripExtrasPostHook,
+    "StripExtrasPostHook (enabled)": lambda: StripExtrasPostHook(enabled=True),
+}
+
+
+def make_response() -> JSONResponse:
+    return JSONResponse(CONTENT, status_code=404)
+
+
+def run(hook: t.Callable[..., t.Any], request: t.Any) -> t.Any:
+    # Hooks mutate the response, so a fresh one is required for each call.
+    return hook(CONTENT, request, make_response())
+
+
+@pytest.mark.parametrize("name", list(HOOKS))
+def test_post_hook(benchmark, name):
+    request = make_request([(b"origin", b"https://199.example.com"), (b"cookie", b"session=1")])
+    benchmark(run, HOOKS[name](), request)
+
+
+def main() -> None:
+    request = make_request([(b"origin", b"https://199.example.com"), (b"cookie", b"session=1")])
+    baseline = timed(make_response)
+    report("response construction (baseline)", baseline)
+    for name, factory in HOOKS.items():
+        hook = factory()
+        report(name, timed(lambda hook=hook: run(hook, request)) - baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Measure the import time of fastapi_problem modules with `-X importtime`.
+
+fastapi is imported first, as any app using fastapi_problem will already have
+paid for it, so only the cost added by fastapi_problem is reported. Bytecode
+is cached in a temporary directory, so compilation is not included.
+
+Run this benchmark:
+$ python benchmarks/bench_import.py
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+from _timing import report
+
+MODULES = ["fastapi_problem.error", "fastapi_problem.handler", "fastapi_problem.openapi"]
+PRELOAD = "fastapi"
+
+
+@functools.cache
+def pycache_env() -> dict[str, str]:
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    env["PYTHONPYCACHEPREFIX"] = tempfile.mkdtemp(prefix="fastapi-problem-pycache-")
+    return env
+
+
+def import_times(module: str, preload: str = PRELOAD) -> dict[str, tuple[int, int]]:
+    """Import module in a fresh interpreter, returning self and cumulative time in us per module."""
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", f"import {preload}; import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=pycache_env(),
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def cumulative(module: str, repeat: int = 5) -> float:
+    """Best cumulative import time of module, in seconds."""
+    import_times(module)  # Warm the bytecode cache.
+    return min(import_times(module)[module][1] for _ in range(repeat)) / 1e6
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import(benchmark, module):
+    import_times(module)  # Warm the bytecode cache.
+    benchmark(import_times, module)
+
+
+def main() -> None:
+    import_times(PRELOAD)  # Warm the bytecode cache.
+    for module in MODULES:
+        report(f"import {module}", cumulative(module))
+
+    times = import_times("fastapi_problem.handler")
+    preloaded = import_times(PRELOAD)
+    added = sorted(
+        ((name, self_us) for name, (self_us, _) in times.items() if name not in preloaded),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    print("\nSlowest modules imported by fastapi_problem.handler (self time):")
+    for name, self_us in added[:10]:
+        report(f"  {name}", self_us / 1e6)
+
+
+if __name__ == "__main__":
+    main()
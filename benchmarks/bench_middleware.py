@@ -0,0 +1,114 @@
+"""Compare registering exception handlers against ProblemMiddleware.
+
+Requests are sent straight to the ASGI app, so the times include starlette's
+middleware and routing, but not a server.
+
+Run this benchmark:
+$ python benchmarks/bench_middleware.py
+"""
+
+from __future__ import annotations
+
+import contextlib
+import typing as t
+
+import anyio
+import pytest
+from _timing import report, timed
+from fastapi import FastAPI
+
+from fastapi_problem.error import NotFoundProblem
+from fastapi_problem.handler import add_exception_handler, new_exception_handler
+
+if t.TYPE_CHECKING:
+    from starlette.types import Message
+
+# Requests sent per event loop, to amortise starting the loop.
+BATCH = 100
+
+
+class UserNotFoundError(NotFoundProblem):
+    title = "User not found."
+
+
+def make_app(**kwargs: t.Any) -> FastAPI:
+    app = FastAPI()
+    add_exception_handler(app, new_exception_handler(), **kwargs)
+
+    @app.get("/problem")
+    def problem() -> None:
+        msg = "User 1 does not exist."
+        raise UserNotFoundError(msg)
+
+    @app.get("/unhandled")
+    def unhandled() -> None:
+        msg = "Something went wrong."
+        raise RuntimeError(msg)
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int) -> int:
+        return item_id
+
+    return app
+
+
+MODES = {
+    "exception handlers": make_app,
+    "middleware": lambda: make_app(middleware=True),
+}
+
+PATHS = {
+    "known problem": "/problem",
+    "unhandled exception": "/unhandled",
+    "http exception": "/missing",
+    "request validation error": "/items/a",
+}
+
+
+async def send_requests(app: FastAPI, path: str, count: int) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"testserver")],
+        "server": ("testserver", 80),
+        "client": ("testclient", 50000),
+    }
+
+    async def receive() -> Message:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Message) -> None:
+        pass
+
+    for _ in range(count):
+        # Both modes re-raise unhandled exceptions to the server.
+        with contextlib.suppress(RuntimeError):
+            await app(dict(scope), receive, send)
+
+
+def run(app: FastAPI, path: str, count: int = BATCH) -> None:
+    anyio.run(send_requests, app, path, count)
+
+
+@pytest.mark.parametrize("mode", list(MODES))
+@pytest.mark.parametrize("name", list(PATHS))
+def test_problem_response(benchmark, mode, name):
+    benchmark(run, MODES[mode](), PATHS[name])
+
+
+def main() -> None:
+    for mode, factory in MODES.items():
+        app = factory()
+        for name, path in PATHS.items():
+            report(f"{mode} ({name})", timed(lambda app=app, path=path: run(app, path)) / BATCH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Measure customise_openapi post-processing for apps of different sizes.
+
+The FastAPI schema is generated once, for a single route, and replicated to
+the required number of routes, so only the problem post-processing is timed.
+
+Plugin style startup, where routers are included one at a time and the schema
+is requested after each, is measured with and without incremental mode.
+
+Run this benchmark:
+$ python benchmarks/bench_openapi.py
+"""
+
+from __future__ import annotations
+
+import copy
+import typing as t
+
+import pytest
+from _timing import report, timed
+from fastapi import APIRouter, FastAPI
+
+from fastapi_problem.openapi import customise_openapi
+
+ROUTES = [10, 1_000, 10_000]
+ROUTERS = 20
+
+
+def make_schema(routes: int) -> dict[str, t.Any]:
+    app = FastAPI()
+
+    @app.get("/users/{user_id}")
+    async def user(user_id: int, q: str | None = None) -> dict:
+        return {"user_id": user_id, "q": q}
+
+    schema = app.openapi()
+    path = schema["paths"].pop("/users/{user_id}")
+    for i in range(routes):
+        schema["paths"][f"/users{i}/{{user_id}}"] = copy.deepcopy(path)
+    return schema
+
+
+def make_router(prefix: str, routes: int = 10) -> APIRouter:
+    router = APIRouter(prefix=prefix)
+    for i in range(routes):
+
+        @router.get(f"/users{i}/{{user_id}}")
+        async def user(user_id: int, q: str | None = None) -> dict:
+            return {"user_id": user_id, "q": q}
+
+    return router
+
+
+def plugin_startup(*, incremental: bool) -> None:
+    app = FastAPI()
+    app.openapi = t.cast("t.Any", customise_openapi(app.openapi, incremental=incremental))
+    for i in range(ROUTERS):
+        app.include_router(make_router(f"/plugin{i}"))
+        app.openapi()
+
+
+@pytest.mark.parametrize("routes", ROUTES)
+@pytest.mark.parametrize("cache", [False, True])
+def test_customise_openapi(benchmark, routes, cache):
+    schema = make_schema(routes)
+    benchmark(customise_openapi(lambda: schema, cache=cache))
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_plugin_startup(benchmark, incremental):
+    benchmark(plugin_startup, incremental=incremental)
+
+
+def main() -> None:
+    for routes in ROUTES:
+        schema = make_schema(routes)
+        for cache in (False, True):
+            wrapper = customise_openapi(lambda schema=schema: schema, cache=cache)
+            report(f"customise_openapi ({routes} routes, cache={cache})", timed(wrapper))
+    for incremental in (False, True):
+        report(
+            f"{ROUTERS} routers startup (incremental={incremental})",
+            timed(lambda incremental=incremental: plugin_startup(incremental=incremental), repeat=3),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Compare request validation error sanitising against a json round trip.
+
+Run this benchmark:
+$ python benchmarks/bench_validation.py
+"""
+
+from __future__ import annotations
+
+import decimal
+import json
+import typing as t
+
+import pytest
+from _timing import timed
+
+from fastapi_problem.handler import _jsonable
+
+
+def make_errors(count: int) -> list[dict[str, t.Any]]:
+    """Generate a list of pydantic style validation errors."""
+    errors = []
+    for i in range(count):
+        errors.append({
+            "type": "missing",
+            "loc": ("body", i, "name"),
+            "msg": "Field required",
+            "input": {"id": i, "amount": decimal.Decimal("1.5")},
+        })
+        errors.append({
+            "type": "value_error",
+            "loc": ("body", i, "payload"),
+            "msg": "Value error, invalid payload",
+            "input": b"\x00\x01",
+            "ctx": {"error": ValueError("invalid payload")},
+        })
+    return errors[:count]
+
+
+def round_trip(errors: list[dict[str, t.Any]]) -> t.Any:
+    return json.loads(json.dumps(errors, default=str))
+
+
+@pytest.mark.parametrize("count", [10, 100, 10_000])
+def test_round_trip(benchmark, count):
+    benchmark(round_trip, make_errors(count))
+
+
+@pytest.mark.parametrize("count", [10, 100, 10_000])
+def test_sanitise(benchmark, count):
+    benchmark(_jsonable, make_errors(count))
+
+
+def main() -> None:
+    print(f"{'errors':>8} {'round trip':>14} {'sanitise':>14} {'speedup':>8}")
+    for count in (10, 100, 10_000):
+        errors = make_errors(count)
+        baseline = timed(lambda errors=errors: round_trip(errors))
+        sanitised = timed(lambda errors=errors: _jsonable(errors))
+        print(f"{count:>8} {baseline * 1e6:>12.1f}us {sanitised * 1e6:>12.1f}us {baseline / sanitised:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
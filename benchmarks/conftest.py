@@ -0,0 +1,28 @@
+"""Run the benchmarks with pytest.
+
+With pytest-benchmark installed the `benchmark` fixture records timings, without
+it the benchmarks are executed once as smoke tests.
+
+$ pytest benchmarks --benchmark-only
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import typing as t
+
+import pytest
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    config.addinivalue_line("python_files", "bench_*.py")
+
+
+if importlib.util.find_spec("pytest_benchmark") is None:
+
+    @pytest.fixture
+    def benchmark() -> t.Callable[..., t.Any]:
+        def run(func: t.Callable[..., t.Any], *args: t.Any, **kwargs: t.Any) -> t.Any:
+            return func(*args, **kwargs)
+
+        return run
@@ -0,0 +1,23 @@
+"""Run every benchmark as a standalone script.
+
+$ python benchmarks/run.py
+"""
+
+from __future__ import annotations
+
+import bench_handler
+import bench_hooks
+import bench_import
+import bench_middleware
+import bench_openapi
+import bench_validation
+
+
+def main() -> None:
+    for module in (bench_handler, bench_hooks, bench_import, bench_middleware, bench_openapi, bench_validation):
+        print(f"\n# {module.__name__}")
+        module.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Response body compression helpers.
+
+gzip is always available, brotli is used when the `brotli` package is
+installed.
+
+`CompressionPostHook` compresses large problem responses, which are built by
+the exception handler, and are not always passed through compression
+middleware.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import gzip
+import importlib
+import typing as t
+
+from fastapi_problem.util import parse_quality_values
+
+if t.TYPE_CHECKING:
+    from starlette.requests import Request
+    from starlette.responses import Response
+
+Compressor = t.Callable[[bytes], bytes]
+
+
+def _gzip(body: bytes) -> bytes:
+    # Fixed mtime so the same body always compresses to the same bytes.
+    return gzip.compress(body, mtime=0)
+
+
+def _load_compressors() -> dict[str, Compressor]:
+    compressors: dict[str, Compressor] = {}
+    with contextlib.suppress(ImportError):
+        compressors["br"] = importlib.import_module("brotli").compress
+    compressors["gzip"] = _gzip
+    return compressors
+
+
+# Available encodings, in order of preference.
+COMPRESSORS = _load_compressors()
+
+
+def available_encodings() -> tuple[str, ...]:
+    return tuple(COMPRESSORS)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    return COMPRESSORS[encoding](body)
+
+
+def negotiate(accept_encoding: str, encodings: t.Sequence[str]) -> str | None:
+    """Select the preferred encoding accepted by the client.
+
+    Encodings are picked by quality value, ties are broken by the order of
+    `encodings`. Returns None if no compression should be used.
+    """
+    qualities = parse_quality_values(accept_encoding)
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+# Smallest body, in bytes, that CompressionPostHook compresses.
+MINIMUM_SIZE = 1024
+
+
+class CompressionPostHook:
+    """Compress problem responses larger than `minimum_size`.
+
+    The encoding is negotiated from the request's Accept-Encoding header,
+    preferring brotli when installed, then gzip. Responses that could be
+    compressed vary on Accept-Encoding. This should be the last post hook, so
+    the compressed body is not replaced.
+    """
+
+    def __init__(self, minimum_size: int = MINIMUM_SIZE, encodings: t.Sequence[str] | None = None) -> None:
+        self.minimum_size = minimum_size
+        self.encodings = tuple(encoding for encoding in (encodings or available_encodings()) if encoding in COMPRESSORS)
+
+    def __call__(self, content: dict, request: Request, response: Response) -> tuple[dict, Response]:
+        if len(response.body) < self.minimum_size or "content-encoding" in response.headers:
+            return content, response
+
+        response.headers.add_vary_header("Accept-Encoding")
+        encoding = negotiate(request.headers.get("accept-encoding", ""), self.encodings)
+        if encoding is not None:
+            response.body = compress(bytes(response.body), encoding)
+            response.headers["content-encoding"] = encoding
+            response.headers["content-length"] = str(len(response.body))
+
+        return content, response
+
+
+__all__ = [
+    "COMPRESSORS",
+    "MINIMUM_SIZE",
+    "CompressionPostHook",
+    "Compressor",
+    "available_encodings",
+    "compress",
+    "negotiate",
+]
@@ -1,3 +1,110 @@
-from starlette_problem.cors import CorsConfiguration
+from __future__ import annotations
 
-__all__ = ["CorsConfiguration"]
+import dataclasses
+import functools
+import re
+import typing as t
+
+from starlette_problem.cors import CorsConfiguration as BaseCorsConfiguration
+
+if t.TYPE_CHECKING:
+    from starlette.requests import Request
+    from starlette.responses import Response
+
+# Number of distinct origins to cache computed headers for.
+CORS_CACHE_SIZE = 1024
+
+_CORS_HEADERS = frozenset({b"access-control-allow-origin", b"access-control-allow-credentials"})
+
+
+@dataclasses.dataclass
+class CorsConfiguration(BaseCorsConfiguration):
+    allow_origin_regex: str | list[str] | None = None
+
+
+def _compile_origin_regex(patterns: str | list[str] | None) -> re.Pattern[str] | None:
+    """Combine origin patterns into a single regex."""
+    if not patterns:
+        return None
+    if isinstance(patterns, str):
+        return re.compile(patterns)
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+class CorsPostHook:
+    """Set CORS headers on problem responses.
+
+    Since the CORSMiddleware is not executed when an unhandled server exception
+    occurs, the CORS headers are set here to allow the frontend to receive the
+    problem response, rather than a CORS error.
+
+    The configuration is compiled once, and the encoded headers for each origin
+    are cached and appended to the response's raw headers, changes to `config`
+    after construction are not applied.
+    """
+
+    def __init__(self, config: BaseCorsConfiguration, cache_size: int = CORS_CACHE_SIZE) -> None:
+        self.config = config
+        self.allow_all_origins = "*" in config.allow_origins
+        self.allow_origins = frozenset(config.allow_origins)
+        self.allow_origin_regex = _compile_origin_regex(getattr(config, "allow_origin_regex", None))
+
+        # Matches starlette's CORSMiddleware.simple_headers
+        simple_headers = []
+        if self.allow_all_origins:
+            simple_headers.append(("Access-Control-Allow-Origin", "*"))
+        if config.allow_credentials:
+            simple_headers.append(("Access-Control-Allow-Credentials", "true"))
+        self.simple_headers = tuple(simple_headers)
+
+        self._headers = functools.lru_cache(maxsize=cache_size)(self._compute_headers)
+
+    def is_allowed_origin(self, origin: str) -> bool:
+        if self.allow_all_origins:
+            return True
+
+        if self.allow_origin_regex is not None and self.allow_origin_regex.fullmatch(origin):
+            return True
+
+        return origin in self.allow_origins
+
+    def _compute_headers(self, origin: str, has_cookie: bool) -> tuple[tuple[tuple[bytes, bytes], ...], bool]:  # noqa: FBT001
+        """Return the encoded headers to set for an origin, and whether to vary on Origin."""
+        headers = dict(self.simple_headers)
+        vary = False
+
+        # If request includes any cookie headers, then we must respond
+        # with the specific origin instead of "*".
+        if self.allow_all_origins and has_cookie:
+            headers["Access-Control-Allow-Origin"] = origin
+
+        # If we only allow specific origins, then we have to mirror back
+        # the Origin header in the response.
+        elif not self.allow_all_origins and self.is_allowed_origin(origin):
+            headers["Access-Control-Allow-Origin"] = origin
+            vary = True
+
+        return tuple((key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()), vary
+
+    def __call__(self, content: dict, request: Request, response: Response) -> tuple[dict, Response]:
+        origin = request.headers.get("origin")
+
+        if origin:
+            headers, vary = self._headers(origin, "cookie" in request.headers)
+            raw = response.raw_headers
+            names = {name for name, _ in raw}
+            if names.isdisjoint(_CORS_HEADERS):
+                raw.extend(headers)
+            else:
+                for key, value in headers:
+                    response.headers[key.decode("latin-1")] = value.decode("latin-1")
+            if vary:
+                if b"vary" in names:
+                    response.headers.add_vary_header("Origin")
+                else:
+                    raw.append((b"vary", b"Origin"))
+
+        return content, response
+
+
+__all__ = ["CORS_CACHE_SIZE", "CorsConfiguration", "CorsPostHook"]
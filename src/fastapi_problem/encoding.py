@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import importlib
+import json
+import typing as t
+from warnings import warn
+
+from fastapi_problem.util import parse_quality_values
+
+Encoder = t.Callable[[t.Any], bytes]
+
+# Supported optional encoders, mapped to the module and function to use.
+ENCODERS = {
+    "orjson": ("orjson", "dumps"),
+    "msgspec": ("msgspec.json", "encode"),
+}
+
+PROBLEM_JSON = "application/problem+json"
+
+# Optional encoders for alternative media types.
+MEDIA_ENCODERS = {
+    "msgpack": ("msgpack", "packb"),
+    "cbor2": ("cbor2", "dumps"),
+}
+
+
+def json_encoder(content: t.Any) -> bytes:  # noqa: ANN401
+    """Encode content using the stdlib, matching starlette's JSONResponse."""
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def resolve_encoder(encoder: Encoder | str | None) -> Encoder:
+    """Resolve an encoder, falling back to the stdlib.
+
+    `encoder` can be a `dumps` style callable returning bytes, or the name of a
+    supported optional encoder (`orjson`, `msgspec`). If the named encoder is
+    not installed a warning is raised and the stdlib encoder is used.
+    """
+    if encoder is None:
+        return json_encoder
+
+    if not isinstance(encoder, str):
+        return encoder
+
+    if encoder not in ENCODERS:
+        msg = f"Unknown encoder '{encoder}', expected one of {sorted(ENCODERS)}."
+        raise ValueError(msg)
+
+    module, attr = ENCODERS[encoder]
+    try:
+        return getattr(importlib.import_module(module), attr)
+    except ImportError:
+        warn(
+            f"Encoder '{encoder}' is not installed, falling back to json.",
+            RuntimeWarning,
+            stacklevel=3,
+        )
+        return json_encoder
+
+
+def resolve_media_encoders(media_types: t.Mapping[str, Encoder | str] | None) -> dict[str, Encoder]:
+    """Resolve encoders for alternative media types.
+
+    Encoders can be a callable, or the name of a supported optional encoder
+    (`msgpack`, `cbor2`, `orjson`, `msgspec`). Media types whose named encoder
+    is not installed are dropped with a warning, leaving those clients with
+    `application/problem+json`.
+    """
+    resolved = {}
+    for media_type, encoder in (media_types or {}).items():
+        if not isinstance(encoder, str):
+            resolved[media_type] = encoder
+            continue
+
+        registry = {**ENCODERS, **MEDIA_ENCODERS}
+        if encoder not in registry:
+            msg = f"Unknown encoder '{encoder}', expected one of {sorted(registry)}."
+            raise ValueError(msg)
+
+        module, attr = registry[encoder]
+        try:
+            resolved[media_type] = getattr(importlib.import_module(module), attr)
+        except ImportError:
+            warn(
+                f"Encoder '{encoder}' is not installed, '{media_type}' will not be offered.",
+                RuntimeWarning,
+                stacklevel=3,
+            )
+    return resolved
+
+
+def negotiate_media_type(accept: str, media_types: t.Sequence[str]) -> str | None:
+    """Select the preferred media type accepted by the client.
+
+    The most specific matching media range in `accept` sets the quality of
+    each media type, ties are broken by the order of `media_types`. Returns
+    None if none are acceptable.
+    """
+    qualities = parse_quality_values(accept)
+    best, best_quality = None, 0.0
+    for media_type in media_types:
+        type_ = media_type.partition("/")[0]
+        quality = qualities.get(media_type, qualities.get(f"{type_}/*", qualities.get("*/*", 0.0)))
+        if quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+__all__ = [
+    "MEDIA_ENCODERS",
+    "PROBLEM_JSON",
+    "Encoder",
+    "json_encoder",
+    "negotiate_media_type",
+    "resolve_encoder",
+    "resolve_media_encoders",
+]
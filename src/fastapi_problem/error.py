@@ -3,6 +3,11 @@
 https://www.rfc-editor.org/rfc/rfc9457.html
 """
 
+from __future__ import annotations
+
+import http
+import typing as t
+
 from rfc9457 import (
     BadRequestProblem,
     ConflictProblem,
@@ -16,7 +21,45 @@ from rfc9457 import (
     UnprocessableProblem,
 )
 
+
+class AggregateProblem(Problem):
+    """A problem made up of several sub problems, such as a partially failed batch.
+
+    Sub problems are rendered in an `errors` list. If no status is provided, the
+    status shared by all sub problems is used, falling back to 500 if any sub
+    problem is a server error, or 400 otherwise.
+    """
+
+    def __init__(
+        self,
+        title: str = "Multiple problems occurred.",
+        problems: t.Iterable[Problem] = (),
+        *,
+        status: int | None = None,
+        **kwargs: t.Any,  # noqa: ANN401
+    ) -> None:
+        self.problems = list(problems)
+        if status is None:
+            status = _aggregate_status(self.problems)
+        super().__init__(title, status=status, **kwargs)
+
+    def marshal(self, *, uri: str = "", strict: bool = False) -> dict[str, t.Any]:
+        content = super().marshal(uri=uri, strict=strict)
+        content["errors"] = [problem.marshal(uri=uri, strict=strict) for problem in self.problems]
+        return content
+
+
+def _aggregate_status(problems: list[Problem]) -> int:
+    statuses = {problem.status for problem in problems}
+    if len(statuses) == 1:
+        return statuses.pop()
+    if any(status >= http.HTTPStatus.INTERNAL_SERVER_ERROR for status in statuses):
+        return http.HTTPStatus.INTERNAL_SERVER_ERROR
+    return http.HTTPStatus.BAD_REQUEST
+
+
 __all__ = [
+    "AggregateProblem",
     "BadRequestProblem",
     "ConflictProblem",
     "ForbiddenProblem",
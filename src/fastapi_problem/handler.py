@@ -1,148 +1,705 @@
 from __future__ import annotations
 
+import builtins
+import collections
+import contextlib
+import dataclasses
+import functools
+import http
+import importlib
+import inspect
 import json
+import time
 import typing as t
-from http.client import responses
 from warnings import warn
 
+import anyio
 import rfc9457
 from fastapi.exceptions import RequestValidationError
-from rfc9457.openapi import problem_component, problem_response
+from starlette.concurrency import run_in_threadpool
 from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette_problem.handler import ExceptionHandler as BaseExceptionHandler
 from starlette_problem.handler import (
-    CorsPostHook,
     Handler,
     PostHook,
     PreHook,
     StripExtrasPostHook,
     http_exception_handler_,
 )
-from starlette_problem.handler import ExceptionHandler as BaseExceptionHandler
 
-from fastapi_problem.error import Problem, StatusProblem
+from fastapi_problem.cors import CorsPostHook
+from fastapi_problem.encoding import (
+    PROBLEM_JSON,
+    Encoder,
+    negotiate_media_type,
+    resolve_encoder,
+    resolve_media_encoders,
+)
+from fastapi_problem.error import AggregateProblem, Problem, StatusProblem
+from fastapi_problem.reporting import LogReporter
+from fastapi_problem.util import add_background_task
 
 if t.TYPE_CHECKING:
     import logging
 
     from fastapi import FastAPI
     from starlette.requests import Request
+    from starlette.responses import Response
 
     from fastapi_problem.cors import CorsConfiguration
+    from fastapi_problem.metrics import Metrics
+    from fastapi_problem.profiling import Profiler
+    from fastapi_problem.reporting import Reporter
 
 
-def _generate_swagger_response(
-    *exceptions: type[Problem] | Problem,
-    documentation_uri_template: str = "",
-    strict: bool = False,
-) -> dict:
-    examples = []
-    for e in exceptions:
-        exc = e("Additional error context.") if not isinstance(e, Problem) else e
-        examples.append(exc.marshal(uri=documentation_uri_template, strict=strict))
-    exceptions = t.cast("tuple[Problem]", exceptions)
-    return problem_response(
-        responses[exceptions[0].status],
-        examples=examples,
-    )
+@dataclasses.dataclass
+class ErrorLimits:
+    """Limits applied to the `errors` list of a validation or aggregate problem.
 
+    `max_errors` caps the number of errors returned, `max_input_size` caps the
+    length of each echoed `input` value, and `max_bytes` caps the total encoded
+    size of the errors. Unset limits are not applied.
+    """
 
-def generate_swagger_response(
-    *exceptions: type[Problem] | Problem,
-    documentation_uri_template: str = "",
-    strict: bool = False,
-) -> dict:
-    warn(
-        "Direct calls to generate_swagger_response are being deprecated, use `eh.generate_swagger_response(...)` instead.",
-        FutureWarning,
-        stacklevel=2,
-    )
-    return _generate_swagger_response(
-        *exceptions,
-        documentation_uri_template=documentation_uri_template,
-        strict=strict,
+    max_errors: int | None = None
+    max_input_size: int | None = None
+    max_bytes: int | None = None
+
+
+# Limits applied to aggregate problems when no `error_limits` are provided, so
+# a large partial batch failure can not build an unbounded response.
+DEFAULT_AGGREGATE_LIMITS = ErrorLimits(max_errors=1000, max_bytes=1024 * 1024)
+
+
+class _ByteBudget:
+    """Track the encoded size of a JSON list, as items are added to it."""
+
+    __slots__ = ("max_bytes", "size")
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        # The brackets, less the comma not needed before the first item.
+        self.size = len("[]") - 1
+
+    def fits(self, item: bytes) -> bool:
+        """Add an encoded item, including its separating comma, and return whether the list is within budget."""
+        self.size += len(item) + 1
+        return self.size <= self.max_bytes
+
+
+# Upper bound on distinct (class, detail) bodies kept when prerendering, least
+# recently used bodies are evicted first.
+PRERENDER_CACHE_SIZE = 1024
+
+# Number of distinct Accept headers to cache negotiated media types for.
+MEDIA_TYPE_CACHE_SIZE = 256
+
+# Upper bound on distinct (media type, problem headers) header blocks kept, least
+# recently used blocks are evicted first.
+HEADER_CACHE_SIZE = 1024
+
+RawHeaders = tuple[tuple[bytes, bytes], ...]
+
+
+class _ProblemResponse(JSONResponse):
+    """JSONResponse built from an already encoded body and headers, skipping header encoding."""
+
+    # The content-type is included in the raw headers.
+    media_type = None
+
+    def __init__(self, body: bytes, status_code: int, raw_headers: RawHeaders) -> None:
+        super().__init__(body, status_code)
+        self.raw_headers[:0] = raw_headers
+
+    def render(self, content: t.Any) -> bytes:  # noqa: ANN401
+        # The body is encoded by the exception handler.
+        return content
+
+
+_K = t.TypeVar("_K")
+_V = t.TypeVar("_V")
+
+
+class _LRUCache(collections.OrderedDict[_K, _V]):
+    """A bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__()
+        self.maxsize = maxsize
+
+    def lookup(self, key: _K) -> _V | None:
+        # Entries may be evicted by another thread between the two calls.
+        with contextlib.suppress(KeyError):
+            self.move_to_end(key)
+            return self[key]
+        return None
+
+    def store(self, key: _K, value: _V) -> None:
+        self[key] = value
+        if len(self) > self.maxsize:
+            with contextlib.suppress(KeyError):
+                self.popitem(last=False)
+
+
+def _is_static(problem: StatusProblem) -> bool:
+    """Check that a StatusProblem only carries class defined fields, other than detail.
+
+    Subclasses that override how the problem is marshalled may render
+    differently per instance, so are never static.
+    """
+    cls = type(problem)
+    return (
+        cls.marshal is StatusProblem.marshal
+        and cls.type is StatusProblem.type
+        and not problem.extras
+        and problem._type == cls.type_  # noqa: SLF001
+        and problem.title == cls.title
+        and problem.status == cls.status
     )
 
 
+AsyncPreHook = t.Callable[["Request", Exception], t.Coroutine[t.Any, t.Any, None]]
+AsyncPostHook = t.Callable[[dict, "Request", "Response"], t.Coroutine[t.Any, t.Any, tuple[dict, "Response"]]]
+
+
+def _is_async(func: t.Callable[..., t.Any]) -> bool:
+    while isinstance(func, functools.partial):
+        func = func.func
+    return inspect.iscoroutinefunction(func) or inspect.iscoroutinefunction(type(func).__call__)
+
+
+class ThreadPoolHook:
+    """Run a synchronous pre/post hook in the threadpool.
+
+    Requires an AsyncExceptionHandler, so blocking hooks do not block the event
+    loop. Pre hooks wrapped in a ThreadPoolHook run concurrently with any other
+    async pre hooks.
+    """
+
+    def __init__(self, hook: t.Callable[..., t.Any]) -> None:
+        self.hook = hook
+
+    async def __call__(self, *args: t.Any) -> t.Any:  # noqa: ANN401
+        return await run_in_threadpool(self.hook, *args)
+
+
+class BackgroundHook:
+    """Run a pre hook as a background task, after the response has been sent."""
+
+    def __init__(self, hook: PreHook | AsyncPreHook) -> None:
+        self.hook = hook
+
+    def __call__(self, request: Request, exc: Exception) -> t.Any:  # noqa: ANN401
+        # Only called directly when used outside of an ExceptionHandler.
+        return self.hook(request, exc)
+
+
+class _TimedHook:
+    """Record the duration of each call to a hook, or handler stage."""
+
+    def __init__(self, hook: t.Callable[..., t.Any], stage: str, profiler: Profiler) -> None:
+        self.hook = hook
+        self.stage = stage
+        self.profiler = profiler
+
+    def __call__(self, *args: t.Any) -> t.Any:  # noqa: ANN401
+        start = time.perf_counter()
+        try:
+            return self.hook(*args)
+        finally:
+            self.profiler.record(self.stage, time.perf_counter() - start)
+
+
+class _AsyncTimedHook(_TimedHook):
+    async def __call__(self, *args: t.Any) -> t.Any:  # noqa: ANN401
+        start = time.perf_counter()
+        try:
+            return await self.hook(*args)
+        finally:
+            self.profiler.record(self.stage, time.perf_counter() - start)
+
+
+def _timed(hook: t.Callable[..., t.Any], stage: str, profiler: Profiler) -> _TimedHook:
+    return (_AsyncTimedHook if _is_async(hook) else _TimedHook)(hook, stage, profiler)
+
+
+def _hook_name(hook: t.Callable[..., t.Any]) -> str:
+    hook = getattr(hook, "hook", hook)
+    while isinstance(hook, functools.partial):
+        hook = hook.func
+    return getattr(hook, "__name__", type(hook).__name__)
+
+
+class _Handlers(dict):
+    """Handler mapping that notifies its owner when modified."""
+
+    def __init__(self, handlers: dict[type[Exception], Handler], on_change: t.Callable[[], None]) -> None:
+        super().__init__(handlers)
+        self._on_change = on_change
+
+    def __setitem__(self, key: type[Exception], value: Handler) -> None:
+        super().__setitem__(key, value)
+        self._on_change()
+
+    def __delitem__(self, key: type[Exception]) -> None:
+        super().__delitem__(key)
+        self._on_change()
+
+    def __ior__(self, other: t.Any) -> _Handlers:  # noqa: ANN401, PYI034
+        super().__ior__(other)
+        self._on_change()
+        return self
+
+    def update(self, *args: t.Any, **kwargs: t.Any) -> None:  # noqa: ANN401
+        super().update(*args, **kwargs)
+        self._on_change()
+
+    def setdefault(self, key: type[Exception], default: Handler) -> Handler:  # ty: ignore[invalid-method-override]
+        value = super().setdefault(key, default)
+        self._on_change()
+        return value
+
+    def pop(self, *args: t.Any) -> t.Any:  # noqa: ANN401
+        value = super().pop(*args)
+        self._on_change()
+        return value
+
+    def popitem(self) -> tuple[type[Exception], Handler]:
+        item = super().popitem()
+        self._on_change()
+        return item
+
+    def clear(self) -> None:
+        super().clear()
+        self._on_change()
+
+
 class ExceptionHandler(BaseExceptionHandler):
-    def generate_swagger_response(self, *exceptions: type[Problem] | Problem) -> dict:
-        return _generate_swagger_response(
-            *exceptions,
-            documentation_uri_template=self.documentation_uri_template,
+    asynchronous = False
+
+    def __init__(  # noqa: PLR0913, PLR0917
+        self,
+        logger: logging.Logger | None = None,
+        unhandled_wrappers: dict[str, type[StatusProblem]] | None = None,
+        handlers: dict[type[Exception], Handler] | None = None,
+        pre_hooks: list[PreHook] | None = None,
+        post_hooks: list[PostHook] | None = None,
+        documentation_uri_template: str = "",
+        *,
+        strict_rfc9457: bool = False,
+        error_limits: ErrorLimits | None = None,
+        prerender: bool = False,
+        encoder: Encoder | str | None = None,
+        reporter: Reporter | None = None,
+        metrics: Metrics | None = None,
+        profiler: Profiler | None = None,
+        shared_swagger_responses: bool = False,
+        media_types: dict[str, Encoder | str] | None = None,
+    ) -> None:
+        super().__init__(
+            logger=logger,
+            unhandled_wrappers=unhandled_wrappers,
+            handlers=handlers,
+            pre_hooks=pre_hooks,
+            post_hooks=post_hooks,
+            documentation_uri_template=documentation_uri_template,
+            strict_rfc9457=strict_rfc9457,
+        )
+        if not self.asynchronous and any(_is_async(hook) for hook in (*self.pre_hooks, *self.post_hooks)):
+            msg = "Async hooks require an AsyncExceptionHandler, use `new_exception_handler(...)`."
+            raise ValueError(msg)
+
+        self.error_limits = error_limits
+        self.prerender = prerender
+        self.encoder = resolve_encoder(encoder)
+        self.reporter = reporter or (LogReporter(self.logger) if self.logger else None)
+        self.metrics = metrics
+        self.profiler = profiler
+        self.shared_swagger_responses = shared_swagger_responses
+        self.swagger_responses: dict[str, dict] = {}
+        self._swagger_refs: dict[tuple[type[Problem], ...], dict] = {}
+        self.media_encoders = resolve_media_encoders(media_types)
+        if self.media_encoders and any(isinstance(hook, StripExtrasPostHook) for hook in self.post_hooks):
+            # StripExtrasPostHook always writes a JSON body, which would be labelled as the negotiated media type.
+            msg = "StripExtrasPostHook encodes JSON, and can not be combined with `media_types`."
+            raise ValueError(msg)
+        self._media_types = (PROBLEM_JSON, *self.media_encoders)
+        self._negotiate = functools.lru_cache(maxsize=MEDIA_TYPE_CACHE_SIZE)(self._negotiate_media_type)
+        self._prerendered: _LRUCache[tuple[type[Problem], str | None, str], tuple[dict, bytes]] = _LRUCache(
+            PRERENDER_CACHE_SIZE,
+        )
+        self._header_blocks: _LRUCache[tuple[str, tuple[tuple[str, str], ...]], RawHeaders] = _LRUCache(
+            HEADER_CACHE_SIZE,
+        )
+        if profiler is not None:
+            self._instrument(profiler)
+
+    def _instrument(self, profiler: Profiler) -> None:
+        """Time each stage of handling an exception.
+
+        Stages are wrapped once at configuration, so handling is unchanged when
+        no profiler is provided. Hooks added after instrumentation are not timed.
+        """
+        for attr, stage in (("_resolve", "dispatch"), ("_marshal", "marshal"), ("_encode", "encode")):
+            setattr(self, attr, _timed(getattr(self, attr), stage, profiler))
+        self.pre_hooks = [
+            hook if isinstance(hook, BackgroundHook) else _timed(hook, f"pre_hook:{_hook_name(hook)}", profiler)
+            for hook in self.pre_hooks
+        ]
+        self.post_hooks = [_timed(hook, f"post_hook:{_hook_name(hook)}", profiler) for hook in self.post_hooks]
+
+    @property
+    def handlers(self) -> dict[type[Exception], Handler]:
+        return self._handlers
+
+    @handlers.setter
+    def handlers(self, handlers: dict[type[Exception], Handler]) -> None:
+        # Copied, so changes to the caller's mapping can not bypass invalidation.
+        self._dispatch: dict[type[Exception], tuple[Handler, ...]] = {}
+        self._handlers = _Handlers(handlers, self._dispatch.clear)
+
+    def _handler_chain(self, exc_type: type[Exception]) -> tuple[Handler, ...]:
+        """Return the ordered handlers that apply to an exception type.
+
+        Resolved on first sight of each exception class and cached until the
+        handlers are modified.
+        """
+        try:
+            return self._dispatch[exc_type]
+        except KeyError:
+            chain = tuple(handler for type_, handler in self._handlers.items() if issubclass(exc_type, type_))
+            self._dispatch[exc_type] = chain
+            return chain
+
+    def _resolve(self, request: Request, exc: Exception) -> Problem:
+        """Convert an exception into a Problem."""
+        ret = None
+        for handler in self._handler_chain(type(exc)):
+            ret = handler(self, request, exc)
+            if ret is not None:
+                break
+
+        if isinstance(exc, rfc9457.Problem):
+            return exc
+
+        if ret is None:
+            wrapper = self.unhandled_wrappers.get("default", self.unhandled_wrappers.get("500"))
+            ret = (
+                wrapper(str(exc))
+                if wrapper
+                else Problem(
+                    title="Unhandled exception occurred.",
+                    detail=str(exc),
+                    type_="unhandled-exception",
+                )
+            )
+
+        return ret
+
+    def _negotiate_media_type(self, accept: str) -> str:
+        return negotiate_media_type(accept, self._media_types) or PROBLEM_JSON
+
+    def _media_type(self, request: Request) -> str:
+        """Select the response media type from the Accept header."""
+        if not self.media_encoders:
+            return PROBLEM_JSON
+        accept = request.headers.get("accept")
+        return self._negotiate(accept) if accept else PROBLEM_JSON
+
+    def _render(self, ret: Problem, media_type: str = PROBLEM_JSON) -> tuple[dict, bytes]:
+        """Marshal and encode a Problem.
+
+        With `prerender` enabled, StatusProblems that have no instance specific
+        title, type or extras are only rendered once per class, detail and
+        media type.
+        """
+        if isinstance(ret, AggregateProblem):
+            return self._render_aggregate(ret, media_type)
+
+        key = None
+        if self.prerender and isinstance(ret, StatusProblem) and _is_static(ret):
+            key = (type(ret), ret.detail, media_type)
+            cached = self._prerendered.lookup(key)
+            if cached is not None:
+                return cached[0].copy(), cached[1]
+
+        content = self._marshal(ret)
+        body = self._encode(content, media_type)
+
+        if key is not None:
+            self._prerendered.store(key, (content.copy(), body))
+
+        return content, body
+
+    def _render_aggregate(self, ret: AggregateProblem, media_type: str = PROBLEM_JSON) -> tuple[dict, bytes]:
+        """Marshal an AggregateProblem one sub problem at a time.
+
+        Marshalling stops once the `max_errors` or `max_bytes` error limits are
+        reached, `DEFAULT_AGGREGATE_LIMITS` apply if no error limits are set.
+        The body is encoded in full once the sub problems are marshalled, it is
+        not streamed.
+        """
+        content = rfc9457.Problem.marshal(ret, uri=self.documentation_uri_template, strict=self.strict)
+        limits = self.error_limits or DEFAULT_AGGREGATE_LIMITS
+        total = len(ret.problems)
+        problems = ret.problems if limits.max_errors is None else ret.problems[: limits.max_errors]
+        encoder = self.encoder if media_type == PROBLEM_JSON else self.media_encoders[media_type]
+        budget = None if limits.max_bytes is None else _ByteBudget(limits.max_bytes)
+
+        errors: list[dict] = []
+        for problem in problems:
+            sub = problem.marshal(uri=self.documentation_uri_template, strict=self.strict)
+            if budget is not None and not budget.fits(encoder(sub)):
+                break
+            errors.append(sub)
+
+        if len(errors) < total:
+            content.update(truncated=True, total_errors=total)
+        content["errors"] = errors
+        return content, self._encode(content, media_type)
+
+    def _marshal(self, ret: Problem) -> dict:
+        return ret.marshal(
+            uri=self.documentation_uri_template,
             strict=self.strict,
         )
 
+    def _encode(self, content: dict, media_type: str = PROBLEM_JSON) -> bytes:
+        if media_type == PROBLEM_JSON:
+            return self.encoder(content)
+        return self.media_encoders[media_type](content)
+
+    def _report(self, ret: Problem, exc: Exception, response: Response) -> None:
+        if ret.status >= http.HTTPStatus.INTERNAL_SERVER_ERROR and self.reporter:
+            self.reporter(ret, exc, response)
+
+    def _raw_headers(self, ret: Problem, media_type: str) -> RawHeaders:
+        """Encode the static headers of a response, once per media type and problem headers."""
+        key = (media_type, tuple(ret.headers.items()) if ret.headers else ())
+        try:
+            cached = self._header_blocks.lookup(key)
+        except TypeError:
+            # Unhashable header values are encoded every time.
+            key = cached = None
+        if cached is not None:
+            return cached
+
+        headers = {"content-type": media_type}
+        if self.media_encoders:
+            headers["vary"] = "Accept"
+        headers.update(ret.headers or {})
+        raw = tuple((k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items())
+
+        if key is not None:
+            self._header_blocks.store(key, raw)
+        return raw
+
+    def _response(self, ret: Problem, media_type: str = PROBLEM_JSON) -> tuple[dict, Response]:
+        content, body = self._render(ret, media_type)
+        response = _ProblemResponse(body, ret.status, self._raw_headers(ret, media_type))
+        return content, response
+
+    def _finish(  # noqa: PLR0913, PLR0917
+        self,
+        request: Request,
+        exc: Exception,
+        ret: Problem,
+        response: Response,
+        background: list[PreHook | AsyncPreHook],
+        start: float,
+    ) -> None:
+        """Record metrics, report server errors and attach background hooks."""
+        if self.metrics is not None:
+            self.metrics.observe(ret, request, time.perf_counter() - start)
+
+        self._report(ret, exc, response)
+
+        for hook in background:
+            add_background_task(response, hook, request, exc)
+
+    def __call__(self, request: Request, exc: Exception) -> Response:
+        start = time.perf_counter() if self.metrics is not None else 0.0
+        background = []
+        for pre_hook in self.pre_hooks:
+            if isinstance(pre_hook, BackgroundHook):
+                background.append(pre_hook.hook)
+                continue
+            pre_hook(request, exc)
+
+        ret = self._resolve(request, exc)
+        content, response = self._response(ret, self._media_type(request))
+
+        for post_hook in self.post_hooks:
+            content, response = post_hook(content, request, response)
+            response.headers["content-length"] = str(len(response.body))
+
+        self._finish(request, exc, ret, response, background, start)
+        return response
 
-def customise_openapi(
-    func: t.Callable[..., dict],
-    *,
-    documentation_uri_template: str = "",
-    strict: bool = False,
-    generic_defaults: bool = True,
-) -> t.Callable[..., dict[str, t.Any]]:
-    """Customize OpenAPI schema."""
-
-    def wrapper() -> dict[str, t.Any]:
-        """Wrapper."""
-        res = func()
-
-        if not res["paths"]:
-            # If there are no paths, we don't need to add any responses
-            return res
-
-        if "components" not in res:
-            res["components"] = {"schemas": {}}
-        elif "schemas" not in res["components"]:
-            res["components"]["schemas"] = {}
-
-        validation_error = problem_component(
-            "RequestValidationError",
-            required=["errors"],
-            errors={
-                "type": "array",
-                "items": {
-                    "$ref": "#/components/schemas/ValidationError",
-                },
-            },
+    def generate_swagger_response(self, *exceptions: type[Problem] | Problem) -> dict:
+        """Generate an openapi response for problems.
+
+        With `shared_swagger_responses` enabled, responses for problem classes
+        are added once to `swagger_responses`, which are included under
+        `components/responses`, and a reference to them is returned. Names that
+        clash with an existing response, or the generic `ClientError` and
+        `ServerError` responses, are suffixed with a number.
+        """
+        from fastapi_problem.openapi import _GENERIC_RESPONSE_NAMES, _generate_swagger_response  # noqa: PLC0415
+
+        response = _generate_swagger_response(
+            *exceptions,
+            documentation_uri_template=self.documentation_uri_template,
+            strict=self.strict,
         )
-        problem = problem_component("Problem")
-
-        res["components"]["schemas"]["HTTPValidationError"] = validation_error
-        res["components"]["schemas"]["Problem"] = problem
-
-        for methods in res["paths"].values():
-            for details in methods.values():
-                if (
-                    "422" in details["responses"]
-                    and "application/problem+json" not in details["responses"]["422"]["content"]
-                ):
-                    details["responses"]["422"]["content"]["application/problem+json"] = details["responses"]["422"][
-                        "content"
-                    ].pop("application/json")
-                if generic_defaults:
-                    user_error = Problem(
-                        "User facing error message.",
-                        type_="client-error-type",
-                        status=400,
-                        detail="Additional error context.",
-                    )
-                    server_error = Problem(
-                        "User facing error message.",
-                        type_="server-error-type",
-                        status=500,
-                        detail="Additional error context.",
-                    )
-                    details["responses"]["4XX"] = problem_response(
-                        description="Client Error",
-                        examples=[user_error.marshal(uri=documentation_uri_template, strict=strict)],
-                    )
-                    details["responses"]["5XX"] = problem_response(
-                        description="Server Error",
-                        examples=[server_error.marshal(uri=documentation_uri_template, strict=strict)],
-                    )
-
-        return res
-
-    return wrapper
+        if not self.shared_swagger_responses or any(isinstance(e, Problem) for e in exceptions):
+            return response
+
+        classes = t.cast("tuple[type[Problem], ...]", exceptions)
+        ref = self._swagger_refs.get(classes)
+        if ref is None:
+            name = base = "".join(e.__name__ for e in classes)
+            suffix = 1
+            while name in self.swagger_responses or name in _GENERIC_RESPONSE_NAMES:
+                suffix += 1
+                name = f"{base}{suffix}"
+            self.swagger_responses[name] = response
+            ref = self._swagger_refs[classes] = {"$ref": f"#/components/responses/{name}"}
+        return ref
+
+
+class AsyncExceptionHandler(ExceptionHandler):
+    """ExceptionHandler supporting async pre and post hooks.
+
+    Synchronous pre hooks are run first, in order, async pre hooks are then run
+    concurrently. If an async pre hook fails, its exception is raised directly,
+    rather than wrapped in an ExceptionGroup. Post hooks are run in order,
+    awaiting any async hooks.
+
+    Hooks are classified once, when `pre_hooks` or `post_hooks` are assigned,
+    so assign a new list rather than modifying them in place.
+    """
+
+    asynchronous = True
+
+    @property
+    def pre_hooks(self) -> list[PreHook]:
+        return self._pre_hooks
+
+    @pre_hooks.setter
+    def pre_hooks(self, hooks: list[PreHook]) -> None:
+        self._pre_hooks = hooks
+        self._background_pre_hooks = [hook.hook for hook in hooks if isinstance(hook, BackgroundHook)]
+        foreground = [hook for hook in hooks if not isinstance(hook, BackgroundHook)]
+        self._sync_pre_hooks = [hook for hook in foreground if not _is_async(hook)]
+        self._async_pre_hooks = [t.cast("AsyncPreHook", hook) for hook in foreground if _is_async(hook)]
+
+    @property
+    def post_hooks(self) -> list[PostHook]:
+        return self._post_hooks
+
+    @post_hooks.setter
+    def post_hooks(self, hooks: list[PostHook]) -> None:
+        self._post_hooks = hooks
+        self._classified_post_hooks = [(hook, _is_async(hook)) for hook in hooks]
+
+    async def __call__(self, request: Request, exc: Exception) -> Response:  # ty: ignore[invalid-method-override]
+        start = time.perf_counter() if self.metrics is not None else 0.0
+        for pre_hook in self._sync_pre_hooks:
+            pre_hook(request, exc)
+
+        concurrent = self._async_pre_hooks
+        if len(concurrent) == 1:
+            await concurrent[0](request, exc)
+        elif concurrent:
+            try:
+                async with anyio.create_task_group() as tg:
+                    for pre_hook in concurrent:
+                        tg.start_soon(pre_hook, request, exc)
+            except Exception as group:
+                if EXCEPTION_GROUP is None or not isinstance(group, EXCEPTION_GROUP):
+                    raise
+                # Raise the failing hook's own exception, as when a single async hook is run.
+                raise next(_flatten_group(group)) from group
+
+        ret = self._resolve(request, exc)
+        content, response = self._response(ret, self._media_type(request))
+
+        for post_hook, is_async in self._classified_post_hooks:
+            if is_async:
+                content, response = await t.cast("AsyncPostHook", post_hook)(content, request, response)
+            else:
+                content, response = post_hook(content, request, response)
+            response.headers["content-length"] = str(len(response.body))
+
+        self._finish(request, exc, ret, response, self._background_pre_hooks, start)
+        return response
+
+
+_JSON_SCALARS = frozenset({str, int, float, bool, type(None)})
+
+
+def _jsonable_key(key: t.Any) -> str:  # noqa: ANN401
+    if isinstance(key, str):
+        return key
+    # Match json.dumps key coercion for scalar keys (True -> "true" etc).
+    return json.dumps(key) if key is None or isinstance(key, (int, float)) else str(key)
+
+
+def _jsonable(value: t.Any) -> t.Any:  # noqa: ANN401
+    """Convert a value into a JSON compatible structure.
+
+    Equivalent to `json.loads(json.dumps(value, default=str))`, but only values
+    that are not JSON compatible are converted, everything else is passed
+    through as is.
+    """
+    cls = type(value)
+    if cls in _JSON_SCALARS:
+        return value
+    if cls is dict or isinstance(value, dict):
+        return {
+            k if type(k) is str else _jsonable_key(k): v if type(v) in _JSON_SCALARS else _jsonable(v)
+            for k, v in value.items()
+        }
+    if cls is list or cls is tuple or isinstance(value, (list, tuple)):
+        return [v if type(v) in _JSON_SCALARS else _jsonable(v) for v in value]
+    if isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+
+def _truncate_input(value: t.Any, max_size: int, encoder: Encoder) -> tuple[t.Any, bool]:  # noqa: ANN401
+    encoded = value if isinstance(value, str) else encoder(value).decode("utf-8")
+    if len(encoded) <= max_size:
+        return value, False
+    return f"{encoded[:max_size]}...", True
+
+
+def _limit_errors(
+    errors: t.Sequence[t.Any],
+    limits: ErrorLimits,
+    encoder: Encoder,
+) -> tuple[list[t.Any], bool]:
+    """Sanitise errors, dropping any that exceed the configured limits."""
+    total = len(errors)
+    if limits.max_errors is not None:
+        errors = errors[: limits.max_errors]
+    truncated = len(errors) < total
+
+    limited = []
+    budget = None if limits.max_bytes is None else _ByteBudget(limits.max_bytes)
+    for error in errors:
+        error_ = _jsonable(error)
+        if limits.max_input_size is not None and isinstance(error_, dict) and "input" in error_:
+            error_["input"], input_truncated = _truncate_input(error_["input"], limits.max_input_size, encoder)
+            truncated = truncated or input_truncated
+        if budget is not None and not budget.fits(encoder(error_)):
+            truncated = True
+            break
+        limited.append(error_)
+
+    return limited, truncated
 
 
 def request_validation_handler_(
@@ -151,8 +708,15 @@ def request_validation_handler_(
     exc: RequestValidationError,
 ) -> Problem:
     wrapper = eh.unhandled_wrappers.get("422")
-    errors = json.loads(json.dumps(exc.errors(), default=str))
-    kwargs = {"errors": errors}
+    errors = exc.errors()
+    kwargs: dict[str, t.Any]
+    if eh.error_limits is None:
+        kwargs = {"errors": _jsonable(errors)}
+    else:
+        limited, truncated = _limit_errors(errors, eh.error_limits, eh.encoder)
+        kwargs = {"errors": limited}
+        if truncated:
+            kwargs.update(truncated=True, total_errors=len(errors))
     return (
         wrapper(**kwargs)
         if wrapper
@@ -165,6 +729,37 @@ def request_validation_handler_(
     )
 
 
+def _exception_group() -> type[Exception] | None:
+    """ExceptionGroup is builtin from python 3.11, and backported by `exceptiongroup`."""
+    group = getattr(builtins, "ExceptionGroup", None)
+    if group is None:
+        with contextlib.suppress(ImportError):
+            group = importlib.import_module("exceptiongroup").ExceptionGroup
+    return group
+
+
+# None if ExceptionGroup is unavailable.
+EXCEPTION_GROUP = _exception_group()
+
+
+def _flatten_group(exc: Exception) -> t.Iterator[Exception]:
+    for sub in exc.exceptions:  # ty: ignore[unresolved-attribute]
+        if EXCEPTION_GROUP is not None and isinstance(sub, EXCEPTION_GROUP):
+            yield from _flatten_group(sub)
+        else:
+            yield sub
+
+
+def exception_group_handler_(
+    eh: ExceptionHandler,
+    request: Request,
+    exc: Exception,
+) -> Problem:
+    """Resolve each exception in a (nested) ExceptionGroup, and aggregate the problems."""
+    problems = [eh._resolve(request, sub) for sub in _flatten_group(exc)]  # noqa: SLF001
+    return AggregateProblem(problems=problems, type_="multiple-problems")
+
+
 def new_exception_handler(  # noqa: PLR0913
     logger: logging.Logger | None = None,
     cors: CorsConfiguration | None = None,
@@ -177,6 +772,15 @@ def new_exception_handler(  # noqa: PLR0913
     request_validation_handler: Handler = request_validation_handler_,
     *,
     strict_rfc9457: bool = False,
+    error_limits: ErrorLimits | None = None,
+    prerender: bool = False,
+    encoder: Encoder | str | None = None,
+    reporter: Reporter | None = None,
+    metrics: Metrics | None = None,
+    profiler: Profiler | None = None,
+    shared_swagger_responses: bool = False,
+    exception_group_handler: Handler = exception_group_handler_,
+    media_types: dict[str, Encoder | str] | None = None,
 ) -> ExceptionHandler:
     handlers = handlers or {}
     handlers.update(
@@ -185,6 +789,8 @@ def new_exception_handler(  # noqa: PLR0913
             RequestValidationError: request_validation_handler,
         },
     )
+    if EXCEPTION_GROUP is not None:
+        handlers.setdefault(EXCEPTION_GROUP, exception_group_handler)
     pre_hooks = pre_hooks or []
     post_hooks = post_hooks or []
 
@@ -192,7 +798,8 @@ def new_exception_handler(  # noqa: PLR0913
         # Ensure it runs first before any custom modifications
         post_hooks.insert(0, CorsPostHook(cors))
 
-    return ExceptionHandler(
+    cls = AsyncExceptionHandler if any(_is_async(hook) for hook in (*pre_hooks, *post_hooks)) else ExceptionHandler
+    return cls(
         logger=logger,
         unhandled_wrappers=unhandled_wrappers,
         handlers=handlers,
@@ -200,6 +807,14 @@ def new_exception_handler(  # noqa: PLR0913
         post_hooks=post_hooks,
         documentation_uri_template=documentation_uri_template,
         strict_rfc9457=strict_rfc9457,
+        error_limits=error_limits,
+        prerender=prerender,
+        encoder=encoder,
+        reporter=reporter,
+        metrics=metrics,
+        profiler=profiler,
+        shared_swagger_responses=shared_swagger_responses,
+        media_types=media_types,
     )
 
 
@@ -218,6 +833,10 @@ def add_exception_handler(  # noqa: PLR0913
     request_validation_handler: Handler = request_validation_handler_,
     generic_swagger_defaults: bool = True,
     strict_rfc9457: bool = False,
+    cache_openapi: bool = False,
+    incremental_openapi: bool = False,
+    encoder: Encoder | str | None = None,
+    middleware: bool = False,
 ) -> ExceptionHandler:
     if eh is None:
         warn(
@@ -237,32 +856,89 @@ def add_exception_handler(  # noqa: PLR0913
             http_exception_handler=http_exception_handler,
             request_validation_handler=request_validation_handler,
             strict_rfc9457=strict_rfc9457,
+            encoder=encoder,
         )
-
-    app.add_exception_handler(Exception, eh)
-    app.add_exception_handler(rfc9457.Problem, eh)
-    app.add_exception_handler(HTTPException, eh)
-    app.add_exception_handler(RequestValidationError, eh)
+    elif encoder is not None:
+        eh.encoder = resolve_encoder(encoder)
+
+    if middleware:
+        from fastapi_problem.middleware import ProblemMiddleware, handle_exception  # noqa: PLC0415
+
+        app.add_middleware(ProblemMiddleware, eh=eh)
+        # Replace FastAPI's default handlers, which handle these before they reach the middleware.
+        handler = functools.partial(handle_exception, eh)
+        app.add_exception_handler(HTTPException, handler)
+        app.add_exception_handler(RequestValidationError, handler)
+    else:
+        app.add_exception_handler(Exception, eh)
+        app.add_exception_handler(rfc9457.Problem, eh)
+        app.add_exception_handler(HTTPException, eh)
+        app.add_exception_handler(RequestValidationError, eh)
 
     # Override default 422 with Problem schema
-    app.openapi = customise_openapi(  # ty: ignore[invalid-assignment]
+    app.openapi = _LazyOpenAPI(  # ty: ignore[invalid-assignment]
         app.openapi,
         generic_defaults=generic_swagger_defaults,
         documentation_uri_template=eh.documentation_uri_template,
         strict=eh.strict,
+        cache=cache_openapi,
+        incremental=incremental_openapi,
+        responses=eh.swagger_responses,
+        media_types=tuple(eh.media_encoders),
     )
 
     return eh
 
 
+class _LazyOpenAPI:
+    """Customise an app's OpenAPI schema, importing the OpenAPI helpers on first use."""
+
+    def __init__(self, func: t.Callable[..., dict], **kwargs: t.Any) -> None:  # noqa: ANN401
+        self.func = func
+        self.kwargs = kwargs
+        self._customised: t.Any = None
+
+    def _customise(self) -> t.Any:  # noqa: ANN401
+        if self._customised is None:
+            from fastapi_problem.openapi import customise_openapi  # noqa: PLC0415
+
+            self._customised = customise_openapi(self.func, **self.kwargs)
+        return self._customised
+
+    def __call__(self) -> dict[str, t.Any]:
+        return self._customise()()
+
+    def cache_clear(self) -> None:
+        self._customise().cache_clear()
+
+
+# OpenAPI helpers, imported from fastapi_problem.openapi on first use.
+_OPENAPI_ATTRS = frozenset({"customise_openapi", "generate_swagger_response"})
+
+
+def __getattr__(name: str) -> t.Any:  # noqa: ANN401
+    if name in _OPENAPI_ATTRS:
+        from fastapi_problem import openapi  # noqa: PLC0415
+
+        return getattr(openapi, name)
+
+    msg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(msg)
+
+
 __all__ = [
+    "AsyncExceptionHandler",
+    "BackgroundHook",
     "CorsPostHook",
+    "ErrorLimits",
     "ExceptionHandler",
     "Handler",
     "PostHook",
     "PreHook",
     "StripExtrasPostHook",
+    "ThreadPoolHook",
     "add_exception_handler",
+    "exception_group_handler_",
     "http_exception_handler_",
     "new_exception_handler",
     "request_validation_handler_",
@@ -0,0 +1,351 @@
+"""In process metrics for problems emitted by the exception handler.
+
+Counters are kept per thread so recording never takes a lock, shards are only
+combined when a snapshot is taken. Once a thread exits, its shard is folded into
+a retired total, so short lived worker threads do not accumulate shards.
+
+`SharedProblemCounters` counts problems across worker processes, each thread
+writes to its own memory mapped file, and the files are summed when read. Once
+a thread exits, its file is handed to the next new thread of that process.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import mmap
+import os
+import struct
+import threading
+import typing as t
+import weakref
+from bisect import bisect_left
+from pathlib import Path
+
+if t.TYPE_CHECKING:
+    from starlette.requests import Request
+
+    from fastapi_problem.error import Problem
+
+# Handler latency buckets in seconds.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+Labels = tuple[int, str, str]
+
+
+class Metrics(t.Protocol):
+    def observe(self, problem: Problem, request: Request, elapsed: float) -> None: ...
+
+
+def route_template(request: Request) -> str:
+    """Return the path template of the matched route, empty if no route matched."""
+    route = request.scope.get("route")
+    path = getattr(route, "path", None)
+    return path if isinstance(path, str) else ""
+
+
+@dataclasses.dataclass
+class MetricsSnapshot:
+    """Point in time totals across all threads.
+
+    `counts` maps (status, type, route) to the number of problems emitted,
+    `bucket_counts` are cumulative, with a final +Inf bucket.
+    """
+
+    counts: dict[Labels, int]
+    buckets: tuple[float, ...]
+    bucket_counts: list[int]
+    sum: float
+    count: int
+
+
+class _Shard:
+    __slots__ = ("bucket_counts", "counts", "sum")
+
+    def __init__(self, size: int) -> None:
+        self.counts: dict[Labels, int] = {}
+        self.bucket_counts = [0] * size
+        self.sum = 0.0
+
+    def add(self, other: _Shard) -> None:
+        # Copy before iterating, the other shard's thread may still be writing.
+        for labels, count in dict(other.counts).items():
+            self.counts[labels] = self.counts.get(labels, 0) + count
+        for i, count in enumerate(list(other.bucket_counts)):
+            self.bucket_counts[i] += count
+        self.sum += other.sum
+
+
+class _Owner:
+    """Held only by a thread's local storage, so it is released when the thread exits."""
+
+    __slots__ = ("__weakref__",)
+
+
+def _retire(lock: threading.Lock, shards: list[_Shard], retired: _Shard, shard: _Shard) -> None:
+    with lock:
+        shards.remove(shard)
+        retired.add(shard)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class ProblemMetrics:
+    """Count problems by status, type and route, and track handler latency."""
+
+    def __init__(self, buckets: t.Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards: list[_Shard] = []
+        self._retired = _Shard(len(self.buckets) + 1)
+        self._lock = threading.Lock()
+
+    def _shard(self) -> _Shard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard(len(self.buckets) + 1)
+            owner = self._local.owner = _Owner()
+            with self._lock:
+                self._shards.append(shard)
+            # Not bound to self, so a live thread does not keep the metrics alive.
+            weakref.finalize(owner, _retire, self._lock, self._shards, self._retired, shard)
+            return shard
+
+    def observe(self, problem: Problem, request: Request, elapsed: float) -> None:
+        shard = self._shard()
+        labels = (problem.status, problem.type, route_template(request))
+        shard.counts[labels] = shard.counts.get(labels, 0) + 1
+        shard.bucket_counts[bisect_left(self.buckets, elapsed)] += 1
+        shard.sum += elapsed
+
+    def snapshot(self) -> MetricsSnapshot:
+        combined = _Shard(len(self.buckets) + 1)
+        with self._lock:
+            # Retired under the lock, so no shard is counted both live and retired.
+            combined.add(self._retired)
+            shards = list(self._shards)
+
+        for shard in shards:
+            combined.add(shard)
+
+        bucket_counts = combined.bucket_counts
+        cumulative = 0
+        for i, count in enumerate(bucket_counts):
+            cumulative += count
+            bucket_counts[i] = cumulative
+
+        return MetricsSnapshot(
+            counts=combined.counts,
+            buckets=self.buckets,
+            bucket_counts=bucket_counts,
+            sum=combined.sum,
+            count=cumulative,
+        )
+
+    def render_prometheus(self, prefix: str = "fastapi_problem") -> str:
+        """Render a snapshot in the prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_problems_total Problems emitted by the exception handler.",
+            f"# TYPE {prefix}_problems_total counter",
+        ]
+        lines.extend(
+            f'{prefix}_problems_total{{status="{status}",type="{_escape(type_)}",route="{_escape(route)}"}} {count}'
+            for (status, type_, route), count in sorted(snapshot.counts.items())
+        )
+
+        name = f"{prefix}_handler_duration_seconds"
+        lines.extend([
+            f"# HELP {name} Time from exception to response built.",
+            f"# TYPE {name} histogram",
+        ])
+        les = [str(bucket) for bucket in snapshot.buckets] + ["+Inf"]
+        lines.extend(f'{name}_bucket{{le="{le}"}} {count}' for le, count in zip(les, snapshot.bucket_counts))
+        lines.extend([f"{name}_sum {snapshot.sum}", f"{name}_count {snapshot.count}"])
+        return "\n".join(lines) + "\n"
+
+
+# Distinct (status, type) pairs each worker can count, the last slot counts
+# any pairs seen once the others are in use.
+SHARED_SLOTS = 256
+
+# Native byte order, matching the memoryview used to increment counts.
+# magic, version, slots, padding
+_HEADER = struct.Struct("=4sIII")
+# count, status, type
+_SLOT = struct.Struct("=QQ112s")
+_MAGIC = b"FPPC"
+_VERSION = 1
+_OVERFLOW = (0, "other")
+
+
+def _read_slots(data: bytes) -> t.Iterator[tuple[int, int, str]]:
+    """Yield the (count, status, type) of each used slot in a worker file."""
+    if len(data) < _HEADER.size:
+        return
+    magic, version, slots, _ = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION or len(data) < _HEADER.size + slots * _SLOT.size:
+        return
+    for offset in range(_HEADER.size, _HEADER.size + slots * _SLOT.size, _SLOT.size):
+        count, status, type_ = _SLOT.unpack_from(data, offset)
+        if count:
+            yield count, status, type_.rstrip(b"\0").decode("utf-8", errors="ignore")
+
+
+class _WorkerFile:
+    """A thread's memory mapped counts, written only by the thread currently holding it."""
+
+    __slots__ = ("closed", "counts", "index", "mapped", "pid", "slots")
+
+    def __init__(self, path: Path, slots: int) -> None:
+        self.pid = os.getpid()
+        self.slots = slots
+        self.closed = False
+        size = _HEADER.size + slots * _SLOT.size
+        # Keep the counts if the file is reopened, or the pid was reused.
+        data = path.read_bytes() if path.exists() else b""
+        existing = list(_read_slots(data)) if len(data) == size else []
+
+        # Restored counts are written to a temporary file and renamed into
+        # place, so concurrent readers never see the counts reset.
+        initial = bytearray(size)
+        _HEADER.pack_into(initial, 0, _MAGIC, _VERSION, slots, 0)
+        self.index: dict[tuple[int, str], int] = {}
+        for count, status, type_ in existing:
+            slot = self.index[status, type_] = len(self.index)
+            _SLOT.pack_into(initial, _HEADER.size + slot * _SLOT.size, count, status, type_.encode("utf-8")[:112])
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(initial)
+        tmp.replace(path)
+
+        with path.open("r+b") as f:
+            self.mapped = mmap.mmap(f.fileno(), size)
+        self.counts = memoryview(self.mapped).cast("B")[_HEADER.size :].cast("Q")
+
+    def claim(self, key: tuple[int, str]) -> int:
+        """Assign a slot to a new (status, type) pair, pairs past capacity share the overflow slot."""
+        if len(self.index) >= self.slots - 1:
+            if _OVERFLOW in self.index:
+                return self.index.setdefault(key, self.index[_OVERFLOW])
+            key = _OVERFLOW
+        slot = self.index[key] = len(self.index)
+        status, type_ = key
+        _SLOT.pack_into(self.mapped, _HEADER.size + slot * _SLOT.size, 0, status, type_.encode("utf-8")[:112])
+        return slot
+
+    def increment(self, key: tuple[int, str]) -> None:
+        slot = self.index.get(key)
+        if slot is None:
+            slot = self.claim(key)
+        self.counts[slot * (_SLOT.size // 8)] += 1
+
+    def close(self) -> None:
+        self.closed = True
+        self.counts.release()
+        self.mapped.close()
+
+
+class SharedProblemCounters:
+    """Count problems by status and type across worker processes.
+
+    Each thread writes to its own memory mapped file in `directory`, so
+    recording never takes a lock, and `totals()` sums the files of every
+    thread and worker, including any that have exited. Files are pooled per
+    process, once a thread exits its file is reused by the next new thread,
+    so short lived worker threads do not each hold a file open. Call `clear()`
+    before starting the workers, to reset the counts.
+    """
+
+    def __init__(self, directory: str | os.PathLike[str], slots: int = SHARED_SLOTS) -> None:
+        self.directory = Path(directory)
+        self.slots = slots
+        self._local = threading.local()
+        self._reset()
+
+    def _reset(self) -> None:
+        # Replaced rather than cleared, so owners released later return their
+        # files to the discarded free list.
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._files: list[_WorkerFile] = []
+        self._free: list[_WorkerFile] = []
+
+    def _open(self) -> _WorkerFile:
+        if self._pid != os.getpid():
+            # Forked, the files and lock belong to the parent.
+            self._reset()
+        with self._lock:
+            free = self._free
+            if free:
+                file = free.pop()
+            else:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                path = self.directory / f"problems_{self._pid}_{len(self._files)}.db"
+                file = _WorkerFile(path, self.slots)
+                self._files.append(file)
+        self._local.file = file
+        owner = self._local.owner = _Owner()
+        weakref.finalize(owner, free.append, file)
+        return file
+
+    def observe(self, problem: Problem, _request: Request, _elapsed: float) -> None:
+        file = getattr(self._local, "file", None)
+        if file is None or file.closed or file.pid != os.getpid():
+            # Also reopened after a fork, so each process has its own files.
+            file = self._open()
+        file.increment((problem.status, problem.type))
+
+    def totals(self) -> dict[tuple[int, str], int]:
+        """Return the number of problems emitted by (status, type), across all workers."""
+        totals: dict[tuple[int, str], int] = {}
+        for path in sorted(self.directory.glob("problems_*.db")):
+            for count, status, type_ in _read_slots(path.read_bytes()):
+                totals[status, type_] = totals.get((status, type_), 0) + count
+        return totals
+
+    def close(self) -> None:
+        """Unmap this process's files, they are mapped again on the next observation.
+
+        Call once requests have stopped, threads still observing may fail.
+        """
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        files, self._files = self._files, []
+        self._free = []
+        for file in files:
+            if file.pid == os.getpid() and not file.closed:
+                file.close()
+
+    def clear(self) -> None:
+        """Remove every worker file, resetting the counts."""
+        with self._lock:
+            self._close()
+            for path in [*self.directory.glob("problems_*.db"), *self.directory.glob("problems_*.tmp")]:
+                path.unlink(missing_ok=True)
+
+    def render_prometheus(self, prefix: str = "fastapi_problem") -> str:
+        """Render the totals in the prometheus text exposition format."""
+        lines = [
+            f"# HELP {prefix}_problems_total Problems emitted by the exception handler.",
+            f"# TYPE {prefix}_problems_total counter",
+        ]
+        lines.extend(
+            f'{prefix}_problems_total{{status="{status}",type="{_escape(type_)}"}} {count}'
+            for (status, type_), count in sorted(self.totals().items())
+        )
+        return "\n".join(lines) + "\n"
+
+
+__all__ = [
+    "DEFAULT_BUCKETS",
+    "SHARED_SLOTS",
+    "Metrics",
+    "MetricsSnapshot",
+    "ProblemMetrics",
+    "SharedProblemCounters",
+    "route_template",
+]
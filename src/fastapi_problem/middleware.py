@@ -0,0 +1,75 @@
+"""Pure ASGI middleware converting exceptions into problem responses.
+
+An alternative to registering the ExceptionHandler for `Exception` and
+`Problem`, where starlette's ServerErrorMiddleware handles unhandled
+exceptions, in the threadpool, and re-raises them once the response is sent.
+"""
+
+from __future__ import annotations
+
+import http
+import typing as t
+
+from starlette.requests import Request
+
+from fastapi_problem.error import Problem
+
+if t.TYPE_CHECKING:
+    from starlette.responses import Response
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+    from fastapi_problem.handler import ExceptionHandler
+
+
+async def handle_exception(eh: ExceptionHandler, request: Request, exc: Exception) -> Response:
+    """Call an ExceptionHandler from the event loop.
+
+    Synchronous handlers are called directly rather than in the threadpool,
+    blocking hooks should be wrapped in a ThreadPoolHook, and a LogReporter
+    formats and writes tracebacks on the event loop.
+    """
+    response = eh(request, exc)
+    if eh.asynchronous:
+        return await t.cast("t.Awaitable[Response]", response)
+    return response
+
+
+class ProblemMiddleware:
+    """Catch any exception raised by the wrapped app, and send a problem response.
+
+    If the response has already started the exception is re-raised. Otherwise
+    the problem response is sent, and, as with starlette's
+    ServerErrorMiddleware, exceptions that are not problems and result in a
+    server error are then re-raised, so the server logs them.
+    """
+
+    def __init__(self, app: ASGIApp, eh: ExceptionHandler) -> None:
+        self.app = app
+        self.eh = eh
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def _send(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except Exception as exc:
+            if response_started:
+                raise
+
+            response = await handle_exception(self.eh, Request(scope), exc)
+            await response(scope, receive, send)
+            if response.status_code >= http.HTTPStatus.INTERNAL_SERVER_ERROR and not isinstance(exc, Problem):
+                raise
+
+
+__all__ = ["ProblemMiddleware", "handle_exception"]
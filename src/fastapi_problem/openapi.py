@@ -0,0 +1,523 @@
+"""OpenAPI schema customisation and serving.
+
+Imported lazily by `fastapi_problem.handler`, so apps that do not generate a
+schema do not pay for it at import time.
+
+The customised schema can be served as precomputed, compressed bytes, or
+generated at build time, and served from file:
+
+$ python -m fastapi_problem.openapi app.main:app -o openapi.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import functools
+import hashlib
+import importlib
+import json
+import operator
+import sys
+import typing as t
+from http.client import responses
+from pathlib import Path
+from warnings import warn
+
+from fastapi.openapi.utils import get_openapi
+from rfc9457.openapi import problem_component, problem_response
+from starlette.responses import Response
+
+from fastapi_problem.compression import available_encodings, compress, negotiate
+from fastapi_problem.encoding import PROBLEM_JSON, Encoder, json_encoder, resolve_encoder
+from fastapi_problem.error import Problem
+
+if t.TYPE_CHECKING:
+    import os
+
+    from fastapi import FastAPI
+    from starlette.requests import Request
+
+# Maximum number of distinct exception tuples to cache swagger responses for.
+SWAGGER_CACHE_SIZE = 1024
+
+
+def _build_swagger_response(
+    exceptions: tuple[type[Problem] | Problem, ...],
+    *,
+    documentation_uri_template: str,
+    strict: bool,
+) -> dict:
+    examples = []
+    for e in exceptions:
+        exc = e("Additional error context.") if not isinstance(e, Problem) else e
+        examples.append(exc.marshal(uri=documentation_uri_template, strict=strict))
+    exceptions = t.cast("tuple[Problem]", exceptions)
+    return problem_response(
+        responses[exceptions[0].status],
+        examples=examples,
+    )
+
+
+@functools.lru_cache(maxsize=SWAGGER_CACHE_SIZE)
+def _cached_swagger_response(
+    exceptions: tuple[type[Problem], ...],
+    *,
+    documentation_uri_template: str,
+    strict: bool,
+) -> dict:
+    return _build_swagger_response(exceptions, documentation_uri_template=documentation_uri_template, strict=strict)
+
+
+def _generate_swagger_response(
+    *exceptions: type[Problem] | Problem,
+    documentation_uri_template: str = "",
+    strict: bool = False,
+) -> dict:
+    """Generate an openapi response for problems.
+
+    Responses for problem classes are cached, and the same dict is returned to
+    each caller, it should not be modified. Problem instances are not cached.
+    """
+    if any(isinstance(e, Problem) for e in exceptions):
+        return _build_swagger_response(exceptions, documentation_uri_template=documentation_uri_template, strict=strict)
+    return _cached_swagger_response(
+        t.cast("tuple[type[Problem], ...]", exceptions),
+        documentation_uri_template=documentation_uri_template,
+        strict=strict,
+    )
+
+
+def generate_swagger_response(
+    *exceptions: type[Problem] | Problem,
+    documentation_uri_template: str = "",
+    strict: bool = False,
+) -> dict:
+    warn(
+        "Direct calls to generate_swagger_response are being deprecated, use `eh.generate_swagger_response(...)` instead.",
+        FutureWarning,
+        stacklevel=2,
+    )
+    return _generate_swagger_response(
+        *exceptions,
+        documentation_uri_template=documentation_uri_template,
+        strict=strict,
+    )
+
+
+# Component names of the generic responses, not available to shared responses.
+_GENERIC_RESPONSE_NAMES = frozenset({"ClientError", "ServerError"})
+
+
+def _generic_responses(documentation_uri_template: str, *, strict: bool) -> dict[str, dict]:
+    """Generate the shared generic 4XX/5XX response components."""
+    user_error = Problem(
+        "User facing error message.",
+        type_="client-error-type",
+        status=400,
+        detail="Additional error context.",
+    )
+    server_error = Problem(
+        "User facing error message.",
+        type_="server-error-type",
+        status=500,
+        detail="Additional error context.",
+    )
+    return {
+        "ClientError": problem_response(
+            description="Client Error",
+            examples=[user_error.marshal(uri=documentation_uri_template, strict=strict)],
+        ),
+        "ServerError": problem_response(
+            description="Server Error",
+            examples=[server_error.marshal(uri=documentation_uri_template, strict=strict)],
+        ),
+    }
+
+
+def _with_media_types(response: dict, media_types: t.Sequence[str]) -> dict:
+    """Return a copy of a problem response, also listing the alternative media types."""
+    content = response.get("content")
+    if not media_types or not content or PROBLEM_JSON not in content:
+        return response
+    return {
+        **response,
+        "content": {**content, **dict.fromkeys(media_types, content[PROBLEM_JSON])},
+    }
+
+
+def _add_responses(
+    components: dict[str, t.Any],
+    *sources: dict[str, dict] | None,
+    media_types: t.Sequence[str],
+) -> None:
+    """Add shared responses to the schema components."""
+    for source in sources:
+        if source:
+            components.setdefault("responses", {}).update(source)
+    if media_types:
+        shared = components.get("responses", {})
+        for name, response in shared.items():
+            shared[name] = _with_media_types(response, media_types)
+
+
+def _customise_paths(
+    paths: dict[str, dict],
+    *,
+    generic_defaults: bool,
+    media_types: t.Sequence[str] = (),
+) -> None:
+    """Replace 422 responses with the Problem schema, and reference generic responses."""
+    for methods in paths.values():
+        for details in methods.values():
+            operation_responses = details["responses"]
+            validation = operation_responses.get("422")
+            if validation and PROBLEM_JSON not in validation["content"]:
+                validation["content"][PROBLEM_JSON] = validation["content"].pop("application/json")
+            if media_types:
+                for status, response in operation_responses.items():
+                    operation_responses[status] = _with_media_types(response, media_types)
+            if generic_defaults:
+                operation_responses["4XX"] = {"$ref": "#/components/responses/ClientError"}
+                operation_responses["5XX"] = {"$ref": "#/components/responses/ServerError"}
+
+
+def _merge_schema(res: dict[str, t.Any], partial: dict[str, t.Any]) -> None:
+    """Merge the paths and components of a partial schema into res."""
+    paths = res.setdefault("paths", {})
+    for path, methods in partial.get("paths", {}).items():
+        paths.setdefault(path, {}).update(methods)
+    components = res.setdefault("components", {})
+    for key, values in partial.get("components", {}).items():
+        components.setdefault(key, {}).update(values)
+
+
+# Schemas replaced during customisation, so never match the generated ones.
+_CUSTOMISED_SCHEMAS = frozenset({"HTTPValidationError", "Problem"})
+
+
+def _conflicting_schemas(res: dict[str, t.Any], partial: dict[str, t.Any]) -> bool:
+    """Check if merging partial would reuse a schema name for a different model.
+
+    Full generation disambiguates models sharing a name as `module__Name`, a
+    partial schema can not see the existing models so would reuse `Name`.
+    """
+    existing = res.get("components", {}).get("schemas", {})
+    names = {name.rsplit("__", 1)[-1] for name in existing}
+    for name, schema in partial.get("components", {}).get("schemas", {}).items():
+        if name in _CUSTOMISED_SCHEMAS:
+            continue
+        if name in existing:
+            if existing[name] != schema:
+                return True
+        elif name.rsplit("__", 1)[-1] in names:
+            return True
+    return False
+
+
+def customise_openapi(  # noqa: C901, PLR0913
+    func: t.Callable[..., dict],
+    *,
+    documentation_uri_template: str = "",
+    strict: bool = False,
+    generic_defaults: bool = True,
+    cache: bool = False,
+    incremental: bool = False,
+    responses: dict[str, dict] | None = None,
+    media_types: t.Sequence[str] = (),
+) -> t.Callable[..., dict[str, t.Any]]:
+    """Customize OpenAPI schema.
+
+    In `cache` mode the post-processing is done once per schema object returned
+    by `func`, subsequent calls reuse the result until `func` returns a new
+    schema. Call `wrapper.cache_clear()` after adding routes at runtime to
+    force regeneration.
+
+    In `incremental` mode, when `func` is a FastAPI app's `openapi` method,
+    routes added since the last call are generated and customised on their
+    own, and merged into the previous schema. If routes are removed or
+    reordered, or new models share a name with existing ones, the full schema
+    is regenerated.
+
+    `responses` are added to `components/responses`, for responses shared
+    between routes.
+
+    Problem responses also list any alternative `media_types`, such as
+    `application/problem+msgpack`, with the same schema.
+    """
+    cached: dict[str, t.Any] = {}
+    owner = getattr(func, "__self__", None) if incremental else None
+
+    def cache_clear() -> None:
+        """Drop the cached schema, and the owning app's cached schema if present."""
+        cached.clear()
+        owner = getattr(func, "__self__", None)
+        if owner is not None and hasattr(owner, "openapi_schema"):
+            owner.openapi_schema = None
+
+    def incremental_schema(app: FastAPI) -> tuple[dict[str, t.Any], dict[str, dict] | None]:
+        """Return the schema, and the paths added since the last call."""
+        routes = app.routes
+        seen = cached.get("routes")
+        res = cached.get("schema")
+        if res is not None and seen is not None and len(routes) >= len(seen) and all(map(operator.is_, routes, seen)):
+            if len(routes) == len(seen):
+                return res, None
+            partial = get_openapi(
+                title=app.title,
+                version=app.version,
+                openapi_version=app.openapi_version,
+                routes=routes[len(seen) :],
+                separate_input_output_schemas=app.separate_input_output_schemas,
+            )
+            if not _conflicting_schemas(res, partial):
+                _merge_schema(res, partial)
+                cached["routes"] = list(routes)
+                app.openapi_schema = res
+                return res, partial.get("paths", {})
+
+        # Drop the app's cached schema, or func would return it unchanged.
+        app.openapi_schema = None
+        res = func()
+        cached["routes"] = list(routes)
+        cached["schema"] = app.openapi_schema = res
+        return res, res["paths"]
+
+    def wrapper() -> dict[str, t.Any]:
+        """Wrapper."""
+        if owner is not None:
+            res, paths = incremental_schema(owner)
+            if paths is None:
+                return res
+        else:
+            res = func()
+            if cache:
+                if cached.get("schema") is res:
+                    return res
+                cached["schema"] = res
+            paths = res["paths"]
+
+        if not res["paths"]:
+            # If there are no paths, we don't need to add any responses
+            return res
+
+        components = res.setdefault("components", {})
+        schemas = components.setdefault("schemas", {})
+
+        schemas["HTTPValidationError"] = problem_component(
+            "RequestValidationError",
+            required=["errors"],
+            errors={
+                "type": "array",
+                "items": {
+                    "$ref": "#/components/schemas/ValidationError",
+                },
+            },
+        )
+        schemas["Problem"] = problem_component("Problem")
+
+        if generic_defaults and "generic" not in cached:
+            cached["generic"] = _generic_responses(documentation_uri_template, strict=strict)
+        _add_responses(components, cached.get("generic"), responses, media_types=media_types)
+
+        _customise_paths(paths, generic_defaults=generic_defaults, media_types=media_types)
+
+        return res
+
+    wrapper.cache_clear = cache_clear  # ty: ignore[unresolved-attribute]
+
+    return wrapper
+
+
+@dataclasses.dataclass
+class _Rendered:
+    etag: str
+    bodies: dict[str | None, bytes]
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match.
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in if_none_match.split(","))
+
+
+class OpenAPIEndpoint:
+    """Serve `app.openapi()` from bytes encoded and compressed once.
+
+    The schema is rendered on first request (or by calling `build()`) and
+    rendered again only when `app.openapi()` returns a new schema. While the
+    app's routes and cached `openapi_schema` are unchanged `app.openapi()` is
+    not called at all. Responses carry an ETag, clients sending a matching
+    If-None-Match receive an empty 304 response.
+
+    If `schema_file` is provided, the schema is read from file instead of
+    being generated.
+    """
+
+    def __init__(
+        self,
+        app: FastAPI,
+        *,
+        encodings: t.Sequence[str] | None = None,
+        encoder: Encoder | str | None = None,
+        cache_control: str | None = "no-cache",
+        schema_file: str | os.PathLike[str] | None = None,
+    ) -> None:
+        self.app = app
+        self.schema_file = schema_file
+        available = available_encodings()
+        self.encodings = tuple(available if encodings is None else (e for e in encodings if e in available))
+        self.encoder = resolve_encoder(encoder)
+        self.cache_control = cache_control
+        self._schema: dict[str, t.Any] | None = None
+        self._rendered: dict[str, _Rendered] = {}
+        self._routes: list[t.Any] | None = None
+        self._openapi_schema: dict[str, t.Any] | None = None
+
+    def _with_server(self, schema: dict[str, t.Any], root_path: str) -> dict[str, t.Any]:
+        """Add `root_path` as a server, matching FastAPI's own endpoint."""
+        servers = schema.get("servers", [])
+        if root_path not in {server.get("url") for server in servers}:
+            schema = {**schema, "servers": [{"url": root_path}, *servers]}
+        return schema
+
+    def _body(self, root_path: str) -> bytes:
+        with_server = bool(root_path and self.app.root_path_in_servers)
+        if self.schema_file is not None:
+            body = Path(self.schema_file).read_bytes()
+            if not with_server:
+                return body
+            schema = json.loads(body)
+        else:
+            schema = t.cast("dict[str, t.Any]", self._schema)
+
+        if with_server:
+            schema = self._with_server(schema, root_path)
+        return self.encoder(schema)
+
+    def _unchanged(self) -> bool:
+        """Check the app's routes and cached schema are those last rendered."""
+        routes = self.app.routes
+        return (
+            self._routes is not None
+            and self.app.openapi_schema is self._openapi_schema
+            and len(routes) == len(self._routes)
+            and all(map(operator.is_, routes, self._routes))
+        )
+
+    def build(self, root_path: str = "") -> _Rendered:
+        """Render the schema, if it has changed since last rendered."""
+        if self.schema_file is None and not self._unchanged():
+            schema = self.app.openapi()
+            if schema is not self._schema:
+                self._schema = schema
+                self._rendered = {}
+            self._routes = list(self.app.routes)
+            self._openapi_schema = self.app.openapi_schema
+
+        rendered = self._rendered.get(root_path)
+        if rendered is None:
+            body = self._body(root_path)
+            bodies: dict[str | None, bytes] = {None: body}
+            bodies.update({encoding: compress(body, encoding) for encoding in self.encodings})
+            rendered = _Rendered(etag=f'W/"{hashlib.sha256(body).hexdigest()[:32]}"', bodies=bodies)
+            self._rendered[root_path] = rendered
+        return rendered
+
+    async def handle(self, request: Request) -> Response:
+        rendered = self.build(request.scope.get("root_path", "").rstrip("/"))
+        headers = {"etag": rendered.etag, "vary": "Accept-Encoding"}
+        if self.cache_control:
+            headers["cache-control"] = self.cache_control
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, rendered.etag):
+            return Response(status_code=304, headers=headers)
+
+        encoding = negotiate(request.headers.get("accept-encoding", ""), self.encodings)
+        if encoding:
+            headers["content-encoding"] = encoding
+        return Response(rendered.bodies[encoding], media_type="application/json", headers=headers)
+
+
+def serve_openapi(
+    app: FastAPI,
+    *,
+    encodings: t.Sequence[str] | None = None,
+    encoder: Encoder | str | None = None,
+    cache_control: str | None = "no-cache",
+    schema_file: str | os.PathLike[str] | None = None,
+) -> OpenAPIEndpoint:
+    """Replace the app's OpenAPI route with an OpenAPIEndpoint."""
+    if not app.openapi_url:
+        msg = "The app does not serve an OpenAPI schema, openapi_url is not set."
+        raise ValueError(msg)
+
+    endpoint = OpenAPIEndpoint(
+        app,
+        encodings=encodings,
+        encoder=encoder,
+        cache_control=cache_control,
+        schema_file=schema_file,
+    )
+    app.router.routes = [route for route in app.router.routes if getattr(route, "path", None) != app.openapi_url]
+    app.add_route(app.openapi_url, endpoint.handle, include_in_schema=False)
+    return endpoint
+
+
+def load_app(path: str) -> FastAPI:
+    """Import an app from a `module:attribute` path."""
+    module_name, _, attr = path.partition(":")
+    if not module_name or not attr:
+        msg = f"Expected 'module:attribute', got '{path}'."
+        raise ValueError(msg)
+
+    obj: t.Any = importlib.import_module(module_name)
+    for name in attr.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+def main(argv: t.Sequence[str] | None = None) -> None:
+    """Write the customised OpenAPI schema of an app to file."""
+    parser = argparse.ArgumentParser(
+        prog="python -m fastapi_problem.openapi",
+        description="Generate the OpenAPI schema of an app, with problem customisations applied.",
+    )
+    parser.add_argument("app", help="App to import, as 'module:attribute', e.g. 'app.main:app'.")
+    parser.add_argument("-o", "--output", default="-", help="File to write the schema to, defaults to stdout.")
+    parser.add_argument("--app-dir", default=".", help="Directory to import the app from, defaults to cwd.")
+    parser.add_argument("--indent", type=int, default=None, help="Indent the output, compact by default.")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, args.app_dir)
+    try:
+        app = load_app(args.app)
+    except (ValueError, ImportError, AttributeError) as e:
+        parser.error(str(e))
+
+    schema = app.openapi()
+    if args.indent is None:
+        body = json_encoder(schema)
+    else:
+        body = json.dumps(schema, ensure_ascii=False, indent=args.indent).encode("utf-8")
+
+    if args.output == "-":
+        sys.stdout.buffer.write(body + b"\n")
+    else:
+        Path(args.output).write_bytes(body)
+
+
+__all__ = [
+    "OpenAPIEndpoint",
+    "customise_openapi",
+    "generate_swagger_response",
+    "load_app",
+    "main",
+    "serve_openapi",
+]
+
+
+if __name__ == "__main__":
+    main()
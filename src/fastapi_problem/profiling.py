@@ -0,0 +1,78 @@
+"""Per stage timing of the exception handler.
+
+When a profiler is provided to the ExceptionHandler, each stage of handling an
+exception (handler dispatch, each pre hook, marshalling, encoding and each post
+hook) is timed and passed to `profiler.record(stage, elapsed)`.
+"""
+
+from __future__ import annotations
+
+import collections
+import threading
+import typing as t
+
+# Percentiles reported by StageProfiler.report.
+PERCENTILES = (50, 90, 99)
+
+
+class Profiler(t.Protocol):
+    def record(self, stage: str, elapsed: float) -> None: ...
+
+
+def percentile(samples: t.Sequence[float], pct: float) -> float:
+    """Nearest rank percentile of sorted samples."""
+    if not samples:
+        return 0.0
+    index = max(0, min(len(samples) - 1, round(pct / 100 * len(samples)) - 1))
+    return samples[index]
+
+
+class StageProfiler:
+    """Collect stage timings and summarise them as percentiles.
+
+    The most recent `maxlen` samples are kept for each stage.
+    """
+
+    def __init__(self, maxlen: int = 10000) -> None:
+        self.maxlen = maxlen
+        self._samples: dict[str, collections.deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, elapsed: float) -> None:
+        try:
+            samples = self._samples[stage]
+        except KeyError:
+            with self._lock:
+                samples = self._samples.setdefault(stage, collections.deque(maxlen=self.maxlen))
+        samples.append(elapsed)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Return count, percentiles and max in seconds per stage, in first seen order."""
+        stats = {}
+        for stage, samples in list(self._samples.items()):
+            ordered = sorted(samples)
+            stats[stage] = {
+                "count": len(ordered),
+                **{f"p{pct}": percentile(ordered, pct) for pct in PERCENTILES},
+                "max": ordered[-1] if ordered else 0.0,
+            }
+        return stats
+
+    def report(self) -> str:
+        """Render stats as a table, timings in microseconds."""
+        columns = ["count", *(f"p{pct}" for pct in PERCENTILES), "max"]
+        stats = self.stats()
+        width = max([len("stage"), *(len(stage) for stage in stats)])
+        lines = [f"{'stage':<{width}} " + " ".join(f"{column:>10}" for column in columns)]
+        for stage, values in stats.items():
+            cells = [f"{values['count']:>10}"]
+            cells.extend(f"{values[column] * 1_000_000:>10.1f}" for column in columns[1:])
+            lines.append(f"{stage:<{width}} " + " ".join(cells))
+        return "\n".join(lines)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples = {}
+
+
+__all__ = ["Profiler", "StageProfiler", "percentile"]
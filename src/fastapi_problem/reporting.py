@@ -0,0 +1,259 @@
+"""Reporters for unhandled server errors.
+
+A reporter is called by the ExceptionHandler with the resolved problem, the
+original exception and the response, for any problem with a 5XX status.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import os
+import queue
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+
+from fastapi_problem.util import add_background_task
+
+if t.TYPE_CHECKING:
+    import logging
+
+    from starlette.responses import Response
+
+    from fastapi_problem.error import Problem
+
+Reporter = t.Callable[["Problem", Exception, "Response"], None]
+
+
+def log_exception(logger: logging.Logger, title: str, exc: Exception) -> None:
+    logger.exception(title, exc_info=(type(exc), exc, exc.__traceback__))  # noqa: LOG004
+
+
+class LogReporter:
+    """Log the exception before the response is returned."""
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.logger = logger
+
+    def __call__(self, problem: Problem, exc: Exception, response: Response) -> None:  # noqa: ARG002
+        log_exception(self.logger, problem.title, exc)
+
+
+class BackgroundReporter(LogReporter):
+    """Log the exception in a background task, after the response has been sent."""
+
+    def __call__(self, problem: Problem, exc: Exception, response: Response) -> None:
+        add_background_task(response, log_exception, self.logger, problem.title, exc)
+
+
+class QueueReporter(LogReporter):
+    """Log the exception from a worker thread, via a bounded queue.
+
+    When the queue is full, new exceptions are dropped and counted in `dropped`
+    rather than blocking the response. The worker is started on first use, and
+    restarted in forked worker processes.
+    """
+
+    def __init__(self, logger: logging.Logger, maxsize: int = 1000) -> None:
+        super().__init__(logger)
+        self._queue: queue.Queue[tuple[str, Exception] | None] = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._worker: threading.Thread | None = None
+        self._pid: int | None = None
+        self.dropped = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of exceptions waiting to be logged."""
+        return self._queue.qsize()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="fastapi-problem-reporter", daemon=True)
+                self._pid = os.getpid()
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                log_exception(self.logger, *item)
+            finally:
+                self._queue.task_done()
+
+    def __call__(self, problem: Problem, exc: Exception, response: Response) -> None:  # noqa: ARG002
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((problem.title, exc))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def join(self) -> None:
+        """Block until all queued exceptions have been logged."""
+        self._queue.join()
+
+    def close(self, timeout: float | None = None) -> None:
+        """Log any queued exceptions, and stop the worker."""
+        if self._worker is None or not self._worker.is_alive():
+            return
+        self._queue.put(None)
+        self._worker.join(timeout)
+        self._worker = None
+
+
+Fingerprint = tuple[type, str, int]
+
+
+def fingerprint(exc: Exception) -> Fingerprint:
+    """Identify an exception by its type and the frame it was raised from."""
+    tb = exc.__traceback__
+    if tb is None:
+        return (type(exc), "", 0)
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    return (type(exc), tb.tb_frame.f_code.co_filename, tb.tb_lineno)
+
+
+@dataclasses.dataclass
+class _Window:
+    start: float
+    title: str
+    reported: int = 0
+    suppressed: int = 0
+
+
+class DeduplicatingReporter:
+    """Rate limit identical exceptions before passing them to a reporter.
+
+    Exceptions are identified by type and raising frame. The first `first`
+    occurrences in each `interval` are reported in full, further occurrences
+    are counted and a summary is logged once the interval has passed, from a
+    timer thread started on first use. At most `max_fingerprints` are tracked,
+    the least recently seen are evicted (and summarised) first.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        reporter: Reporter,
+        *,
+        first: int = 1,
+        interval: float = 60.0,
+        max_fingerprints: int = 1024,
+        logger: logging.Logger | None = None,
+        clock: t.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.reporter = reporter
+        self.first = first
+        self.interval = interval
+        self.max_fingerprints = max_fingerprints
+        self.logger = logger or t.cast("logging.Logger", getattr(reporter, "logger", None))
+        if self.logger is None:
+            msg = "A logger is required for summaries when the reporter does not provide one."
+            raise ValueError(msg)
+        self.clock = clock
+        self._windows: OrderedDict[Fingerprint, _Window] = OrderedDict()
+        self._lock = threading.Lock()
+        self._timer: threading.Thread | None = None
+        self._pid: int | None = None
+        self._stopped = threading.Event()
+
+    def _ensure_timer(self) -> None:
+        if self._timer is not None and self._pid == os.getpid() and self._timer.is_alive():
+            return
+
+        with self._lock:
+            if self._timer is None or self._pid != os.getpid() or not self._timer.is_alive():
+                self._stopped.clear()
+                self._timer = threading.Thread(target=self._run, name="fastapi-problem-summaries", daemon=True)
+                self._pid = os.getpid()
+                self._timer.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self._expire()
+
+    def _expire(self) -> None:
+        """Summarise and stop tracking exceptions whose interval has passed."""
+        now = self.clock()
+        with self._lock:
+            expired = [(key, window) for key, window in self._windows.items() if now - window.start >= self.interval]
+            for key, _ in expired:
+                del self._windows[key]
+        self._summarise(expired, now)
+
+    def _summarise(self, windows: t.Iterable[tuple[Fingerprint, _Window]], now: float) -> None:
+        """Log summaries, called without holding the lock so reporting threads are not blocked on I/O."""
+        for (type_, filename, lineno), window in windows:
+            if window.suppressed:
+                self.logger.warning(
+                    "Suppressed %d identical errors in %ds: %s (%s at %s:%d)",
+                    window.suppressed,
+                    now - window.start,
+                    window.title,
+                    type_.__name__,
+                    filename,
+                    lineno,
+                    extra={"suppressed": window.suppressed},
+                )
+
+    def __call__(self, problem: Problem, exc: Exception, response: Response) -> None:
+        self._ensure_timer()
+        key = fingerprint(exc)
+        now = self.clock()
+        ended = []
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and now - window.start >= self.interval:
+                # Seen again before the timer expired the window.
+                ended.append((key, self._windows.pop(key)))
+                window = None
+
+            if window is None:
+                window = self._windows[key] = _Window(start=now, title=problem.title)
+                if len(self._windows) > self.max_fingerprints:
+                    ended.append(self._windows.popitem(last=False))
+            else:
+                self._windows.move_to_end(key)
+
+            report = window.reported < self.first
+            if report:
+                window.reported += 1
+            else:
+                window.suppressed += 1
+
+        self._summarise(ended, now)
+        if report:
+            self.reporter(problem, exc, response)
+
+    def flush(self) -> None:
+        """Log summaries for all suppressed exceptions, and reset tracking."""
+        now = self.clock()
+        with self._lock:
+            windows, self._windows = self._windows, OrderedDict()
+        self._summarise(windows.items(), now)
+
+    def close(self, timeout: float | None = None) -> None:
+        """Stop the timer, and log any outstanding summaries."""
+        self._stopped.set()
+        if self._timer is not None:
+            self._timer.join(timeout)
+            self._timer = None
+        self.flush()
+
+
+__all__ = [
+    "BackgroundReporter",
+    "DeduplicatingReporter",
+    "LogReporter",
+    "QueueReporter",
+    "Reporter",
+    "fingerprint",
+]
@@ -1,3 +1,43 @@
+from __future__ import annotations
+
+import typing as t
+
+from starlette.background import BackgroundTasks
 from starlette_problem.util import convert_status_code
 
-__all__ = ["convert_status_code"]
+if t.TYPE_CHECKING:
+    from starlette.responses import Response
+
+
+def add_background_task(response: Response, func: t.Callable[..., t.Any], *args: t.Any) -> None:  # noqa: ANN401
+    """Schedule a task to run after the response has been sent, keeping existing tasks."""
+    tasks = response.background
+    if tasks is None:
+        tasks = BackgroundTasks()
+    elif not isinstance(tasks, BackgroundTasks):
+        tasks = BackgroundTasks([tasks])
+    tasks.add_task(func, *args)
+    response.background = tasks
+
+
+def parse_quality_values(header: str) -> dict[str, float]:
+    """Map each token in an Accept style header to its quality value."""
+    qualities: dict[str, float] = {}
+    for part in header.split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[token] = quality
+    return qualities
+
+
+__all__ = ["add_background_task", "convert_status_code", "parse_quality_values"]
@@ -39,6 +39,12 @@ def tests_coverage(context):
     context.run("pytest --cov -x --cov-report=xml")
 
 
+@invoke.task
+def benchmarks(context):
+    """Run the exception handling benchmarks."""
+    context.run("python benchmarks/run.py")
+
+
 @invoke.task
 def bump(context):
     context.run("git-cliff --config pyproject.toml --bump -o CHANGELOG.md")
@@ -0,0 +1,107 @@
+import gzip
+import json
+
+import pytest
+from fastapi.exceptions import RequestValidationError
+from starlette.requests import Request
+from starlette.responses import Response
+
+from fastapi_problem import compression, handler
+
+
+@pytest.mark.parametrize(
+    ("accept_encoding", "expected"),
+    [
+        ("", None),
+        ("gzip", "gzip"),
+        ("gzip, br", "br"),
+        ("br;q=0.5, gzip", "gzip"),
+        ("br;q=0, gzip;q=0", None),
+        ("*", "br"),
+        ("*;q=0.1, br;q=0", "gzip"),
+        ("GZIP", "gzip"),
+        ("gzip;q=bad, br;q=0.1", "br"),
+        ("deflate", None),
+        (" , gzip", "gzip"),
+    ],
+)
+def test_negotiate(accept_encoding, expected):
+    assert compression.negotiate(accept_encoding, ["br", "gzip"]) == expected
+
+
+def test_gzip_stable():
+    body = b'{"openapi": "3.1.0"}' * 100
+
+    compressed = compression.compress(body, "gzip")
+
+    assert gzip.decompress(compressed) == body
+    assert compression.compress(body, "gzip") == compressed
+
+
+def test_gzip_always_available():
+    assert "gzip" in compression.available_encodings()
+
+
+class TestCompressionPostHook:
+    def run(self, hook, body, accept_encoding="gzip", headers=None):
+        request = Request({"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]})
+        response = Response(body, headers=headers)
+        return hook({}, request, response)[1]
+
+    def test_compresses_large_body(self):
+        body = b'{"errors":[]}' * 200
+
+        response = self.run(compression.CompressionPostHook(encodings=["gzip"]), body)
+
+        assert gzip.decompress(response.body) == body
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["content-length"] == str(len(response.body))
+        assert response.headers["vary"] == "Accept-Encoding"
+
+    def test_small_body_unchanged(self):
+        response = self.run(compression.CompressionPostHook(), b"{}")
+
+        assert response.body == b"{}"
+        assert "content-encoding" not in response.headers
+        assert "vary" not in response.headers
+
+    def test_not_accepted(self):
+        body = b"a" * 2048
+
+        response = self.run(compression.CompressionPostHook(), body, accept_encoding="identity")
+
+        assert response.body == body
+        assert "content-encoding" not in response.headers
+        assert response.headers["vary"] == "Accept-Encoding"
+
+    def test_existing_vary(self):
+        hook = compression.CompressionPostHook(minimum_size=1)
+
+        response = self.run(hook, b"body", headers={"vary": "Origin"})
+
+        assert response.headers["vary"] == "Origin, Accept-Encoding"
+
+    def test_already_encoded(self):
+        hook = compression.CompressionPostHook(minimum_size=1)
+
+        response = self.run(hook, b"body", headers={"content-encoding": "br"})
+
+        assert response.body == b"body"
+
+    def test_unavailable_encodings_ignored(self):
+        hook = compression.CompressionPostHook(encodings=["zstd", "gzip"])
+
+        assert hook.encodings == ("gzip",)
+
+    def test_exception_handler(self):
+        eh = handler.new_exception_handler(post_hooks=[compression.CompressionPostHook()])
+        exc = RequestValidationError([
+            {"type": "missing", "loc": ("body", i, "name"), "msg": "Field required", "input": {"id": i}}
+            for i in range(100)
+        ])
+        request = Request({"type": "http", "headers": [(b"accept-encoding", b"gzip")]})
+
+        response = eh(request, exc)
+
+        assert response.headers["content-length"] == str(len(response.body))
+        assert len(json.loads(gzip.decompress(response.body))["errors"]) == len(exc.errors())
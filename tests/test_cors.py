@@ -0,0 +1,106 @@
+import pytest
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette_problem.handler import CorsPostHook as BaseCorsPostHook
+
+from fastapi_problem import cors
+
+
+def make_request(headers):
+    return Request(
+        {
+            "type": "http",
+            "headers": [(k.encode(), v.encode()) for k, v in headers.items()],
+        },
+    )
+
+
+def make_config(allow_origins, *, allow_credentials=True, allow_origin_regex=None):
+    return cors.CorsConfiguration(
+        allow_origins=allow_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        allow_credentials=allow_credentials,
+        allow_origin_regex=allow_origin_regex,
+    )
+
+
+def headers_for(hook, headers):
+    _, response = hook({}, make_request(headers), JSONResponse({}))
+    return dict(response.headers)
+
+
+@pytest.mark.parametrize("allow_origins", [["*"], ["https://a.example.com", "https://b.example.com"]])
+@pytest.mark.parametrize("allow_credentials", [True, False])
+@pytest.mark.parametrize(
+    "headers",
+    [
+        {},
+        {"origin": "https://a.example.com"},
+        {"origin": "https://a.example.com", "cookie": "session=1"},
+        {"origin": "https://c.example.com"},
+        {"origin": "https://c.example.com", "cookie": "session=1"},
+    ],
+)
+def test_matches_base_hook(allow_origins, allow_credentials, headers):
+    config = make_config(allow_origins, allow_credentials=allow_credentials)
+
+    assert headers_for(cors.CorsPostHook(config), headers) == headers_for(BaseCorsPostHook(config), headers)
+
+
+@pytest.mark.parametrize(
+    "response_headers",
+    [
+        {"vary": "Accept"},
+        {"access-control-allow-origin": "https://other.example.com"},
+    ],
+)
+def test_existing_headers_match_base_hook(response_headers):
+    config = make_config(["https://a.example.com"])
+    request = make_request({"origin": "https://a.example.com"})
+
+    _, response = cors.CorsPostHook(config)({}, request, JSONResponse({}, headers=response_headers))
+    _, expected = BaseCorsPostHook(config)({}, request, JSONResponse({}, headers=response_headers))
+
+    assert response.raw_headers == expected.raw_headers
+
+
+def test_repeated_origin_cached():
+    hook = cors.CorsPostHook(make_config(["https://a.example.com"]))
+
+    for _ in range(3):
+        headers = headers_for(hook, {"origin": "https://a.example.com"})
+
+    assert headers["access-control-allow-origin"] == "https://a.example.com"
+    assert headers["vary"] == "Origin"
+    info = hook._headers.cache_info()
+    assert (info.hits, info.misses) == (2, 1)
+
+
+def test_cache_bounded():
+    cache_size = 2
+    hook = cors.CorsPostHook(make_config(["*"]), cache_size=cache_size)
+
+    for i in range(10):
+        headers_for(hook, {"origin": f"https://{i}.example.com"})
+
+    assert hook._headers.cache_info().currsize == cache_size
+
+
+@pytest.mark.parametrize(
+    ("allow_origin_regex", "origin", "allowed"),
+    [
+        (r"https://.*\.example\.com", "https://a.example.com", True),
+        (r"https://.*\.example\.com", "https://a.example.org", False),
+        ([r"https://.*\.example\.com", r"https://.*\.example\.org"], "https://a.example.org", True),
+        ([r"https://.*\.example\.com", r"https://.*\.example\.org"], "https://example.net", False),
+        (None, "https://listed.example.net", True),
+    ],
+)
+def test_origin_regex(allow_origin_regex, origin, allowed):
+    hook = cors.CorsPostHook(make_config(["https://listed.example.net"], allow_origin_regex=allow_origin_regex))
+
+    headers = headers_for(hook, {"origin": origin})
+
+    assert hook.is_allowed_origin(origin) is allowed
+    assert ("access-control-allow-origin" in headers) is allowed
@@ -0,0 +1,88 @@
+import json
+import sys
+from unittest import mock
+
+import pytest
+
+from fastapi_problem import encoding
+
+
+def test_json_encoder_compact():
+    assert encoding.json_encoder({"title": "é", "status": 500}) == '{"title":"é","status":500}'.encode()
+
+
+def test_resolve_encoder_default():
+    assert encoding.resolve_encoder(None) is encoding.json_encoder
+
+
+def test_resolve_encoder_callable():
+    def encoder(content):
+        return json.dumps(content).encode()
+
+    assert encoding.resolve_encoder(encoder) is encoder
+
+
+def test_resolve_encoder_named():
+    orjson = pytest.importorskip("orjson")
+
+    assert encoding.resolve_encoder("orjson") is orjson.dumps
+
+
+def test_resolve_encoder_not_installed():
+    with mock.patch.dict(sys.modules, {"orjson": None}), pytest.warns(RuntimeWarning, match="not installed"):
+        encoder = encoding.resolve_encoder("orjson")
+
+    assert encoder is encoding.json_encoder
+
+
+def test_resolve_encoder_unknown():
+    with pytest.raises(ValueError, match="Unknown encoder 'ujson'"):
+        encoding.resolve_encoder("ujson")
+
+
+def test_resolve_media_encoders_callable():
+    def encoder(content):
+        return repr(content).encode()
+
+    assert encoding.resolve_media_encoders({"application/problem+x": encoder}) == {"application/problem+x": encoder}
+
+
+def test_resolve_media_encoders_named():
+    msgpack = mock.Mock()
+    with mock.patch.dict(sys.modules, {"msgpack": msgpack}):
+        encoders = encoding.resolve_media_encoders({"application/problem+msgpack": "msgpack"})
+
+    assert encoders == {"application/problem+msgpack": msgpack.packb}
+
+
+def test_resolve_media_encoders_not_installed():
+    with mock.patch.dict(sys.modules, {"msgpack": None}), pytest.warns(RuntimeWarning, match="not be offered"):
+        encoders = encoding.resolve_media_encoders({"application/problem+msgpack": "msgpack"})
+
+    assert encoders == {}
+
+
+def test_resolve_media_encoders_unknown():
+    with pytest.raises(ValueError, match="Unknown encoder 'bson'"):
+        encoding.resolve_media_encoders({"application/problem+bson": "bson"})
+
+
+MEDIA_TYPES = ["application/problem+json", "application/problem+msgpack"]
+
+
+@pytest.mark.parametrize(
+    ("accept", "expected"),
+    [
+        ("application/problem+msgpack", "application/problem+msgpack"),
+        ("application/problem+json", "application/problem+json"),
+        ("*/*", "application/problem+json"),
+        ("application/*", "application/problem+json"),
+        ("application/problem+msgpack, */*;q=0.1", "application/problem+msgpack"),
+        ("application/problem+json;q=0.5, application/problem+msgpack;q=0.9", "application/problem+msgpack"),
+        ("application/*, application/problem+json;q=0", "application/problem+msgpack"),
+        ("text/html", None),
+        ("", None),
+    ],
+)
+def test_negotiate_media_type(accept, expected):
+    assert encoding.negotiate_media_type(accept, MEDIA_TYPES) == expected
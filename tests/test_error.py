@@ -1,3 +1,5 @@
+import http
+
 import pytest
 
 from fastapi_problem import error
@@ -42,3 +44,35 @@ def test_marshal(exc, type_):
 def test_subclass_chain():
     assert isinstance(NotFoundError("detail"), error.Problem)
     assert isinstance(NotFoundError("detail"), error.StatusProblem)
+
+
+@pytest.mark.parametrize(
+    ("problems", "status"),
+    [
+        ([NotFoundError("a"), NotFoundError("b")], 404),
+        ([NotFoundError("a"), BadRequestError("b")], 400),
+        ([NotFoundError("a"), ServerExceptionError("b")], 500),
+        ([], 400),
+    ],
+)
+def test_aggregate_status(problems, status):
+    assert error.AggregateProblem(problems=problems).status == status
+
+
+def test_aggregate_explicit_status():
+    status = http.HTTPStatus.MULTI_STATUS
+    assert error.AggregateProblem(problems=[NotFoundError("a")], status=status).status == status
+
+
+def test_aggregate_marshal():
+    e = error.AggregateProblem(problems=[NotFoundError("a"), BadRequestError("b")], type_="batch-failed")
+
+    assert e.marshal() == {
+        "type": "batch-failed",
+        "title": "Multiple problems occurred.",
+        "status": 400,
+        "errors": [
+            {"type": "not-found", "title": "a 404 message", "detail": "a", "status": 404},
+            {"type": "bad-request", "title": "a 400 message", "detail": "b", "status": 400},
+        ],
+    }
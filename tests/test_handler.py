@@ -1,12 +1,14 @@
+import decimal
 import http
 import json
 from unittest import mock
 
+import anyio
 import httpx
 import pytest
-from fastapi import Depends, FastAPI
+from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
-from fastapi.security import HTTPBearer
+from starlette.background import BackgroundTask, BackgroundTasks
 from starlette.exceptions import HTTPException
 
 from fastapi_problem import error, handler
@@ -602,388 +604,1062 @@ def test_generate_swagger_response_status_problem_strict():
     }
 
 
-async def test_customise_openapi():
+async def test_custom_http_exception_handler_in_app():
+    def custom_handler(_eh, _request, _exc) -> error.Problem:
+        return error.Problem("a problem")
+
     app = FastAPI()
 
-    app.openapi = handler.customise_openapi(app.openapi)
+    handler.add_exception_handler(
+        app=app,
+        http_exception_handler=custom_handler,
+    )
 
-    @app.get("/status")
-    async def status(_a: str) -> dict:
-        return {}
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False, client=("1.2.3.4", 123))
+    client = httpx.AsyncClient(transport=transport, base_url="https://test")
 
-    app.openapi()
-    res = app.openapi()  # ensure openapi can be called repeatedly
-    assert res["components"]["schemas"]["HTTPValidationError"] == {
-        "properties": {
-            "title": {
-                "type": "string",
-                "title": "Problem title",
-            },
-            "type": {
-                "type": "string",
-                "title": "Problem type",
-            },
-            "status": {
-                "type": "integer",
-                "title": "Status code",
-            },
-            "errors": {
-                "type": "array",
-                "items": {
-                    "$ref": "#/components/schemas/ValidationError",
-                },
-            },
-        },
-        "type": "object",
-        "required": [
-            "type",
-            "title",
-            "status",
-            "errors",
-        ],
-        "title": "RequestValidationError",
+    r = await client.get("/endpoint")
+    assert r.json() == {
+        "type": "problem",
+        "title": "a problem",
+        "status": 500,
     }
-    assert "Problem" in res["components"]["schemas"]
-    assert "ValidationError" in res["components"]["schemas"]
-
-    assert res["paths"]["/status"]["get"]["responses"] == {
-        "200": {
-            "content": {
-                "application/json": {
-                    "schema": {
-                        "additionalProperties": True,
-                        "title": "Response Status Status Get",
-                        "type": "object",
-                    },
-                },
-            },
-            "description": "Successful Response",
-        },
-        "422": {
-            "content": {
-                "application/problem+json": {
-                    "schema": {
-                        "$ref": "#/components/schemas/HTTPValidationError",
-                    },
-                },
-            },
-            "description": "Validation Error",
-        },
-        "4XX": {
-            "content": {
-                "application/problem+json": {
-                    "schema": {
-                        "$ref": "#/components/schemas/Problem",
-                    },
-                    "example": {
-                        "title": "User facing error message.",
-                        "detail": "Additional error context.",
-                        "type": "client-error-type",
-                        "status": 400,
-                    },
-                },
-            },
-            "description": "Client Error",
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "string",
+        1,
+        1.5,
+        True,
+        None,
+        ("body", 0, "field"),
+        {"error": ValueError("bad value"), "limit": decimal.Decimal("1.5")},
+        {1: "int key", None: "none key", 1.5: "float key"},
+        [b"bytes", {"nested": [decimal.Decimal(1)]}],
+    ],
+)
+def test_jsonable_matches_json_round_trip(value):
+    assert handler._jsonable(value) == json.loads(json.dumps(value, default=str))
+
+
+def test_fastapi_error_with_ctx():
+    eh = handler.new_exception_handler()
+    request = mock.Mock()
+    exc = RequestValidationError([
+        {
+            "type": "value_error",
+            "loc": ("body", "amount"),
+            "msg": "Value error, bad amount",
+            "input": decimal.Decimal("1.5"),
+            "ctx": {"error": ValueError("bad amount")},
         },
-        "5XX": {
-            "content": {
-                "application/problem+json": {
-                    "schema": {
-                        "$ref": "#/components/schemas/Problem",
-                    },
-                    "example": {
-                        "title": "User facing error message.",
-                        "detail": "Additional error context.",
-                        "type": "server-error-type",
-                        "status": 500,
-                    },
-                },
-            },
-            "description": "Server Error",
+    ])
+
+    response = eh(request, exc)
+
+    assert json.loads(response.body)["errors"] == [
+        {
+            "type": "value_error",
+            "loc": ["body", "amount"],
+            "msg": "Value error, bad amount",
+            "input": "1.5",
+            "ctx": {"error": "bad amount"},
         },
-    }
+    ]
 
 
-async def test_customise_openapi_handles_no_components_no_paths():
-    app = FastAPI()
+def validation_errors(count):
+    return [
+        {
+            "type": "missing",
+            "loc": ("body", i, "name"),
+            "msg": "Field required",
+            "input": {"id": i},
+        }
+        for i in range(count)
+    ]
 
-    app.openapi = handler.customise_openapi(app.openapi)
 
-    res = app.openapi()
-    assert res["paths"] == {}
-    assert "components" not in res
+def test_fastapi_error_within_limits():
+    eh = handler.new_exception_handler(error_limits=handler.ErrorLimits(max_errors=5, max_bytes=10_000))
+    request = mock.Mock()
+    exc = RequestValidationError(validation_errors(5))
 
+    response = eh(request, exc)
 
-async def test_customise_openapi_handles_no_components_no_422():
-    app = FastAPI()
+    content = json.loads(response.body)
+    assert len(content["errors"]) == len(exc.errors())
+    assert "truncated" not in content
+    assert "total_errors" not in content
 
-    @app.get("/status")
-    async def status() -> dict:
-        return {}
 
-    app.openapi = handler.customise_openapi(app.openapi)
+def test_fastapi_error_max_errors():
+    eh = handler.new_exception_handler(error_limits=handler.ErrorLimits(max_errors=2))
+    request = mock.Mock()
+    exc = RequestValidationError(validation_errors(10))
 
-    res = app.openapi()
+    response = eh(request, exc)
 
-    assert res["components"]["schemas"]["HTTPValidationError"] == {
-        "properties": {
-            "title": {
-                "type": "string",
-                "title": "Problem title",
-            },
-            "type": {
-                "type": "string",
-                "title": "Problem type",
-            },
-            "status": {
-                "type": "integer",
-                "title": "Status code",
-            },
-            "errors": {
-                "type": "array",
-                "items": {
-                    "$ref": "#/components/schemas/ValidationError",
-                },
-            },
-        },
-        "type": "object",
-        "required": [
-            "type",
-            "title",
-            "status",
-            "errors",
-        ],
-        "title": "RequestValidationError",
-    }
-    assert "Problem" in res["components"]["schemas"]
-
-    assert res["paths"]["/status"]["get"]["responses"] == {
-        "200": {
-            "content": {
-                "application/json": {
-                    "schema": {
-                        "additionalProperties": True,
-                        "title": "Response Status Status Get",
-                        "type": "object",
-                    },
-                },
-            },
-            "description": "Successful Response",
-        },
-        "4XX": {
-            "content": {
-                "application/problem+json": {
-                    "schema": {
-                        "$ref": "#/components/schemas/Problem",
-                    },
-                    "example": {
-                        "title": "User facing error message.",
-                        "detail": "Additional error context.",
-                        "type": "client-error-type",
-                        "status": 400,
-                    },
-                },
-            },
-            "description": "Client Error",
-        },
-        "5XX": {
-            "content": {
-                "application/problem+json": {
-                    "schema": {
-                        "$ref": "#/components/schemas/Problem",
-                    },
-                    "example": {
-                        "title": "User facing error message.",
-                        "detail": "Additional error context.",
-                        "type": "server-error-type",
-                        "status": 500,
-                    },
-                },
-            },
-            "description": "Server Error",
-        },
-    }
+    content = json.loads(response.body)
+    assert content["errors"] == [
+        {"type": "missing", "loc": ["body", 0, "name"], "msg": "Field required", "input": {"id": 0}},
+        {"type": "missing", "loc": ["body", 1, "name"], "msg": "Field required", "input": {"id": 1}},
+    ]
+    assert content["truncated"] is True
+    assert content["total_errors"] == len(exc.errors())
 
 
-async def test_customise_openapi_handles_security_components_no_422():
-    bearer_scheme = HTTPBearer(bearerFormat="JWT")
-    app = FastAPI()
+def test_fastapi_error_max_input_size():
+    eh = handler.new_exception_handler(error_limits=handler.ErrorLimits(max_input_size=10))
+    request = mock.Mock()
+    exc = RequestValidationError([
+        {"type": "string_too_long", "loc": ("body", "name"), "msg": "Too long", "input": "a" * 100},
+        {"type": "missing", "loc": ("body", "items"), "msg": "Field required", "input": {"key": "b" * 100}},
+        {"type": "missing", "loc": ("body", "id"), "msg": "Field required", "input": {}},
+    ])
 
-    @app.get("/status")
-    async def status(bearer: str = Depends(bearer_scheme)) -> dict:  # noqa: ARG001, FAST002
-        return {}
+    response = eh(request, exc)
 
-    app.openapi = handler.customise_openapi(app.openapi)
+    content = json.loads(response.body)
+    assert [e["input"] for e in content["errors"]] == ["aaaaaaaaaa...", '{"key":"bb...', {}]
+    assert content["truncated"] is True
+    assert content["total_errors"] == len(exc.errors())
 
-    res = app.openapi()
 
-    assert res["components"]["schemas"]["HTTPValidationError"] == {
-        "properties": {
-            "title": {
-                "type": "string",
-                "title": "Problem title",
-            },
-            "type": {
-                "type": "string",
-                "title": "Problem type",
-            },
-            "status": {
-                "type": "integer",
-                "title": "Status code",
-            },
-            "errors": {
-                "type": "array",
-                "items": {
-                    "$ref": "#/components/schemas/ValidationError",
-                },
+def test_fastapi_error_max_bytes():
+    limits = handler.ErrorLimits(max_bytes=256)
+    eh = handler.new_exception_handler(error_limits=limits)
+    request = mock.Mock()
+    exc = RequestValidationError(validation_errors(100))
+
+    response = eh(request, exc)
+
+    content = json.loads(response.body)
+    assert len(json.dumps(content["errors"], separators=(",", ":"))) <= limits.max_bytes
+    assert 0 < len(content["errors"]) < len(exc.errors())
+    assert content["truncated"] is True
+    assert content["total_errors"] == len(exc.errors())
+
+
+def test_fastapi_error_max_bytes_exact_fit():
+    errors = validation_errors(3)
+    size = len(json.dumps(RequestValidationError(errors).errors(), separators=(",", ":")))
+    eh = handler.new_exception_handler(error_limits=handler.ErrorLimits(max_bytes=size))
+
+    response = eh(mock.Mock(), RequestValidationError(errors))
+
+    content = json.loads(response.body)
+    assert len(content["errors"]) == len(errors)
+    assert "truncated" not in content
+
+
+def test_fastapi_error_limits_custom_wrapper():
+    eh = handler.new_exception_handler(
+        unhandled_wrappers={"422": CustomValidationError},
+        error_limits=handler.ErrorLimits(max_errors=1),
+    )
+    request = mock.Mock()
+    exc = RequestValidationError(validation_errors(3))
+
+    response = eh(request, exc)
+
+    content = json.loads(response.body)
+    assert content["type"] == "custom-validation"
+    assert len(content["errors"]) == 1
+    assert content["total_errors"] == len(exc.errors())
+
+
+class TestHandlerDispatch:
+    def test_chain_cached_per_exception_type(self):
+        def handler_(_eh, _request, exc):
+            return error.Problem(title="Handled", detail=str(exc), status=400)
+
+        eh = handler.new_exception_handler(handlers={RuntimeError: handler_})
+        with mock.patch.object(eh, "_handlers", wraps=eh._handlers) as handlers:
+            eh(mock.Mock(), RuntimeError("one"))
+            eh(mock.Mock(), RuntimeError("two"))
+
+        assert handlers.items.call_count == 1
+        assert eh._dispatch[RuntimeError] == (handler_,)
+
+    def test_chain_ordered_by_registration(self):
+        def value_handler(_eh, _request, _exc):
+            return None
+
+        def runtime_handler(_eh, _request, _exc):
+            return None
+
+        def base_handler(_eh, _request, _exc):
+            return None
+
+        eh = handler.ExceptionHandler(
+            handlers={
+                Exception: base_handler,
+                ValueError: value_handler,
+                RuntimeError: runtime_handler,
             },
-        },
-        "type": "object",
-        "required": [
-            "type",
-            "title",
-            "status",
-            "errors",
+        )
+
+        assert eh._handler_chain(RuntimeError) == (base_handler, runtime_handler)
+        assert eh._handler_chain(ValueError) == (base_handler, value_handler)
+        assert eh._handler_chain(KeyError) == (base_handler,)
+
+    @pytest.mark.parametrize(
+        "mutate",
+        [
+            lambda handlers, h: handlers.__setitem__(RuntimeError, h),
+            lambda handlers, h: handlers.update({RuntimeError: h}),
+            lambda handlers, h: handlers.setdefault(RuntimeError, h),
+            lambda handlers, h: handlers.__ior__({RuntimeError: h}),
         ],
-        "title": "RequestValidationError",
-    }
-    assert "Problem" in res["components"]["schemas"]
-    assert "securitySchemes" in res["components"]
-
-    assert res["paths"]["/status"]["get"]["responses"] == {
-        "200": {
-            "content": {
-                "application/json": {
-                    "schema": {
-                        "additionalProperties": True,
-                        "title": "Response Status Status Get",
-                        "type": "object",
-                    },
-                },
-            },
-            "description": "Successful Response",
-        },
-        "4XX": {
-            "content": {
-                "application/problem+json": {
-                    "schema": {
-                        "$ref": "#/components/schemas/Problem",
-                    },
-                    "example": {
-                        "title": "User facing error message.",
-                        "detail": "Additional error context.",
-                        "type": "client-error-type",
-                        "status": 400,
-                    },
-                },
-            },
-            "description": "Client Error",
-        },
-        "5XX": {
-            "content": {
-                "application/problem+json": {
-                    "schema": {
-                        "$ref": "#/components/schemas/Problem",
-                    },
-                    "example": {
-                        "title": "User facing error message.",
-                        "detail": "Additional error context.",
-                        "type": "server-error-type",
-                        "status": 500,
-                    },
-                },
-            },
-            "description": "Server Error",
-        },
-    }
+    )
+    def test_chain_invalidated_on_add(self, mutate):
+        def handler_(_eh, _request, exc):
+            return error.Problem(title="Handled", detail=str(exc), status=400)
 
+        eh = handler.ExceptionHandler()
+        assert eh(mock.Mock(), RuntimeError("bad")).status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
 
-async def test_customise_openapi_generic_opt_out():
-    app = FastAPI()
+        mutate(eh.handlers, handler_)
 
-    app.openapi = handler.customise_openapi(app.openapi, generic_defaults=False)
+        assert eh(mock.Mock(), RuntimeError("bad")).status_code == http.HTTPStatus.BAD_REQUEST
 
-    @app.get("/status")
-    async def status(_a: str) -> dict:
-        return {}
+    @pytest.mark.parametrize(
+        "mutate",
+        [
+            lambda handlers: handlers.pop(RuntimeError),
+            lambda handlers: handlers.__delitem__(RuntimeError),
+            lambda handlers: handlers.popitem(),
+            lambda handlers: handlers.clear(),
+        ],
+    )
+    def test_chain_invalidated_on_remove(self, mutate):
+        def handler_(_eh, _request, exc):
+            return error.Problem(title="Handled", detail=str(exc), status=400)
 
-    res = app.openapi()
-    assert res["components"]["schemas"]["HTTPValidationError"] == {
-        "properties": {
-            "title": {
-                "type": "string",
-                "title": "Problem title",
-            },
-            "type": {
-                "type": "string",
-                "title": "Problem type",
-            },
-            "status": {
-                "type": "integer",
-                "title": "Status code",
-            },
-            "errors": {
-                "type": "array",
-                "items": {
-                    "$ref": "#/components/schemas/ValidationError",
-                },
-            },
-        },
-        "type": "object",
-        "required": [
-            "type",
-            "title",
-            "status",
-            "errors",
+        eh = handler.ExceptionHandler(handlers={RuntimeError: handler_})
+        assert eh(mock.Mock(), RuntimeError("bad")).status_code == http.HTTPStatus.BAD_REQUEST
+
+        mutate(eh.handlers)
+
+        assert eh(mock.Mock(), RuntimeError("bad")).status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
+
+    def test_chain_invalidated_on_replace(self):
+        def handler_(_eh, _request, exc):
+            return error.Problem(title="Handled", detail=str(exc), status=400)
+
+        eh = handler.ExceptionHandler()
+        assert eh(mock.Mock(), RuntimeError("bad")).status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
+
+        eh.handlers = {RuntimeError: handler_}
+
+        assert eh(mock.Mock(), RuntimeError("bad")).status_code == http.HTTPStatus.BAD_REQUEST
+
+    def test_handlers_mapping_copied(self):
+        def handler_(_eh, _request, exc):
+            return error.Problem(title="Handled", detail=str(exc), status=400)
+
+        handlers = {}
+        eh = handler.ExceptionHandler(handlers=handlers)
+
+        handlers[RuntimeError] = handler_
+
+        assert RuntimeError not in eh.handlers
+        assert eh(mock.Mock(), RuntimeError("bad")).status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+class TestPrerender:
+    def test_static_problem_rendered_once(self):
+        eh = handler.new_exception_handler(
+            unhandled_wrappers={"404": error.NotFoundProblem},
+            documentation_uri_template="https://docs/errors/{type}",
+            prerender=True,
+        )
+
+        with mock.patch.object(eh, "_marshal", wraps=eh._marshal) as marshal:
+            first = eh(mock.Mock(), HTTPException(404))
+            second = eh(mock.Mock(), HTTPException(404))
+
+        assert marshal.call_count == 1
+        assert first.body == second.body
+        assert first.status_code == http.HTTPStatus.NOT_FOUND
+        assert first.headers["content-type"] == "application/problem+json"
+        assert json.loads(second.body) == {
+            "title": "Base http exception.",
+            "detail": "Not Found",
+            "type": "https://docs/errors/not-found-problem",
+            "status": 404,
+        }
+
+    def test_disabled_by_default(self):
+        eh = handler.new_exception_handler()
+
+        eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert eh._prerendered == {}
+
+    def test_detail_part_of_key(self):
+        eh = handler.new_exception_handler(prerender=True)
+
+        first = eh(mock.Mock(), SomethingWrongError("first"))
+        second = eh(mock.Mock(), SomethingWrongError("second"))
+
+        assert json.loads(first.body)["detail"] == "first"
+        assert json.loads(second.body)["detail"] == "second"
+
+    @pytest.mark.parametrize(
+        "exc",
+        [
+            SomethingWrongError("with extras", key="value"),
+            error.Problem("Not a status problem"),
         ],
-        "title": "RequestValidationError",
-    }
-    assert "Problem" in res["components"]["schemas"]
-    assert "ValidationError" in res["components"]["schemas"]
-
-    assert res["paths"]["/status"]["get"]["responses"] == {
-        "200": {
-            "content": {
-                "application/json": {
-                    "schema": {
-                        "additionalProperties": True,
-                        "title": "Response Status Status Get",
-                        "type": "object",
-                    },
-                },
-            },
-            "description": "Successful Response",
-        },
-        "422": {
-            "content": {
-                "application/problem+json": {
-                    "schema": {
-                        "$ref": "#/components/schemas/HTTPValidationError",
-                    },
-                },
-            },
-            "description": "Validation Error",
-        },
-    }
+    )
+    def test_dynamic_problems_not_cached(self, exc):
+        eh = handler.new_exception_handler(prerender=True)
 
+        eh(mock.Mock(), exc)
 
-async def test_custom_http_exception_handler_in_app():
-    def custom_handler(_eh, _request, _exc) -> error.Problem:
-        return error.Problem("a problem")
+        assert eh._prerendered == {}
+
+    def test_headers_not_cached(self):
+        eh = handler.new_exception_handler(prerender=True)
+
+        first = eh(mock.Mock(), SomethingWrongError("bad", headers={"x-first": "1"}))
+        second = eh(mock.Mock(), SomethingWrongError("bad", headers={"x-second": "2"}))
+
+        assert first.body == second.body
+        assert first.headers["x-first"] == "1"
+        assert "x-first" not in second.headers
+        assert second.headers["x-second"] == "2"
+
+    def test_post_hook_content_isolated(self):
+        def hook(content, _request, response):
+            content["mutated"] = True
+            return content, response
+
+        eh = handler.new_exception_handler(prerender=True, post_hooks=[hook])
+
+        eh(mock.Mock(), SomethingWrongError("bad"))
+        response = eh(mock.Mock(), SomethingWrongError("bad"))
+
+        assert "mutated" not in json.loads(response.body)
+
+    def test_cache_bounded(self):
+        with mock.patch.object(handler, "PRERENDER_CACHE_SIZE", 2):
+            eh = handler.new_exception_handler(prerender=True)
+
+        for i in range(5):
+            eh(mock.Mock(), SomethingWrongError(str(i)))
+
+        assert [key[1] for key in eh._prerendered] == ["3", "4"]
+
+    def test_cache_evicts_least_recently_used(self):
+        with mock.patch.object(handler, "PRERENDER_CACHE_SIZE", 2):
+            eh = handler.new_exception_handler(prerender=True)
+
+        eh(mock.Mock(), SomethingWrongError("common"))
+        for i in range(5):
+            eh(mock.Mock(), SomethingWrongError(str(i)))
+            eh(mock.Mock(), SomethingWrongError("common"))
+
+        assert [key[1] for key in eh._prerendered] == ["4", "common"]
+
+    def test_overridden_marshal_not_cached(self):
+        stamps = iter(range(2))
+
+        class StampedError(SomethingWrongError):
+            def marshal(self, *, uri="", strict=False):
+                content = super().marshal(uri=uri, strict=strict)
+                content["stamp"] = next(stamps)
+                return content
+
+        eh = handler.new_exception_handler(prerender=True)
+
+        first = eh(mock.Mock(), StampedError("bad"))
+        second = eh(mock.Mock(), StampedError("bad"))
+
+        assert eh._prerendered == {}
+        assert json.loads(first.body)["stamp"] == 0
+        assert json.loads(second.body)["stamp"] == 1
+
+    def test_overridden_type_not_cached(self):
+        class TypedError(SomethingWrongError):
+            @property
+            def type(self):
+                return "typed"
+
+        eh = handler.new_exception_handler(prerender=True)
+
+        eh(mock.Mock(), TypedError("bad"))
+
+        assert eh._prerendered == {}
+
+
+class TestEncoder:
+    def test_custom_encoder(self):
+        encoder = mock.Mock(return_value=b'{"encoded":true}')
+        eh = handler.new_exception_handler(encoder=encoder)
+
+        response = eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert response.body == b'{"encoded":true}'
+        assert response.headers["content-length"] == str(len(b'{"encoded":true}'))
+        assert encoder.call_args == mock.call({
+            "type": "something-wrong",
+            "title": "This is an error.",
+            "status": 500,
+            "detail": "something bad",
+        })
+
+    def test_named_encoder(self):
+        orjson = pytest.importorskip("orjson")
+        eh = handler.new_exception_handler(encoder="orjson")
+
+        response = eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert eh.encoder is orjson.dumps
+        assert json.loads(response.body)["detail"] == "something bad"
+
+    def test_add_exception_handler_encoder(self):
+        encoder = mock.Mock(return_value=b"{}")
+        eh = handler.new_exception_handler()
+
+        handler.add_exception_handler(FastAPI(), eh, encoder=encoder)
+
+        assert eh.encoder is encoder
+
+    def test_validation_limits_use_encoder(self):
+        encoder = mock.Mock(side_effect=lambda content: json.dumps(content).encode())
+        eh = handler.new_exception_handler(encoder=encoder, error_limits=handler.ErrorLimits(max_bytes=1024))
+
+        errors = validation_errors(2)
+
+        eh(mock.Mock(), RequestValidationError(errors))
+
+        # Each error is sized with the encoder, then the response body encoded.
+        assert encoder.call_count == len(errors) + 1
+
+
+@pytest.mark.skipif(handler.EXCEPTION_GROUP is None, reason="ExceptionGroup unavailable")
+class TestAggregate:
+    def group(self, *exceptions):
+        return handler.EXCEPTION_GROUP("batch", list(exceptions))
+
+    def test_exception_group(self):
+        eh = handler.new_exception_handler()
+        exc = self.group(
+            error.NotFoundProblem("a"),
+            self.group(error.NotFoundProblem("b"), ValueError("c")),
+        )
+
+        response = eh(mock.Mock(), exc)
+
+        assert response.status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
+        assert json.loads(response.body) == {
+            "type": "multiple-problems",
+            "title": "Multiple problems occurred.",
+            "status": 500,
+            "errors": [
+                {"type": "not-found-problem", "title": "Base http exception.", "status": 404, "detail": "a"},
+                {"type": "not-found-problem", "title": "Base http exception.", "status": 404, "detail": "b"},
+                {"type": "unhandled-exception", "title": "Unhandled exception occurred.", "status": 500, "detail": "c"},
+            ],
+        }
+
+    def test_exception_group_uses_handlers(self):
+        eh = handler.new_exception_handler(
+            handlers={KeyError: lambda _eh, _request, exc: error.NotFoundProblem(str(exc))},
+        )
+
+        response = eh(mock.Mock(), self.group(KeyError("a"), KeyError("b")))
+
+        assert response.status_code == http.HTTPStatus.NOT_FOUND
+        assert [e["status"] for e in json.loads(response.body)["errors"]] == [404, 404]
+
+    def test_custom_exception_group_handler(self):
+        eh = handler.new_exception_handler(
+            exception_group_handler=lambda _eh, _request, _exc: error.BadRequestProblem("batch"),
+        )
+
+        response = eh(mock.Mock(), self.group(ValueError("a")))
+
+        assert json.loads(response.body)["detail"] == "batch"
+
+    def test_aggregate_matches_marshal(self):
+        eh = handler.new_exception_handler(documentation_uri_template="https://docs/{type}")
+        exc = error.AggregateProblem(problems=[error.NotFoundProblem("a"), error.BadRequestProblem("b")])
+
+        response = eh(mock.Mock(), exc)
+
+        assert json.loads(response.body) == exc.marshal(uri="https://docs/{type}")
+        assert response.headers["content-length"] == str(len(response.body))
+
+    def test_max_errors(self):
+        eh = handler.new_exception_handler(error_limits=handler.ErrorLimits(max_errors=2))
+        exc = error.AggregateProblem(problems=[error.NotFoundProblem(str(i)) for i in range(10)])
+
+        response = eh(mock.Mock(), exc)
+
+        content = json.loads(response.body)
+        assert [e["detail"] for e in content["errors"]] == ["0", "1"]
+        assert content["truncated"] is True
+        assert content["total_errors"] == len(exc.problems)
+
+    def test_max_bytes(self):
+        limits = handler.ErrorLimits(max_bytes=256)
+        eh = handler.new_exception_handler(error_limits=limits)
+        exc = error.AggregateProblem(problems=[error.NotFoundProblem(str(i)) for i in range(100)])
+
+        response = eh(mock.Mock(), exc)
+
+        content = json.loads(response.body)
+        assert len(json.dumps(content["errors"], separators=(",", ":"))) <= limits.max_bytes
+        assert 0 < len(content["errors"]) < len(exc.problems)
+        assert content["total_errors"] == len(exc.problems)
+
+    def test_sub_problems_are_not_marshalled_past_limit(self):
+        eh = handler.new_exception_handler(error_limits=handler.ErrorLimits(max_errors=1))
+        skipped = mock.Mock(spec=error.Problem, status=404)
+        exc = error.AggregateProblem(problems=[error.NotFoundProblem("a"), skipped])
+
+        eh(mock.Mock(), exc)
+
+        assert skipped.marshal.call_count == 0
+
+    def test_default_limits(self):
+        eh = handler.new_exception_handler()
+        limits = handler.DEFAULT_AGGREGATE_LIMITS
+        exc = error.AggregateProblem(problems=[error.NotFoundProblem(str(i)) for i in range(limits.max_errors + 1)])
+
+        response = eh(mock.Mock(), exc)
+
+        content = json.loads(response.body)
+        assert len(content["errors"]) == limits.max_errors
+        assert content["total_errors"] == len(exc.problems)
+
+    def test_default_limits_replaced_by_error_limits(self):
+        limits = handler.ErrorLimits(max_input_size=10)
+        eh = handler.new_exception_handler(error_limits=limits)
+        exc = error.AggregateProblem(
+            problems=[error.NotFoundProblem(str(i)) for i in range(handler.DEFAULT_AGGREGATE_LIMITS.max_errors + 1)],
+        )
+
+        response = eh(mock.Mock(), exc)
+
+        assert len(json.loads(response.body)["errors"]) == len(exc.problems)
+
+    def test_post_hooks_receive_errors(self):
+        content_ = {}
+
+        def hook(content, _request, response):
+            content_.update(content)
+            return content, response
+
+        eh = handler.new_exception_handler(post_hooks=[hook])
+
+        eh(mock.Mock(), error.AggregateProblem(problems=[error.NotFoundProblem("a")]))
+
+        assert content_ == {
+            "type": "aggregate-problem",
+            "title": "Multiple problems occurred.",
+            "status": 404,
+            "errors": [{"type": "not-found-problem", "title": "Base http exception.", "status": 404, "detail": "a"}],
+        }
+
+    def test_strip_extras_keeps_errors(self):
+        eh = handler.new_exception_handler(
+            post_hooks=[
+                handler.StripExtrasPostHook(mandatory_fields=["type", "title", "status", "errors"], enabled=True),
+            ],
+        )
+        exc = error.AggregateProblem(problems=[error.NotFoundProblem("a"), error.NotFoundProblem("b")])
+
+        response = eh(mock.Mock(), exc)
+
+        assert [e["detail"] for e in json.loads(response.body)["errors"]] == ["a", "b"]
+
+    def test_errors_extra_not_duplicated(self):
+        eh = handler.new_exception_handler()
+        exc = error.AggregateProblem(problems=[error.NotFoundProblem("a")], errors="extra")
+
+        response = eh(mock.Mock(), exc)
+
+        assert response.body.count(b'"errors"') == 1
+        assert json.loads(response.body)["errors"][0]["detail"] == "a"
+
+    def test_custom_encoder(self):
+        def encoder(content):
+            return json.dumps(content, indent=2).encode() + b"\n"
+
+        eh = handler.new_exception_handler(encoder=encoder)
+        exc = error.AggregateProblem(problems=[error.NotFoundProblem("a")])
+
+        response = eh(mock.Mock(), exc)
+
+        assert response.body == encoder(exc.marshal())
+
+    def test_max_bytes_counts_separators_between_errors(self):
+        problems = [error.NotFoundProblem("a"), error.NotFoundProblem("b")]
+        errors = json.dumps([p.marshal() for p in problems], separators=(",", ":"))
+        eh = handler.new_exception_handler(error_limits=handler.ErrorLimits(max_bytes=len(errors)))
+
+        response = eh(mock.Mock(), error.AggregateProblem(problems=problems))
+
+        assert "truncated" not in json.loads(response.body)
+
+
+def repr_encoder(content):
+    return repr(content).encode()
+
+
+class TestRawHeaders:
+    def test_headers_encoded_once(self):
+        eh = handler.new_exception_handler()
+
+        first = eh(mock.Mock(), error.NotFoundProblem("a", headers={"X-Custom": "1"}))
+        second = eh(mock.Mock(), error.NotFoundProblem("b", headers={"X-Custom": "1"}))
+
+        assert first.raw_headers == [
+            (b"content-type", b"application/problem+json"),
+            (b"x-custom", b"1"),
+            (b"content-length", str(len(first.body)).encode()),
+        ]
+        assert second.headers["content-length"] == str(len(second.body))
+        assert len(eh._header_blocks) == 1
+
+    def test_distinct_headers(self):
+        eh = handler.new_exception_handler()
+
+        values = ["1", "2"]
+
+        responses = [eh(mock.Mock(), error.NotFoundProblem("a", headers={"X-Custom": value})) for value in values]
+
+        assert [response.headers["x-custom"] for response in responses] == values
+        assert len(eh._header_blocks) == len(values)
+
+    def test_no_content_length_without_body(self):
+        eh = handler.new_exception_handler()
+
+        response = eh(mock.Mock(), error.Problem("a", status=http.HTTPStatus.NOT_MODIFIED))
+
+        assert response.raw_headers == [(b"content-type", b"application/problem+json")]
+
+    def test_cache_bounded(self):
+        with mock.patch.object(handler, "HEADER_CACHE_SIZE", 2):
+            eh = handler.new_exception_handler()
+
+        for i in range(5):
+            response = eh(mock.Mock(), error.NotFoundProblem("a", headers={"X-Custom": str(i)}))
+
+        assert response.headers["x-custom"] == "4"
+        assert [dict(headers)["X-Custom"] for _, headers in eh._header_blocks] == ["3", "4"]
+
+    def test_cache_evicts_least_recently_used(self):
+        with mock.patch.object(handler, "HEADER_CACHE_SIZE", 2):
+            eh = handler.new_exception_handler()
+
+        for i in range(5):
+            eh(mock.Mock(), error.NotFoundProblem("a", headers={"Retry-After": str(i)}))
+        eh(mock.Mock(), error.NotFoundProblem("a"))
+        eh(mock.Mock(), error.NotFoundProblem("a", headers={"Retry-After": "5"}))
+
+        assert list(eh._header_blocks) == [
+            ("application/problem+json", ()),
+            ("application/problem+json", (("Retry-After", "5"),)),
+        ]
+
+    def test_cors_headers_appended(self):
+        eh = handler.new_exception_handler(
+            cors=CorsConfiguration(
+                allow_origins=["https://a.example.com"],
+                allow_methods=["*"],
+                allow_headers=["*"],
+                allow_credentials=False,
+            ),
+        )
+        request = mock.Mock(headers={"origin": "https://a.example.com"})
+
+        response = eh(request, error.NotFoundProblem("a"))
+
+        assert response.raw_headers[-2:] == [
+            (b"access-control-allow-origin", b"https://a.example.com"),
+            (b"vary", b"Origin"),
+        ]
+        assert response.headers["content-length"] == str(len(response.body))
+
+
+class TestMediaTypes:
+    def request(self, accept=None):
+        headers = {} if accept is None else {"accept": accept}
+        return mock.Mock(headers=headers)
+
+    def test_default_json(self):
+        eh = handler.new_exception_handler(media_types={"application/problem+x": repr_encoder})
+
+        response = eh(self.request(), SomethingWrongError("something bad"))
+
+        assert response.headers["content-type"] == "application/problem+json"
+        assert response.headers["vary"] == "Accept"
+        assert json.loads(response.body)["detail"] == "something bad"
+
+    def test_negotiated(self):
+        eh = handler.new_exception_handler(media_types={"application/problem+x": repr_encoder})
+
+        response = eh(self.request("application/problem+x"), SomethingWrongError("something bad"))
+
+        assert response.headers["content-type"] == "application/problem+x"
+        assert response.body == repr_encoder({
+            "type": "something-wrong",
+            "title": "This is an error.",
+            "status": 500,
+            "detail": "something bad",
+        })
+        assert response.headers["content-length"] == str(len(response.body))
+
+    def test_unacceptable_falls_back_to_json(self):
+        eh = handler.new_exception_handler(media_types={"application/problem+x": repr_encoder})
+
+        response = eh(self.request("text/html"), SomethingWrongError("something bad"))
+
+        assert response.headers["content-type"] == "application/problem+json"
+
+    def test_strip_extras_rejected(self):
+        with pytest.raises(ValueError, match="StripExtrasPostHook encodes JSON"):
+            handler.new_exception_handler(
+                media_types={"application/problem+x": repr_encoder},
+                post_hooks=[handler.StripExtrasPostHook(enabled=True)],
+            )
+
+    def test_not_configured(self):
+        eh = handler.new_exception_handler()
+
+        response = eh(self.request("application/problem+x"), SomethingWrongError("something bad"))
+
+        assert response.headers["content-type"] == "application/problem+json"
+        assert "vary" not in response.headers
+
+    def test_prerender_per_media_type(self):
+        eh = handler.new_exception_handler(media_types={"application/problem+x": repr_encoder}, prerender=True)
+
+        json_ = eh(self.request(), error.NotFoundProblem("missing"))
+        x = eh(self.request("application/problem+x"), error.NotFoundProblem("missing"))
+
+        assert json_.body != x.body
+        assert eh(self.request("application/problem+x"), error.NotFoundProblem("missing")).body == x.body
+
+    def test_aggregate(self):
+        eh = handler.new_exception_handler(
+            media_types={"application/problem+x": repr_encoder},
+            error_limits=handler.ErrorLimits(max_errors=1),
+        )
+        exc = error.AggregateProblem(problems=[error.NotFoundProblem("a"), error.NotFoundProblem("b")])
+
+        response = eh(self.request("application/problem+x"), exc)
+
+        assert response.body == repr_encoder({
+            "type": "aggregate-problem",
+            "title": "Multiple problems occurred.",
+            "status": 404,
+            "truncated": True,
+            "total_errors": 2,
+            "errors": [{"type": "not-found-problem", "title": "Base http exception.", "status": 404, "detail": "a"}],
+        })
+
+    async def test_async_handler(self):
+        async def hook(content, _request, response):
+            return content, response
+
+        eh = handler.new_exception_handler(media_types={"application/problem+x": repr_encoder}, post_hooks=[hook])
+
+        response = await eh(self.request("application/problem+x"), SomethingWrongError("something bad"))
+
+        assert response.headers["content-type"] == "application/problem+x"
+
+
+class TestAsyncHooks:
+    def test_sync_hooks_sync_handler(self):
+        eh = handler.new_exception_handler(pre_hooks=[lambda _req, _exc: None])
+
+        assert type(eh) is handler.ExceptionHandler
+
+    def test_sync_handler_rejects_async_hooks(self):
+        async def hook(_request, _exc):
+            pass
+
+        with pytest.raises(ValueError, match="Async hooks require an AsyncExceptionHandler"):
+            handler.ExceptionHandler(pre_hooks=[hook])
+
+    async def test_async_pre_hook(self):
+        m = mock.Mock()
+
+        async def hook(_request, exc):
+            m(exc.detail)
+
+        eh = handler.new_exception_handler(pre_hooks=[hook])
+        response = await eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert isinstance(eh, handler.AsyncExceptionHandler)
+        assert response.status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
+        assert m.call_args == mock.call("something bad")
+
+    async def test_async_pre_hooks_run_concurrently(self):
+        started = []
+        release = anyio.Event()
+
+        async def hook_a(_request, _exc):
+            started.append("a")
+            await release.wait()
+
+        async def hook_b(_request, _exc):
+            started.append("b")
+            # Only reachable if hook_a is waiting concurrently
+            release.set()
+
+        eh = handler.new_exception_handler(pre_hooks=[hook_a, hook_b])
+        with anyio.fail_after(1):
+            await eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert sorted(started) == ["a", "b"]
+
+    @pytest.mark.parametrize("count", [1, 2])
+    async def test_async_pre_hook_failure_is_unwrapped(self, count):
+        async def failing(_request, _exc):
+            msg = "hook failed"
+            raise RuntimeError(msg)
+
+        async def passing(_request, _exc):
+            pass
+
+        eh = handler.new_exception_handler(pre_hooks=[failing, passing][:count])
+
+        with pytest.raises(RuntimeError, match="hook failed"):
+            await eh(mock.Mock(), SomethingWrongError("something bad"))
+
+    async def test_sync_pre_hooks_run_first_in_order(self):
+        calls = []
+
+        async def async_hook(_request, _exc):
+            calls.append("async")
+
+        eh = handler.new_exception_handler(
+            pre_hooks=[
+                async_hook,
+                lambda _req, _exc: calls.append("sync-1"),
+                lambda _req, _exc: calls.append("sync-2"),
+            ],
+        )
+        await eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert calls == ["sync-1", "sync-2", "async"]
+
+    async def test_async_post_hooks(self):
+        async def async_hook(content, _request, response):
+            response.headers["x-async"] = "1"
+            return content, response
+
+        def sync_hook(content, _request, response):
+            response.headers["x-sync"] = "1"
+            return content, response
+
+        eh = handler.new_exception_handler(post_hooks=[async_hook, sync_hook])
+        response = await eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert response.headers["x-async"] == "1"
+        assert response.headers["x-sync"] == "1"
+
+    async def test_hooks_classified_once(self):
+        async def async_hook(content, _request, response):
+            return content, response
+
+        eh = handler.new_exception_handler(pre_hooks=[mock.Mock()], post_hooks=[async_hook])
+        with mock.patch.object(handler, "_is_async", wraps=handler._is_async) as is_async:
+            await eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert is_async.call_count == 0
+
+    async def test_hooks_reclassified_on_assignment(self):
+        async def async_hook(content, _request, response):
+            response.headers["x-async"] = "1"
+            return content, response
+
+        eh = handler.new_exception_handler(post_hooks=[async_hook])
+        eh.post_hooks = [async_hook, lambda content, _request, response: (content, response)]
+        response = await eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert response.headers["x-async"] == "1"
+
+    async def test_thread_pool_hook(self):
+        m = mock.Mock()
+
+        eh = handler.new_exception_handler(pre_hooks=[handler.ThreadPoolHook(m)])
+        await eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert isinstance(eh, handler.AsyncExceptionHandler)
+        assert m.call_count == 1
+
+    async def test_thread_pool_post_hook(self):
+        def hook(content, _request, response):
+            response.headers["x-thread"] = "1"
+            return content, response
+
+        eh = handler.new_exception_handler(post_hooks=[handler.ThreadPoolHook(hook)])
+        response = await eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert response.headers["x-thread"] == "1"
+
+    @pytest.mark.parametrize("asynchronous", [True, False])
+    async def test_background_hook(self, asynchronous):
+        m = mock.Mock()
+        hooks = [handler.BackgroundHook(m)]
+        if asynchronous:
+            hooks.append(handler.ThreadPoolHook(mock.Mock()))
+
+        eh = handler.new_exception_handler(pre_hooks=hooks)
+        response = eh(mock.Mock(), SomethingWrongError("something bad"))
+        if asynchronous:
+            response = await response
+
+        assert m.call_count == 0
+        await response.background()
+        assert m.call_count == 1
+
+    def test_background_hook_extends_existing_background(self):
+        m = mock.Mock()
+
+        def post_hook(content, _request, response):
+            response.background = BackgroundTask(m, "post")
+            return content, response
+
+        eh = handler.new_exception_handler(pre_hooks=[handler.BackgroundHook(m)], post_hooks=[post_hook])
+        response = eh(mock.Mock(), SomethingWrongError("something bad"))
+
+        assert isinstance(response.background, BackgroundTasks)
+        post, pre = response.background.tasks
+        assert post.args == ("post",)
+        assert pre.func is m
+
+
+async def test_async_exception_handler_in_app():
+    m = mock.Mock()
+
+    async def pre_hook(_req, exc):
+        m("pre-hook", exc.detail)
 
     app = FastAPI()
+    eh = handler.new_exception_handler(pre_hooks=[pre_hook, handler.BackgroundHook(m)])
+    handler.add_exception_handler(app, eh)
 
-    handler.add_exception_handler(
-        app=app,
-        http_exception_handler=custom_handler,
-    )
+    @app.get("/error")
+    async def raise_error() -> dict:
+        msg = "something bad"
+        raise SomethingWrongError(msg)
 
     transport = httpx.ASGITransport(app=app, raise_app_exceptions=False, client=("1.2.3.4", 123))
     client = httpx.AsyncClient(transport=transport, base_url="https://test")
 
-    r = await client.get("/endpoint")
-    assert r.json() == {
-        "type": "problem",
-        "title": "a problem",
-        "status": 500,
-    }
+    r = await client.get("/error")
+
+    assert r.status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
+    assert r.json()["detail"] == "something bad"
+    pre_hook_call, background_call = m.call_args_list
+    assert pre_hook_call == mock.call("pre-hook", "something bad")
+    assert background_call.args[1].detail == "something bad"
+
+
+class TestSwaggerResponseCache:
+    def test_classes_cached(self):
+        eh = handler.new_exception_handler()
+
+        with mock.patch.object(error.BadRequestProblem, "marshal", autospec=True) as marshal:
+            marshal.return_value = {"title": "Bad request.", "type": "bad-request", "status": 400}
+            first = eh.generate_swagger_response(error.BadRequestProblem, CustomValidationError)
+            second = eh.generate_swagger_response(error.BadRequestProblem, CustomValidationError)
+
+        assert first is second
+
+    def test_cache_keyed_on_uri_and_strict(self):
+        default = handler.new_exception_handler()
+        uri = handler.new_exception_handler(documentation_uri_template="https://docs/{type}")
+        strict = handler.new_exception_handler(strict_rfc9457=True, documentation_uri_template="https://docs/{type}")
+
+        responses = [eh.generate_swagger_response(error.BadRequestProblem) for eh in (default, uri, strict)]
+
+        assert len({id(response) for response in responses}) == len(responses)
+        assert responses[0]["content"]["application/problem+json"]["example"]["type"] == "bad-request-problem"
+        assert (
+            responses[1]["content"]["application/problem+json"]["example"]["type"] == "https://docs/bad-request-problem"
+        )
+
+    def test_instances_not_cached(self):
+        eh = handler.new_exception_handler()
+
+        first = eh.generate_swagger_response(error.BadRequestProblem("one"))
+        second = eh.generate_swagger_response(error.BadRequestProblem("two"))
+
+        assert first is not second
+        assert second["content"]["application/problem+json"]["example"]["detail"] == "two"
+
+    def test_shared_responses(self):
+        eh = handler.new_exception_handler(shared_swagger_responses=True)
+
+        class BadRequestProblem(error.BadRequestProblem):
+            title = "Other bad request."
+
+        ref = eh.generate_swagger_response(error.BadRequestProblem)
+        assert eh.generate_swagger_response(error.BadRequestProblem) is ref
+        other = eh.generate_swagger_response(BadRequestProblem)
+        multiple = eh.generate_swagger_response(error.BadRequestProblem, CustomValidationError)
+        instance = eh.generate_swagger_response(error.BadRequestProblem("detail"))
+
+        assert ref == {"$ref": "#/components/responses/BadRequestProblem"}
+        assert other == {"$ref": "#/components/responses/BadRequestProblem2"}
+        assert multiple == {"$ref": "#/components/responses/BadRequestProblemCustomValidationError"}
+        assert "content" in instance
+        assert list(eh.swagger_responses) == [
+            "BadRequestProblem",
+            "BadRequestProblem2",
+            "BadRequestProblemCustomValidationError",
+        ]
+
+    async def test_shared_responses_in_app(self):
+        app = FastAPI()
+        eh = handler.new_exception_handler(shared_swagger_responses=True)
+        handler.add_exception_handler(app, eh)
+
+        @app.get("/a", responses={400: eh.generate_swagger_response(error.BadRequestProblem)})
+        async def a() -> dict:
+            return {}
+
+        @app.get("/b", responses={400: eh.generate_swagger_response(error.BadRequestProblem)})
+        async def b() -> dict:
+            return {}
+
+        res = app.openapi()
+
+        for path in ("/a", "/b"):
+            assert res["paths"][path]["get"]["responses"]["400"]["$ref"] == "#/components/responses/BadRequestProblem"
+        shared = res["components"]["responses"]["BadRequestProblem"]
+        assert shared["content"]["application/problem+json"]["example"]["type"] == "bad-request-problem"
+
+    async def test_shared_responses_keep_generic_names(self):
+        app = FastAPI()
+        eh = handler.new_exception_handler(shared_swagger_responses=True)
+        handler.add_exception_handler(app, eh)
+
+        class ServerError(error.ServerProblem):
+            title = "Custom server error."
+
+        @app.get("/a", responses={500: eh.generate_swagger_response(ServerError)})
+        async def a() -> dict:
+            return {}
+
+        res = app.openapi()
+
+        operation = res["paths"]["/a"]["get"]["responses"]
+        assert operation["500"]["$ref"] == "#/components/responses/ServerError2"
+        assert operation["5XX"] == {"$ref": "#/components/responses/ServerError"}
+        responses = res["components"]["responses"]
+        assert responses["ServerError"]["description"] == "Server Error"
+        assert responses["ServerError2"]["content"]["application/problem+json"]["example"]["title"] == ServerError.title
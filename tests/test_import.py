@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Budget for the import time added by fastapi_problem.handler, once fastapi is
+# imported. Override with FASTAPI_PROBLEM_IMPORT_BUDGET_MS on slow runners.
+IMPORT_BUDGET_MS = float(os.environ.get("FASTAPI_PROBLEM_IMPORT_BUDGET_MS", "100"))
+
+
+@pytest.fixture(scope="module")
+def env(tmp_path_factory):
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    env["PYTHONPYCACHEPREFIX"] = str(tmp_path_factory.mktemp("pycache"))
+    return env
+
+
+def run(code, env, *args):
+    return subprocess.run(  # noqa: S603
+        [sys.executable, *args, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+
+
+def test_openapi_not_imported(env):
+    result = run(
+        "import sys, fastapi_problem.handler; print(sorted(m for m in sys.modules if m.endswith('openapi')))",
+        env,
+    )
+
+    assert "fastapi_problem.openapi" not in result.stdout
+    assert "rfc9457.openapi" not in result.stdout
+
+
+def test_openapi_not_imported_by_add_exception_handler(env):
+    code = """
+import sys
+from fastapi import FastAPI
+from fastapi_problem.handler import add_exception_handler, new_exception_handler
+
+app = FastAPI()
+add_exception_handler(app, new_exception_handler())
+print("fastapi_problem.openapi" in sys.modules)
+app.openapi()
+print("fastapi_problem.openapi" in sys.modules)
+"""
+    result = run(code, env)
+
+    assert result.stdout.split() == ["False", "True"]
+
+
+def test_openapi_lazy_attributes():
+    from fastapi_problem import handler, openapi  # noqa: PLC0415
+
+    assert handler.customise_openapi is openapi.customise_openapi
+    with pytest.raises(AttributeError, match="has no attribute 'missing'"):
+        handler.missing  # noqa: B018
+
+
+def test_import_budget(env):
+    code = "import fastapi; import fastapi_problem.handler"
+    run(code, env)  # Warm the bytecode cache.
+
+    timings = []
+    for _ in range(3):
+        stderr = run(code, env, "-X", "importtime").stderr
+        line = next(line for line in stderr.splitlines() if line.endswith("| fastapi_problem.handler"))
+        timings.append(int(line.split("|")[1]) / 1000)
+
+    assert min(timings) < IMPORT_BUDGET_MS
@@ -0,0 +1,282 @@
+import multiprocessing
+import threading
+from pathlib import Path
+from unittest import mock
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from fastapi_problem import error, handler, metrics
+
+
+class SomethingWrongError(error.ServerProblem):
+    title = "This is an error."
+
+
+class UserNotFoundError(error.NotFoundProblem):
+    title = "User not found."
+
+
+def make_request(path="/users/{user_id}"):
+    return mock.Mock(scope={"route": mock.Mock(path=path)})
+
+
+def test_route_template():
+    assert metrics.route_template(make_request()) == "/users/{user_id}"
+    assert metrics.route_template(mock.Mock(scope={})) == ""
+
+
+def test_observe_counts_by_labels():
+    m = metrics.ProblemMetrics()
+
+    m.observe(UserNotFoundError("a"), make_request(), 0.0001)
+    m.observe(UserNotFoundError("b"), make_request(), 0.002)
+    m.observe(SomethingWrongError("c"), make_request("/other"), 1.0)
+
+    snapshot = m.snapshot()
+
+    assert snapshot.counts == {
+        (404, "user-not-found", "/users/{user_id}"): 2,
+        (500, "something-wrong", "/other"): 1,
+    }
+    assert snapshot.count == sum(snapshot.counts.values())
+    assert snapshot.sum == 0.0001 + 0.002 + 1.0
+    assert snapshot.bucket_counts == [1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 3]
+
+
+def test_snapshot_combines_threads():
+    m = metrics.ProblemMetrics(buckets=[1.0])
+
+    def observe():
+        for _ in range(100):
+            m.observe(UserNotFoundError("a"), make_request(), 0.5)
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    snapshot = m.snapshot()
+    assert snapshot.counts == {(404, "user-not-found", "/users/{user_id}"): 400}
+    assert snapshot.bucket_counts == [400, 400]
+
+
+def test_exited_threads_are_retired():
+    m = metrics.ProblemMetrics(buckets=[1.0])
+    threads = [
+        threading.Thread(target=m.observe, args=(UserNotFoundError("a"), make_request(), 0.5)) for _ in range(50)
+    ]
+
+    for thread in threads:
+        thread.start()
+        thread.join()
+
+    assert m._shards == []
+    snapshot = m.snapshot()
+    assert snapshot.counts == {(404, "user-not-found", "/users/{user_id}"): len(threads)}
+    assert snapshot.bucket_counts == [len(threads), len(threads)]
+
+
+def test_render_prometheus():
+    m = metrics.ProblemMetrics(buckets=[0.1])
+    m.observe(UserNotFoundError("a"), make_request('/"quoted"'), 0.5)
+
+    assert m.render_prometheus() == (
+        "# HELP fastapi_problem_problems_total Problems emitted by the exception handler.\n"
+        "# TYPE fastapi_problem_problems_total counter\n"
+        'fastapi_problem_problems_total{status="404",type="user-not-found",route="/\\"quoted\\""} 1\n'
+        "# HELP fastapi_problem_handler_duration_seconds Time from exception to response built.\n"
+        "# TYPE fastapi_problem_handler_duration_seconds histogram\n"
+        'fastapi_problem_handler_duration_seconds_bucket{le="0.1"} 0\n'
+        'fastapi_problem_handler_duration_seconds_bucket{le="+Inf"} 1\n'
+        "fastapi_problem_handler_duration_seconds_sum 0.5\n"
+        "fastapi_problem_handler_duration_seconds_count 1\n"
+    )
+
+
+def test_handler_observes():
+    m = mock.Mock()
+    eh = handler.new_exception_handler(metrics=m)
+    request = make_request()
+
+    eh(request, UserNotFoundError("a"))
+
+    problem, observed_request, elapsed = m.observe.call_args[0]
+    assert isinstance(problem, UserNotFoundError)
+    assert observed_request is request
+    assert elapsed > 0
+
+
+async def test_async_handler_observes():
+    async def pre_hook(_request, _exc):
+        pass
+
+    m = metrics.ProblemMetrics()
+    eh = handler.new_exception_handler(metrics=m, pre_hooks=[pre_hook])
+
+    await eh(make_request(), UserNotFoundError("a"))
+
+    assert m.snapshot().count == 1
+
+
+async def test_metrics_in_app():
+    m = metrics.ProblemMetrics()
+    app = FastAPI()
+    handler.add_exception_handler(app, handler.new_exception_handler(metrics=m))
+
+    @app.get("/users/{user_id}")
+    async def get_user(user_id: str) -> dict:
+        raise UserNotFoundError(user_id)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    client = httpx.AsyncClient(transport=transport, base_url="https://test")
+    await client.get("/users/1")
+    await client.get("/users/2")
+    await client.get("/missing")
+
+    assert m.snapshot().counts == {
+        (404, "user-not-found", "/users/{user_id}"): 2,
+        (404, "http-not-found", ""): 1,
+    }
+
+
+def observe_in_worker(directory, count):
+    counters = metrics.SharedProblemCounters(directory)
+    for i in range(count):
+        counters.observe(UserNotFoundError(str(i)), make_request(), 0.0)
+
+
+class TestSharedProblemCounters:
+    def test_totals(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path)
+
+        counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+        counters.observe(UserNotFoundError("b"), make_request(), 0.0)
+        counters.observe(SomethingWrongError("c"), make_request(), 0.0)
+
+        assert counters.totals() == {(404, "user-not-found"): 2, (500, "something-wrong"): 1}
+
+    def test_totals_across_processes(self, tmp_path):
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=observe_in_worker, args=(tmp_path, 10)) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        counters = metrics.SharedProblemCounters(tmp_path)
+        counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+
+        assert len(list(tmp_path.iterdir())) == len(workers) + 1
+        assert counters.totals() == {(404, "user-not-found"): 31}
+
+    def test_reopen_keeps_counts(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path)
+        counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+        counters.close()
+
+        counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+
+        assert counters.totals() == {(404, "user-not-found"): 2}
+
+    def test_reopen_replaces_file(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path)
+        counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+        counters.close()
+
+        with next(tmp_path.glob("problems_*.db")).open("rb") as f:
+            counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+            # The previous file is replaced rather than truncated in place.
+            assert list(metrics._read_slots(f.read())) == [(1, 404, "user-not-found")]
+
+    def test_file_per_thread(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path)
+        # Keep every thread alive until all have observed, so thread ids are not reused.
+        barrier = threading.Barrier(3)
+
+        def observe():
+            counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+            barrier.wait()
+
+        threads = [threading.Thread(target=observe) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(list(tmp_path.glob("problems_*.db"))) == len(threads)
+        assert counters.totals() == {(404, "user-not-found"): 3}
+
+    @pytest.mark.skipif(not Path("/proc/self/fd").exists(), reason="Requires /proc")
+    def test_files_reused_by_new_threads(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path)
+        used = set()
+
+        def observe():
+            counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+            used.add(counters._local.file)
+
+        threads = [threading.Thread(target=observe) for _ in range(200)]
+        fds = []
+        for thread in threads:
+            thread.start()
+            thread.join()
+            fds.append(len(list(Path("/proc/self/fd").iterdir())))
+
+        # Each thread exits before the next starts, so they all share the first thread's file.
+        assert set(fds) == {fds[0]}
+        assert len(used) == 1
+        assert len(counters._files) == 1
+        assert counters.totals() == {(404, "user-not-found"): len(threads)}
+
+    def test_overflow(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path, slots=2)
+
+        counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+        counters.observe(SomethingWrongError("b"), make_request(), 0.0)
+        counters.observe(error.BadRequestProblem("c"), make_request(), 0.0)
+
+        assert counters.totals() == {(404, "user-not-found"): 1, (0, "other"): 2}
+
+    def test_long_type_truncated(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path)
+
+        counters.observe(error.Problem("a", type_="é" * 100), make_request(), 0.0)
+
+        assert counters.totals() == {(500, "é" * 56): 1}
+
+    def test_ignores_unknown_files(self, tmp_path):
+        (tmp_path / "problems_1.db").write_bytes(b"garbage")
+        counters = metrics.SharedProblemCounters(tmp_path)
+
+        assert counters.totals() == {}
+
+    def test_clear(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path)
+        counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+
+        counters.clear()
+
+        assert counters.totals() == {}
+        counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+        assert counters.totals() == {(404, "user-not-found"): 1}
+
+    def test_render_prometheus(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path)
+        counters.observe(UserNotFoundError("a"), make_request(), 0.0)
+
+        assert counters.render_prometheus() == (
+            "# HELP fastapi_problem_problems_total Problems emitted by the exception handler.\n"
+            "# TYPE fastapi_problem_problems_total counter\n"
+            'fastapi_problem_problems_total{status="404",type="user-not-found"} 1\n'
+        )
+
+    def test_exception_handler(self, tmp_path):
+        counters = metrics.SharedProblemCounters(tmp_path)
+        eh = handler.new_exception_handler(metrics=counters)
+
+        eh(make_request(), UserNotFoundError("a"))
+
+        assert counters.totals() == {(404, "user-not-found"): 1}
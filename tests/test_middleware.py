@@ -0,0 +1,153 @@
+import http
+import json
+from unittest import mock
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from starlette.responses import StreamingResponse
+
+from fastapi_problem import error, handler
+from fastapi_problem.middleware import ProblemMiddleware
+
+
+class UserNotFoundError(error.NotFoundProblem):
+    title = "User not found."
+
+
+def make_app(eh):
+    app = FastAPI()
+    handler.add_exception_handler(app, eh, middleware=True)
+
+    @app.get("/problem")
+    def problem() -> None:
+        msg = "User 1 does not exist."
+        raise UserNotFoundError(msg)
+
+    @app.get("/server-problem")
+    def server_problem() -> None:
+        msg = "Something went wrong."
+        raise error.ServerProblem(msg)
+
+    @app.get("/unhandled")
+    async def unhandled() -> None:
+        msg = "Something went wrong."
+        raise RuntimeError(msg)
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int) -> int:
+        return item_id
+
+    @app.get("/stream")
+    def stream() -> StreamingResponse:
+        def body():
+            yield b"partial"
+            msg = "Stream failed."
+            raise RuntimeError(msg)
+
+        return StreamingResponse(body())
+
+    return app
+
+
+def make_client(app, *, raise_app_exceptions=False):
+    # Unhandled exceptions are re-raised once the response is sent, like a server the transport suppresses them.
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=raise_app_exceptions)
+    return httpx.AsyncClient(transport=transport, base_url="https://test")
+
+
+@pytest.mark.parametrize(
+    ("path", "status", "type_"),
+    [
+        ("/problem", 404, "user-not-found"),
+        ("/unhandled", 500, "unhandled-exception"),
+        ("/items/a", 422, "request-validation-failed"),
+        ("/missing", 404, "http-not-found"),
+    ],
+)
+async def test_problem_responses(path, status, type_):
+    app = make_app(handler.new_exception_handler())
+
+    async with make_client(app) as client:
+        response = await client.get(path)
+
+    assert response.status_code == status
+    assert response.headers["content-type"] == "application/problem+json"
+    assert response.json()["type"] == type_
+
+
+async def test_not_registered_for_exception():
+    app = make_app(handler.new_exception_handler())
+
+    assert Exception not in app.exception_handlers
+    assert [m.cls for m in app.user_middleware] == [ProblemMiddleware]
+
+
+async def test_async_exception_handler():
+    async def hook(content, _request, response):
+        response.headers["x-hook"] = "async"
+        return content, response
+
+    app = make_app(handler.new_exception_handler(post_hooks=[hook]))
+
+    async with make_client(app) as client:
+        response = await client.get("/unhandled")
+
+    assert response.status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
+    assert response.headers["x-hook"] == "async"
+
+
+async def test_hooks_and_reporting():
+    logger = mock.Mock()
+    pre_hook = mock.Mock()
+    app = make_app(handler.new_exception_handler(logger=logger, pre_hooks=[pre_hook]))
+
+    async with make_client(app) as client:
+        await client.get("/unhandled")
+
+    assert pre_hook.call_count == 1
+    assert logger.exception.call_count == 1
+
+
+async def test_unhandled_reraised_after_response():
+    app = make_app(handler.new_exception_handler())
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/unhandled", "headers": [], "query_string": b""}
+    with pytest.raises(RuntimeError, match="Something went wrong"):
+        await app(scope, mock.AsyncMock(return_value={"type": "http.request"}), send)
+
+    assert messages[0]["status"] == http.HTTPStatus.INTERNAL_SERVER_ERROR
+    assert json.loads(messages[1]["body"])["type"] == "unhandled-exception"
+
+
+@pytest.mark.parametrize("path", ["/problem", "/server-problem"])
+async def test_problems_not_reraised(path):
+    app = make_app(handler.new_exception_handler())
+
+    async with make_client(app, raise_app_exceptions=True) as client:
+        response = await client.get(path)
+
+    assert response.headers["content-type"] == "application/problem+json"
+
+
+async def test_reraised_after_response_started():
+    app = make_app(handler.new_exception_handler())
+
+    async with make_client(app, raise_app_exceptions=True) as client:
+        with pytest.raises(RuntimeError, match="Stream failed"):
+            await client.get("/stream")
+
+
+async def test_non_http_passthrough():
+    app = mock.AsyncMock(side_effect=RuntimeError("websocket error"))
+    middleware = ProblemMiddleware(app, handler.new_exception_handler())
+    scope = {"type": "websocket"}
+
+    with pytest.raises(RuntimeError, match="websocket error"):
+        await middleware(scope, mock.Mock(), mock.Mock())
+
+    assert app.call_args[0][0] is scope
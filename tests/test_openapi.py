@@ -0,0 +1,800 @@
+import gzip
+import http
+import json
+import sys
+from unittest import mock
+
+import httpx
+import pytest
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.security import HTTPBearer
+from pydantic import BaseModel, create_model
+
+from fastapi_problem import error, handler, openapi
+
+
+class UserNotFoundError(error.NotFoundProblem):
+    title = "User not found."
+
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    handler.add_exception_handler(app, handler.new_exception_handler())
+
+    @app.get("/users/{user_id}")
+    async def get_user(user_id: str) -> dict:
+        raise UserNotFoundError(user_id)
+
+    return app
+
+
+def client_for(app):
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="https://test")
+
+
+async def test_serves_customised_schema(app):
+    expected = app.openapi()
+    openapi.serve_openapi(app)
+
+    r = await client_for(app).get("/openapi.json", headers={"accept-encoding": "identity"})
+
+    assert r.status_code == http.HTTPStatus.OK
+    assert r.json() == expected
+    assert "content-encoding" not in r.headers
+    assert r.headers["etag"].startswith('W/"')
+    assert r.headers["vary"] == "Accept-Encoding"
+    assert r.headers["cache-control"] == "no-cache"
+    assert len([route for route in app.router.routes if getattr(route, "path", None) == "/openapi.json"]) == 1
+
+
+async def test_serves_gzip(app):
+    openapi.serve_openapi(app, encodings=["gzip"])
+
+    async with client_for(app) as client:
+        request = client.build_request("GET", "/openapi.json", headers={"accept-encoding": "gzip"})
+        r = await client.send(request, stream=True)
+        raw = b"".join([chunk async for chunk in r.aiter_raw()])
+
+    assert r.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(raw)) == app.openapi()
+
+
+async def test_if_none_match(app):
+    openapi.serve_openapi(app)
+    client = client_for(app)
+
+    etag = (await client.get("/openapi.json")).headers["etag"]
+    r = await client.get("/openapi.json", headers={"if-none-match": etag})
+
+    assert r.status_code == http.HTTPStatus.NOT_MODIFIED
+    assert r.content == b""
+    assert r.headers["etag"] == etag
+
+    r = await client.get("/openapi.json", headers={"if-none-match": 'W/"other", ' + etag.removeprefix("W/")})
+    assert r.status_code == http.HTTPStatus.NOT_MODIFIED
+
+    r = await client.get("/openapi.json", headers={"if-none-match": '"other"'})
+    assert r.status_code == http.HTTPStatus.OK
+
+
+async def test_rendered_once(app):
+    endpoint = openapi.serve_openapi(app)
+    client = client_for(app)
+
+    await client.get("/openapi.json")
+    rendered = endpoint.build()
+    await client.get("/openapi.json")
+
+    assert endpoint.build() is rendered
+
+
+async def test_rerendered_when_routes_change(app):
+    openapi.serve_openapi(app)
+    client = client_for(app)
+    etag = (await client.get("/openapi.json")).headers["etag"]
+
+    @app.get("/other")
+    async def other() -> dict:
+        return {}
+
+    r = await client.get("/openapi.json", headers={"if-none-match": etag})
+
+    assert r.status_code == http.HTTPStatus.OK
+    assert "/other" in r.json()["paths"]
+
+
+async def test_revalidation_skips_schema_generation(app):
+    openapi.serve_openapi(app)
+    client = client_for(app)
+    etag = (await client.get("/openapi.json")).headers["etag"]
+
+    with mock.patch.object(app, "openapi", wraps=app.openapi) as openapi_:
+        r = await client.get("/openapi.json", headers={"if-none-match": etag})
+
+    assert r.status_code == http.HTTPStatus.NOT_MODIFIED
+    assert openapi_.call_count == 0
+
+
+async def test_rerendered_when_schema_cleared(app):
+    endpoint = openapi.serve_openapi(app)
+    client = client_for(app)
+    await client.get("/openapi.json")
+    rendered = endpoint.build()
+
+    app.openapi_schema = None
+
+    assert endpoint.build() is not rendered
+
+
+async def test_root_path(app):
+    openapi.serve_openapi(app)
+    transport = httpx.ASGITransport(app=app, root_path="/api")
+    client = httpx.AsyncClient(transport=transport, base_url="https://test")
+
+    r = await client.get("/api/openapi.json")
+
+    assert r.json()["servers"] == [{"url": "/api"}]
+    assert "servers" not in app.openapi()
+
+
+def test_requires_openapi_url():
+    with pytest.raises(ValueError, match="openapi_url is not set"):
+        openapi.serve_openapi(FastAPI(openapi_url=None))
+
+
+def test_unavailable_encodings_ignored(app):
+    endpoint = openapi.serve_openapi(app, encodings=["gzip", "zstd"])
+
+    assert endpoint.encodings == ("gzip",)
+
+
+APP_MODULE = """
+from fastapi import FastAPI
+
+from fastapi_problem import error, handler
+
+
+class UserNotFoundError(error.NotFoundProblem):
+    title = "User not found."
+
+
+app = FastAPI()
+eh = handler.new_exception_handler()
+handler.add_exception_handler(app, eh)
+
+
+@app.get("/users/{user_id}", responses={404: eh.generate_swagger_response(UserNotFoundError)})
+async def get_user(user_id: str) -> dict:
+    raise UserNotFoundError(user_id)
+"""
+
+
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch):
+    (tmp_path / "cli_app.py").write_text(APP_MODULE)
+    monkeypatch.setattr("sys.path", list(sys.path))
+    yield tmp_path
+    sys.modules.pop("cli_app", None)
+
+
+def test_cli_writes_schema(app_dir):
+    output = app_dir / "openapi.json"
+
+    openapi.main(["cli_app:app", "--app-dir", str(app_dir), "-o", str(output)])
+
+    schema = json.loads(output.read_bytes())
+    responses = schema["paths"]["/users/{user_id}"]["get"]["responses"]
+    assert responses["4XX"] == {"$ref": "#/components/responses/ClientError"}
+    assert "application/problem+json" in responses["422"]["content"]
+    assert responses["404"]["content"]["application/problem+json"]["example"]["type"] == "user-not-found"
+
+
+def test_cli_writes_stdout(app_dir, capsys):
+    openapi.main(["cli_app:app", "--app-dir", str(app_dir), "--indent", "2"])
+
+    out = capsys.readouterr().out
+    assert out.startswith('{\n  "openapi"')
+    assert "/users/{user_id}" in json.loads(out)["paths"]
+
+
+@pytest.mark.parametrize("path", ["cli_app", "cli_app:missing", "missing:app"])
+def test_cli_invalid_app(app_dir, path, capsys):
+    with pytest.raises(SystemExit):
+        openapi.main([path, "--app-dir", str(app_dir)])
+
+    assert "error:" in capsys.readouterr().err
+
+
+async def test_serve_schema_file(app, tmp_path):
+    schema_file = tmp_path / "openapi.json"
+    schema_file.write_bytes(b'{"openapi":"3.1.0","paths":{}}')
+    openapi.serve_openapi(app, schema_file=schema_file)
+
+    with mock.patch.object(app, "openapi") as generate:
+        r = await client_for(app).get("/openapi.json")
+
+    assert generate.call_count == 0
+    assert r.content == b'{"openapi":"3.1.0","paths":{}}'
+
+    transport = httpx.ASGITransport(app=app, root_path="/api")
+    client = httpx.AsyncClient(transport=transport, base_url="https://test")
+    r = await client.get("/api/openapi.json")
+
+    assert r.json() == {"openapi": "3.1.0", "paths": {}, "servers": [{"url": "/api"}]}
+
+
+async def test_customise_openapi():
+    app = FastAPI()
+
+    app.openapi = openapi.customise_openapi(app.openapi)
+
+    @app.get("/status")
+    async def status(_a: str) -> dict:
+        return {}
+
+    app.openapi()
+    res = app.openapi()  # ensure openapi can be called repeatedly
+    assert res["components"]["schemas"]["HTTPValidationError"] == {
+        "properties": {
+            "title": {
+                "type": "string",
+                "title": "Problem title",
+            },
+            "type": {
+                "type": "string",
+                "title": "Problem type",
+            },
+            "status": {
+                "type": "integer",
+                "title": "Status code",
+            },
+            "errors": {
+                "type": "array",
+                "items": {
+                    "$ref": "#/components/schemas/ValidationError",
+                },
+            },
+        },
+        "type": "object",
+        "required": [
+            "type",
+            "title",
+            "status",
+            "errors",
+        ],
+        "title": "RequestValidationError",
+    }
+    assert "Problem" in res["components"]["schemas"]
+    assert "ValidationError" in res["components"]["schemas"]
+
+    assert res["paths"]["/status"]["get"]["responses"] == {
+        "200": {
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "additionalProperties": True,
+                        "title": "Response Status Status Get",
+                        "type": "object",
+                    },
+                },
+            },
+            "description": "Successful Response",
+        },
+        "422": {
+            "content": {
+                "application/problem+json": {
+                    "schema": {
+                        "$ref": "#/components/schemas/HTTPValidationError",
+                    },
+                },
+            },
+            "description": "Validation Error",
+        },
+        "4XX": {
+            "$ref": "#/components/responses/ClientError",
+        },
+        "5XX": {
+            "$ref": "#/components/responses/ServerError",
+        },
+    }
+    assert res["components"]["responses"] == {
+        "ClientError": {
+            "content": {
+                "application/problem+json": {
+                    "schema": {
+                        "$ref": "#/components/schemas/Problem",
+                    },
+                    "example": {
+                        "title": "User facing error message.",
+                        "detail": "Additional error context.",
+                        "type": "client-error-type",
+                        "status": 400,
+                    },
+                },
+            },
+            "description": "Client Error",
+        },
+        "ServerError": {
+            "content": {
+                "application/problem+json": {
+                    "schema": {
+                        "$ref": "#/components/schemas/Problem",
+                    },
+                    "example": {
+                        "title": "User facing error message.",
+                        "detail": "Additional error context.",
+                        "type": "server-error-type",
+                        "status": 500,
+                    },
+                },
+            },
+            "description": "Server Error",
+        },
+    }
+
+
+async def test_customise_openapi_handles_no_components_no_paths():
+    app = FastAPI()
+
+    app.openapi = openapi.customise_openapi(app.openapi)
+
+    res = app.openapi()
+    assert res["paths"] == {}
+    assert "components" not in res
+
+
+async def test_customise_openapi_handles_no_components_no_422():
+    app = FastAPI()
+
+    @app.get("/status")
+    async def status() -> dict:
+        return {}
+
+    app.openapi = openapi.customise_openapi(app.openapi)
+
+    res = app.openapi()
+
+    assert res["components"]["schemas"]["HTTPValidationError"] == {
+        "properties": {
+            "title": {
+                "type": "string",
+                "title": "Problem title",
+            },
+            "type": {
+                "type": "string",
+                "title": "Problem type",
+            },
+            "status": {
+                "type": "integer",
+                "title": "Status code",
+            },
+            "errors": {
+                "type": "array",
+                "items": {
+                    "$ref": "#/components/schemas/ValidationError",
+                },
+            },
+        },
+        "type": "object",
+        "required": [
+            "type",
+            "title",
+            "status",
+            "errors",
+        ],
+        "title": "RequestValidationError",
+    }
+    assert "Problem" in res["components"]["schemas"]
+
+    assert res["paths"]["/status"]["get"]["responses"] == {
+        "200": {
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "additionalProperties": True,
+                        "title": "Response Status Status Get",
+                        "type": "object",
+                    },
+                },
+            },
+            "description": "Successful Response",
+        },
+        "4XX": {
+            "$ref": "#/components/responses/ClientError",
+        },
+        "5XX": {
+            "$ref": "#/components/responses/ServerError",
+        },
+    }
+
+
+async def test_customise_openapi_handles_security_components_no_422():
+    bearer_scheme = HTTPBearer(bearerFormat="JWT")
+    app = FastAPI()
+
+    @app.get("/status")
+    async def status(bearer: str = Depends(bearer_scheme)) -> dict:  # noqa: ARG001, FAST002
+        return {}
+
+    app.openapi = openapi.customise_openapi(app.openapi)
+
+    res = app.openapi()
+
+    assert res["components"]["schemas"]["HTTPValidationError"] == {
+        "properties": {
+            "title": {
+                "type": "string",
+                "title": "Problem title",
+            },
+            "type": {
+                "type": "string",
+                "title": "Problem type",
+            },
+            "status": {
+                "type": "integer",
+                "title": "Status code",
+            },
+            "errors": {
+                "type": "array",
+                "items": {
+                    "$ref": "#/components/schemas/ValidationError",
+                },
+            },
+        },
+        "type": "object",
+        "required": [
+            "type",
+            "title",
+            "status",
+            "errors",
+        ],
+        "title": "RequestValidationError",
+    }
+    assert "Problem" in res["components"]["schemas"]
+    assert "securitySchemes" in res["components"]
+
+    assert res["paths"]["/status"]["get"]["responses"] == {
+        "200": {
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "additionalProperties": True,
+                        "title": "Response Status Status Get",
+                        "type": "object",
+                    },
+                },
+            },
+            "description": "Successful Response",
+        },
+        "4XX": {
+            "$ref": "#/components/responses/ClientError",
+        },
+        "5XX": {
+            "$ref": "#/components/responses/ServerError",
+        },
+    }
+
+
+async def test_customise_openapi_generic_opt_out():
+    app = FastAPI()
+
+    app.openapi = openapi.customise_openapi(app.openapi, generic_defaults=False)
+
+    @app.get("/status")
+    async def status(_a: str) -> dict:
+        return {}
+
+    res = app.openapi()
+    assert res["components"]["schemas"]["HTTPValidationError"] == {
+        "properties": {
+            "title": {
+                "type": "string",
+                "title": "Problem title",
+            },
+            "type": {
+                "type": "string",
+                "title": "Problem type",
+            },
+            "status": {
+                "type": "integer",
+                "title": "Status code",
+            },
+            "errors": {
+                "type": "array",
+                "items": {
+                    "$ref": "#/components/schemas/ValidationError",
+                },
+            },
+        },
+        "type": "object",
+        "required": [
+            "type",
+            "title",
+            "status",
+            "errors",
+        ],
+        "title": "RequestValidationError",
+    }
+    assert "Problem" in res["components"]["schemas"]
+    assert "responses" not in res["components"]
+    assert "ValidationError" in res["components"]["schemas"]
+
+    assert res["paths"]["/status"]["get"]["responses"] == {
+        "200": {
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "additionalProperties": True,
+                        "title": "Response Status Status Get",
+                        "type": "object",
+                    },
+                },
+            },
+            "description": "Successful Response",
+        },
+        "422": {
+            "content": {
+                "application/problem+json": {
+                    "schema": {
+                        "$ref": "#/components/schemas/HTTPValidationError",
+                    },
+                },
+            },
+            "description": "Validation Error",
+        },
+    }
+
+
+async def test_customise_openapi_cached():
+    app = FastAPI()
+
+    app.openapi = openapi.customise_openapi(app.openapi, cache=True)
+
+    @app.get("/status")
+    async def status(_a: str) -> dict:
+        return {}
+
+    res = app.openapi()
+    with mock.patch.object(openapi, "problem_component") as problem_component:
+        assert app.openapi() is res
+
+    assert problem_component.call_count == 0
+    assert "application/problem+json" in res["paths"]["/status"]["get"]["responses"]["422"]["content"]
+
+
+async def test_customise_openapi_cached_routes_change():
+    app = FastAPI()
+
+    app.openapi = openapi.customise_openapi(app.openapi, cache=True)
+
+    @app.get("/status")
+    async def status() -> dict:
+        return {}
+
+    res = app.openapi()
+    assert "/other" not in res["paths"]
+
+    @app.get("/other")
+    async def other() -> dict:
+        return {}
+
+    res = app.openapi()
+
+    assert "/other" in res["paths"]
+    assert "4XX" in res["paths"]["/other"]["get"]["responses"]
+
+
+async def test_customise_openapi_cache_clear():
+    app = FastAPI()
+
+    app.openapi = openapi.customise_openapi(app.openapi, cache=True)
+
+    @app.get("/status")
+    async def status() -> dict:
+        return {}
+
+    res = app.openapi()
+    app.openapi.cache_clear()
+
+    assert app.openapi_schema is None
+    assert app.openapi() is not res
+
+
+async def test_add_exception_handler_cache_clear(app):
+    res = app.openapi()
+    app.openapi.cache_clear()
+
+    assert app.openapi_schema is None
+    assert app.openapi() is not res
+
+
+async def test_customise_openapi_generic_responses_shared():
+    app = FastAPI()
+
+    app.openapi = openapi.customise_openapi(app.openapi, documentation_uri_template="https://docs/errors/{type}")
+
+    @app.get("/status")
+    async def status() -> dict:
+        return {}
+
+    @app.get("/other")
+    async def other() -> dict:
+        return {}
+
+    with mock.patch.object(openapi, "problem_response", wraps=openapi.problem_response) as problem_response:
+        res = app.openapi()
+        app.openapi()
+
+    assert [c.kwargs["description"] for c in problem_response.call_args_list] == ["Client Error", "Server Error"]
+    for path in ["/status", "/other"]:
+        assert res["paths"][path]["get"]["responses"]["4XX"] == {"$ref": "#/components/responses/ClientError"}
+        assert res["paths"][path]["get"]["responses"]["5XX"] == {"$ref": "#/components/responses/ServerError"}
+    example = res["components"]["responses"]["ClientError"]["content"]["application/problem+json"]["example"]
+    assert example["type"] == "https://docs/errors/client-error-type"
+
+
+def make_router(prefix):
+    router = APIRouter(prefix=prefix)
+
+    class Item(BaseModel):
+        name: str
+
+    @router.post("/items")
+    async def create(item: Item) -> Item:
+        return item
+
+    @router.get("/items/{item_id}")
+    async def get(item_id: int) -> dict:
+        return {"id": item_id}
+
+    return router
+
+
+async def test_customise_openapi_incremental_matches_full():
+    full = FastAPI()
+    full.openapi = openapi.customise_openapi(full.openapi)
+    incremental = FastAPI()
+    incremental.openapi = openapi.customise_openapi(incremental.openapi, incremental=True)
+
+    for app in (full, incremental):
+        app.include_router(make_router("/a"))
+    incremental.openapi()
+
+    for app in (full, incremental):
+        app.include_router(make_router("/b"))
+
+        @app.put("/a/items")
+        async def update() -> dict:
+            return {}
+
+    assert incremental.openapi() == full.openapi()
+
+
+async def test_customise_openapi_incremental_processes_new_paths():
+    app = FastAPI()
+    app.openapi = openapi.customise_openapi(app.openapi, incremental=True)
+    app.include_router(make_router("/a"))
+
+    res = app.openapi()
+    app.include_router(make_router("/b"))
+
+    with mock.patch.object(openapi, "_customise_paths", wraps=openapi._customise_paths) as customise_paths:
+        assert app.openapi() is res
+        assert app.openapi() is res
+
+    assert customise_paths.call_count == 1
+    assert sorted(customise_paths.call_args[0][0]) == ["/b/items", "/b/items/{item_id}"]
+    assert app.openapi_schema is res
+    assert "4XX" in res["paths"]["/b/items"]["post"]["responses"]
+    assert "application/problem+json" in res["paths"]["/b/items"]["post"]["responses"]["422"]["content"]
+    assert res["components"]["schemas"]["HTTPValidationError"]["title"] == "RequestValidationError"
+
+
+async def test_customise_openapi_incremental_routes_removed():
+    app = FastAPI()
+    app.openapi = openapi.customise_openapi(app.openapi, incremental=True)
+    before = list(app.router.routes)
+    app.include_router(make_router("/a"))
+    added = app.router.routes[len(before) :]
+    app.include_router(make_router("/b"))
+
+    res = app.openapi()
+    app.router.routes = [route for route in app.router.routes if route not in added]
+
+    res = app.openapi()
+
+    assert sorted(res["paths"]) == ["/b/items", "/b/items/{item_id}"]
+    assert "4XX" in res["paths"]["/b/items"]["post"]["responses"]
+
+
+def make_module_router(module, **fields):
+    router = APIRouter(prefix=f"/{module}")
+    item = create_model("Item", __module__=module, **fields)
+
+    @router.post("/items")
+    async def create(body: item) -> dict:
+        return body.model_dump()
+
+    return router
+
+
+async def test_customise_openapi_incremental_conflicting_names():
+    full = FastAPI()
+    full.openapi = openapi.customise_openapi(full.openapi)
+    incremental = FastAPI()
+    incremental.openapi = openapi.customise_openapi(incremental.openapi, incremental=True)
+
+    for app in (full, incremental):
+        app.include_router(make_module_router("m1", a=(int, ...)))
+    incremental.openapi()
+
+    for app in (full, incremental):
+        app.include_router(make_module_router("m2", b=(str, ...)))
+    res = incremental.openapi()
+
+    assert res == full.openapi()
+    ref = res["paths"]["/m1/items"]["post"]["requestBody"]["content"]["application/json"]["schema"]["$ref"]
+    assert res["components"]["schemas"][ref.rsplit("/", 1)[1]]["required"] == ["a"]
+
+
+async def test_customise_openapi_incremental_route_removed_directly():
+    app = FastAPI()
+    app.openapi = openapi.customise_openapi(app.openapi, incremental=True)
+
+    @app.get("/a")
+    async def a() -> dict:
+        return {}
+
+    @app.get("/b")
+    async def b() -> dict:
+        return {}
+
+    app.openapi()
+    app.router.routes = [route for route in app.router.routes if getattr(route, "path", None) != "/a"]
+
+    assert sorted(app.openapi()["paths"]) == ["/b"]
+
+
+async def test_customise_openapi_incremental_cache_clear():
+    app = FastAPI()
+    app.openapi = openapi.customise_openapi(app.openapi, incremental=True)
+    app.include_router(make_router("/a"))
+
+    res = app.openapi()
+    app.openapi.cache_clear()
+
+    assert app.openapi() is not res
+    assert app.openapi() == res
+
+
+async def test_customise_openapi_media_types():
+    eh = handler.new_exception_handler(
+        media_types={"application/problem+cbor": lambda _content: b""},
+        shared_swagger_responses=True,
+    )
+    app = FastAPI()
+    handler.add_exception_handler(app, eh)
+    shared = eh.generate_swagger_response(UserNotFoundError)
+    inline = eh.generate_swagger_response(UserNotFoundError("missing"))
+
+    @app.get("/a", responses={404: shared})
+    def a(item_id: int) -> str:
+        return str(item_id)
+
+    @app.get("/b", responses={404: inline})
+    def b() -> str:
+        return ""
+
+    res = app.openapi()
+
+    media_types = ["application/problem+json", "application/problem+cbor"]
+    responses = res["components"]["responses"]
+    assert list(responses["ClientError"]["content"]) == media_types
+    assert list(responses["UserNotFoundError"]["content"]) == media_types
+    assert list(res["paths"]["/a"]["get"]["responses"]["422"]["content"]) == media_types
+    assert list(res["paths"]["/b"]["get"]["responses"]["404"]["content"]) == media_types
+    # Cached swagger responses are not modified.
+    assert list(eh.swagger_responses["UserNotFoundError"]["content"]) == ["application/problem+json"]
+    assert list(inline["content"]) == ["application/problem+json"]
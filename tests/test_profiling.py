@@ -0,0 +1,91 @@
+import http
+from unittest import mock
+
+from fastapi_problem import error, handler, profiling
+from fastapi_problem.cors import CorsConfiguration
+
+
+class UserNotFoundError(error.NotFoundProblem):
+    title = "User not found."
+
+
+def test_percentile():
+    samples = [float(i) for i in range(1, 101)]
+
+    # Samples are 1-100, so each percentile is its own sample.
+    assert [profiling.percentile(samples, p) for p in (50, 99, 100)] == [50.0, 99.0, 100.0]
+    assert profiling.percentile([1.0], 1) == 1.0
+    assert profiling.percentile([], 50) == 0.0
+
+
+def test_stage_profiler_stats():
+    profiler = profiling.StageProfiler(maxlen=2)
+
+    profiler.record("dispatch", 1.0)
+    profiler.record("dispatch", 2.0)
+    profiler.record("dispatch", 3.0)
+    profiler.record("encode", 0.5)
+
+    assert profiler.stats() == {
+        "dispatch": {"count": 2, "p50": 2.0, "p90": 3.0, "p99": 3.0, "max": 3.0},
+        "encode": {"count": 1, "p50": 0.5, "p90": 0.5, "p99": 0.5, "max": 0.5},
+    }
+
+
+def test_stage_profiler_report():
+    profiler = profiling.StageProfiler()
+    profiler.record("dispatch", 0.000001)
+
+    assert profiler.report() == (
+        "stage         count        p50        p90        p99        max\n"
+        "dispatch          1        1.0        1.0        1.0        1.0"
+    )
+
+    profiler.clear()
+    assert profiler.stats() == {}
+
+
+def test_handler_records_stages():
+    def pre_hook(_request, _exc):
+        pass
+
+    profiler = mock.Mock()
+    eh = handler.new_exception_handler(
+        cors=CorsConfiguration(allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=False),
+        pre_hooks=[pre_hook, handler.BackgroundHook(pre_hook)],
+        post_hooks=[handler.StripExtrasPostHook()],
+        profiler=profiler,
+    )
+
+    response = eh(mock.Mock(headers={}), UserNotFoundError("a"))
+
+    assert response.status_code == http.HTTPStatus.NOT_FOUND
+    assert [c[0][0] for c in profiler.record.call_args_list] == [
+        "pre_hook:pre_hook",
+        "dispatch",
+        "marshal",
+        "encode",
+        "post_hook:CorsPostHook",
+        "post_hook:StripExtrasPostHook",
+    ]
+    assert isinstance(eh.pre_hooks[1], handler.BackgroundHook)
+
+
+async def test_async_handler_records_stages():
+    async def pre_hook(_request, _exc):
+        pass
+
+    profiler = profiling.StageProfiler()
+    eh = handler.new_exception_handler(pre_hooks=[pre_hook], profiler=profiler)
+
+    assert isinstance(eh, handler.AsyncExceptionHandler)
+
+    await eh(mock.Mock(), UserNotFoundError("a"))
+
+    assert list(profiler.stats()) == ["pre_hook:pre_hook", "dispatch", "marshal", "encode"]
+
+
+def test_no_profiler_not_instrumented():
+    eh = handler.new_exception_handler()
+
+    assert eh._resolve.__func__ is handler.ExceptionHandler._resolve
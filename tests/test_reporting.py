@@ -0,0 +1,348 @@
+import http
+import threading
+from unittest import mock
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from fastapi_problem import error, handler, reporting
+
+
+class SomethingWrongError(error.ServerProblem):
+    title = "This is an error."
+
+
+def test_log_reporter_logs_immediately():
+    logger = mock.Mock()
+    exc = RuntimeError("bad")
+
+    eh = handler.new_exception_handler(reporter=reporting.LogReporter(logger))
+    eh(mock.Mock(), exc)
+
+    assert logger.exception.call_args == mock.call(
+        "Unhandled exception occurred.",
+        exc_info=(RuntimeError, exc, None),
+    )
+
+
+def test_default_reporter_from_logger():
+    logger = mock.Mock()
+
+    eh = handler.new_exception_handler(logger=logger)
+
+    assert isinstance(eh.reporter, reporting.LogReporter)
+    assert eh.reporter.logger is logger
+
+
+def test_no_logger_no_reporter():
+    eh = handler.new_exception_handler()
+
+    assert eh.reporter is None
+
+
+def test_client_errors_not_reported():
+    reporter = mock.Mock()
+
+    eh = handler.new_exception_handler(reporter=reporter)
+    eh(mock.Mock(), error.BadRequestProblem("bad"))
+
+    assert reporter.call_count == 0
+
+
+def test_reporter_receives_final_response():
+    reporter = mock.Mock()
+
+    def post_hook(content, _request, response):
+        response.headers["x-post"] = "1"
+        return content, response
+
+    eh = handler.new_exception_handler(reporter=reporter, post_hooks=[post_hook])
+    exc = SomethingWrongError("bad")
+    response = eh(mock.Mock(), exc)
+
+    problem, exc_, response_ = reporter.call_args[0]
+    assert problem is exc
+    assert exc_ is exc
+    assert response_ is response
+    assert response_.headers["x-post"] == "1"
+
+
+async def test_background_reporter_logs_after_response():
+    logger = mock.Mock()
+    exc = RuntimeError("bad")
+
+    eh = handler.new_exception_handler(reporter=reporting.BackgroundReporter(logger))
+    response = eh(mock.Mock(), exc)
+
+    assert logger.exception.call_count == 0
+
+    await response.background()
+
+    assert logger.exception.call_args == mock.call(
+        "Unhandled exception occurred.",
+        exc_info=(RuntimeError, exc, None),
+    )
+
+
+class TestQueueReporter:
+    def test_logs_from_worker(self):
+        logger = mock.Mock()
+        reporter = reporting.QueueReporter(logger)
+        exc = RuntimeError("bad")
+
+        eh = handler.new_exception_handler(reporter=reporter)
+        eh(mock.Mock(), exc)
+        reporter.join()
+
+        assert logger.exception.call_args == mock.call(
+            "Unhandled exception occurred.",
+            exc_info=(RuntimeError, exc, None),
+        )
+        assert reporter.depth == 0
+        assert reporter.dropped == 0
+        reporter.close()
+
+    def test_drops_when_full(self):
+        release = threading.Event()
+        logger = mock.Mock()
+        logger.exception.side_effect = lambda *_args, **_kwargs: release.wait(1)
+        maxsize, raised = 2, 6
+        reporter = reporting.QueueReporter(logger, maxsize=maxsize)
+
+        eh = handler.new_exception_handler(reporter=reporter)
+        for i in range(raised):
+            eh(mock.Mock(), RuntimeError(str(i)))
+
+        # One in progress in the worker (or still queued), remainder dropped.
+        assert reporter.depth <= maxsize
+        assert reporter.dropped >= raised - maxsize - 1
+
+        release.set()
+        reporter.close()
+        assert logger.exception.call_count + reporter.dropped == raised
+
+    def test_close_flushes(self):
+        logger = mock.Mock()
+        reporter = reporting.QueueReporter(logger)
+
+        excs = [RuntimeError(str(i)) for i in range(3)]
+        for exc in excs:
+            reporter(SomethingWrongError(str(exc)), exc, mock.Mock())
+        reporter.close()
+
+        assert logger.exception.call_args_list == [
+            mock.call("This is an error.", exc_info=(RuntimeError, exc, None)) for exc in excs
+        ]
+        assert reporter.depth == 0
+
+    def test_close_without_worker(self):
+        reporter = reporting.QueueReporter(mock.Mock())
+
+        reporter.close()
+
+    def test_worker_restarted_after_fork(self):
+        logger = mock.Mock()
+        reporter = reporting.QueueReporter(logger)
+        reporter(SomethingWrongError("bad"), RuntimeError("bad"), mock.Mock())
+        worker = reporter._worker
+
+        with mock.patch("os.getpid", return_value=-1):
+            reporter(SomethingWrongError("bad"), RuntimeError("bad"), mock.Mock())
+
+        assert reporter._worker is not worker
+        reporter.join()
+        assert [c.args[0] for c in logger.exception.call_args_list] == ["This is an error.", "This is an error."]
+
+
+@pytest.mark.parametrize("reporter_cls", [reporting.BackgroundReporter, reporting.QueueReporter])
+async def test_deferred_reporter_in_app(reporter_cls):
+    logger = mock.Mock()
+    reporter = reporter_cls(logger)
+    app = FastAPI()
+    handler.add_exception_handler(app, handler.new_exception_handler(reporter=reporter))
+
+    @app.get("/error")
+    async def raise_error() -> dict:
+        msg = "bad"
+        raise RuntimeError(msg)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    client = httpx.AsyncClient(transport=transport, base_url="https://test")
+    r = await client.get("/error")
+
+    if isinstance(reporter, reporting.QueueReporter):
+        reporter.close()
+
+    assert r.status_code == http.HTTPStatus.INTERNAL_SERVER_ERROR
+    assert logger.exception.call_count == 1
+
+
+def raise_runtime_error(msg="bad"):
+    raise RuntimeError(msg)
+
+
+def raise_from_line():
+    try:
+        raise_runtime_error()
+    except RuntimeError as exc:
+        return exc
+
+
+def raise_from_other_line():
+    try:
+        raise_runtime_error("other")
+    except RuntimeError as exc:
+        return exc
+
+
+def assert_unlocked(reporter):
+    assert not reporter._lock.locked()
+
+
+class TestDeduplicatingReporter:
+    def test_fingerprint_uses_raising_frame(self):
+        first, second = raise_from_line(), raise_from_other_line()
+
+        assert reporting.fingerprint(first) == reporting.fingerprint(second)
+        assert reporting.fingerprint(first)[0] is RuntimeError
+        assert reporting.fingerprint(first)[1] == __file__
+
+    def test_fingerprint_without_traceback(self):
+        assert reporting.fingerprint(ValueError("bad")) == (ValueError, "", 0)
+
+    def test_requires_logger(self):
+        with pytest.raises(ValueError, match="A logger is required"):
+            reporting.DeduplicatingReporter(mock.Mock(spec=[]))
+
+    def test_first_reported_rest_summarised(self):
+        logger = mock.Mock()
+        now = [0.0]
+        first, raised = 2, 10
+        reporter = reporting.DeduplicatingReporter(
+            reporting.LogReporter(logger),
+            first=first,
+            interval=60,
+            clock=lambda: now[0],
+        )
+
+        for _ in range(raised):
+            reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+
+        assert logger.exception.call_count == first
+        assert logger.warning.call_count == 0
+
+        now[0] = 61.0
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+
+        assert logger.warning.call_args[0][:4] == (
+            "Suppressed %d identical errors in %ds: %s (%s at %s:%d)",
+            raised - first,
+            61.0,
+            "This is an error.",
+        )
+        # New window reports in full again.
+        assert logger.exception.call_count == first + 1
+
+    def test_distinct_exceptions_reported(self):
+        logger = mock.Mock()
+        reporter = reporting.DeduplicatingReporter(reporting.LogReporter(logger))
+
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        reporter(SomethingWrongError("bad"), ValueError("bad"), mock.Mock())
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+
+        assert [c.kwargs["exc_info"][0] for c in logger.exception.call_args_list] == [RuntimeError, ValueError]
+
+    def test_eviction_summarises(self):
+        logger = mock.Mock()
+        reporter = reporting.DeduplicatingReporter(
+            reporting.LogReporter(logger),
+            max_fingerprints=1,
+            clock=lambda: 0.0,
+        )
+
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        reporter(SomethingWrongError("bad"), ValueError("bad"), mock.Mock())
+
+        assert len(reporter._windows) == 1
+        assert logger.warning.call_args[0][1] == 1
+
+    def test_flush(self):
+        logger = mock.Mock()
+        reporter = reporting.DeduplicatingReporter(reporting.LogReporter(logger), clock=lambda: 0.0)
+
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        reporter.flush()
+        reporter.flush()
+
+        assert logger.warning.call_count == 1
+        assert reporter._windows == {}
+
+    def test_expire_summarises_ended_windows(self):
+        logger = mock.Mock()
+        now = [0.0]
+        reporter = reporting.DeduplicatingReporter(reporting.LogReporter(logger), interval=60, clock=lambda: now[0])
+
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        now[0] = 30.0
+        reporter(SomethingWrongError("bad"), ValueError("bad"), mock.Mock())
+        reporter(SomethingWrongError("bad"), ValueError("bad"), mock.Mock())
+
+        now[0] = 60.0
+        reporter._expire()
+
+        assert logger.warning.call_args[0][1:3] == (1, 60.0)
+        assert logger.warning.call_count == 1
+        assert list(reporter._windows) == [(ValueError, "", 0)]
+
+    def test_timer_summarises_without_new_occurrences(self):
+        summarised = threading.Event()
+        logger = mock.Mock()
+        logger.warning.side_effect = lambda *_args, **_kwargs: summarised.set()
+        reporter = reporting.DeduplicatingReporter(reporting.LogReporter(logger), interval=0.01)
+
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+
+        assert summarised.wait(1)
+        reporter.close()
+        assert logger.warning.call_args[0][1] == 1
+
+    def test_summary_logged_without_lock(self):
+        logger = mock.Mock()
+        now = [0.0]
+        reporter = reporting.DeduplicatingReporter(reporting.LogReporter(logger), interval=60, clock=lambda: now[0])
+        logger.warning.side_effect = lambda *_args, **_kwargs: assert_unlocked(reporter)
+
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        now[0] = 61.0
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+
+        assert logger.warning.call_count == 1
+
+    def test_close_stops_timer_and_flushes(self):
+        logger = mock.Mock()
+        reporter = reporting.DeduplicatingReporter(reporting.LogReporter(logger), clock=lambda: 0.0)
+
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        reporter(SomethingWrongError("bad"), raise_from_line(), mock.Mock())
+        timer = reporter._timer
+        reporter.close()
+
+        assert timer is not None
+        assert not timer.is_alive()
+        assert logger.warning.call_count == 1
+
+    def test_wraps_deferred_reporter(self):
+        logger = mock.Mock()
+        response = mock.Mock(background=None)
+        reporter = reporting.DeduplicatingReporter(reporting.BackgroundReporter(logger))
+
+        reporter(SomethingWrongError("bad"), raise_from_line(), response)
+
+        assert response.background is not None
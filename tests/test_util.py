@@ -1,6 +1,9 @@
 import sys
+from unittest import mock
 
 import pytest
+from starlette.background import BackgroundTask
+from starlette.responses import Response
 
 from fastapi_problem import util
 
@@ -35,3 +38,33 @@ def test_convert_status_code_legacy(status_code, title, code):
 @pytest.mark.skipif(sys.version_info < (3, 13), reason="python version too old")
 def test_convert_status_code(status_code, title, code):
     assert util.convert_status_code(status_code) == (title, code)
+
+
+async def test_add_background_task():
+    m = mock.Mock()
+    response = Response()
+
+    util.add_background_task(response, m, "first")
+    util.add_background_task(response, m, "second")
+    await response.background()
+
+    assert m.call_args_list == [mock.call("first"), mock.call("second")]
+
+
+async def test_add_background_task_existing_task():
+    m = mock.Mock()
+    response = Response(background=BackgroundTask(m, "existing"))
+
+    util.add_background_task(response, m, "added")
+    await response.background()
+
+    assert m.call_args_list == [mock.call("existing"), mock.call("added")]
+
+
+def test_parse_quality_values():
+    assert util.parse_quality_values("gzip, br;q=0.5, *;q=0 ,, deflate;q=bad") == {
+        "gzip": 1.0,
+        "br": 0.5,
+        "*": 0.0,
+        "deflate": 0.0,
+    }